@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+#
+# Measure what execution budgets cost: run the same programs without a budget, and with
+# a budget whose limits are never reached, and compare the times.
+#
+# A program with a budget always runs in the tree walker, so the compiler is disabled
+# for both runs, to measure the checks alone.
+#
+# Usage: misc/budget_bench.py [--repeat N] [file.pr ...]
+#
+
+import os
+import sys
+import time
+import argparse
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+from procyon import Interpreter, compiler
+from procyon.budget import Budget
+
+PROGRAMS = {
+    'fib': "func fib(n) { if n < 2 { return n; } return fib(n-1) + fib(n-2); } fib(20);",
+    'loop': "i = 0; t = 0; while i < 100000 { t = t + i * i % 7; i = i + 1; } t;",
+    'strings': 's = ""; i = 0; while i < 20000 { s = s + "x"; i = i + 1; } i;',
+}
+
+def best_time(program, budget, repeat):
+    best = None
+    for i in range(repeat):
+        interp = Interpreter()
+        start = time.perf_counter()
+        interp.evaluate(program, budget=budget)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    argparser = argparse.ArgumentParser(description="Measure the overhead of budgets.")
+    argparser.add_argument('files', nargs='*', metavar='file.pr',
+                           help="programs to run (default: a few built-in ones)")
+    argparser.add_argument('--repeat', type=int, default=5,
+                           help="runs per program; the best time is used (default 5)")
+    args = argparser.parse_args()
+
+    programs = PROGRAMS
+    if args.files:
+        programs = {}
+        for filename in args.files:
+            with open(filename) as f:
+                programs[filename] = f.read()
+
+    compiler.JIT_THRESHOLD = compiler.OSR_THRESHOLD = 0
+    budget = Budget(steps=10 ** 12, seconds=3600, int_bits=10 ** 9, string_length=10 ** 9)
+    print("{:20} {:>10} {:>10} {:>9}".format("program", "no budget", "budget", "overhead"))
+    for name, program in programs.items():
+        plain = best_time(program, None, args.repeat)
+        budgeted = best_time(program, budget, args.repeat)
+        print("{:20} {:9.3f}s {:9.3f}s {:8.1f}%".format(
+            name, plain, budgeted, 100 * (budgeted - plain) / plain))
+
+if __name__ == '__main__':
+    main()
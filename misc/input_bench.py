@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+#
+# Measure how fast programs read numbers: run procyon.py on programs that sum N ints fed
+# to their standard input through a pipe, one per line, and report the ints read per
+# second. input_int("") reads them a line at a time; read_int() from the input source's
+# buffer, with a counted loop (as input_int needs) or until eof().
+#
+# The times include starting procyon.py, and writing the input to the pipe.
+#
+# Usage: misc/input_bench.py [--count N] [--repeat N]
+#
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+PROCYON = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'procyon.py')
+
+PROGRAMS = {
+    'input_int': 'n = 0; t = 0; while n < {count} {{ t += input_int(""); n += 1; }} print(t);',
+    'read_int': 'n = 0; t = 0; while n < {count} {{ t += read_int(); n += 1; }} print(t);',
+    'read_int/eof': 't = 0; while !eof() {{ t += read_int(); }} print(t);',
+}
+
+def best_time(filename, data, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, PROCYON, filename], input=data,
+                                stdout=subprocess.PIPE, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result.stdout
+
+def main():
+    argparser = argparse.ArgumentParser(description="Measure the throughput of input.")
+    argparser.add_argument('--count', type=int, default=10 ** 7,
+                           help="ints to read (default 10000000)")
+    argparser.add_argument('--repeat', type=int, default=1,
+                           help="runs per program; the best time is used (default 1)")
+    args = argparser.parse_args()
+
+    data = "".join("{}\n".format(i) for i in range(args.count)).encode('ascii')
+    expected = "{}\n".format(args.count * (args.count - 1) // 2).encode('ascii')
+
+    print("{:15} {:>10} {:>14}".format("program", "time", "ints/second"))
+    for name, program in PROGRAMS.items():
+        fd, filename = tempfile.mkstemp(suffix='.pr')
+        with os.fdopen(fd, 'w') as f:
+            f.write(program.format(count=args.count))
+        try:
+            elapsed, output = best_time(filename, data, args.repeat)
+        finally:
+            os.remove(filename)
+        if output != expected:
+            sys.exit("{}: wrong sum {!r}".format(name, output))
+        print("{:15} {:9.3f}s {:14,.0f}".format(name, elapsed, args.count / elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+#
+# Measure the throughput of programs that print a lot, with the different output sinks:
+# buffered and unbuffered (a write per print(), as before sinks existed) writes to a
+# file descriptor, a file object, and memory. Output goes to os.devnull unless --output
+# names a file.
+#
+# The escapes and literals programs print string literals in a loop; their escape
+# sequences are decoded once, by the lexer.
+#
+# Usage: misc/print_bench.py [--lines N] [--repeat N] [--output FILE]
+#
+
+import os
+import sys
+import time
+import argparse
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+from procyon import Interpreter
+from procyon.output import FDSink, FileSink, MemorySink
+
+PROGRAMS = {
+    'numbers': "i = 0; while i < {lines} {{ print(i); i += 1; }}",
+    'words': 'i = 0; while i < {lines} {{ print("line", i, "of", {lines}, i / 7); i += 1; }}',
+    'escapes': 'i = 0; while i < {lines} {{ print("a\\tb\\\\c", i); i += 1; }}',
+    'literals': ('i = 0; while i < {lines} {{ print("Lorem ipsum", "dolor sit amet,", '
+                 '"consectetur\\tadipiscing\\u00e9lit"); i += 1; }}'),
+}
+
+def best_time(program, make_sink, repeat):
+    best = None
+    for i in range(repeat):
+        interp = Interpreter(output=make_sink())
+        start = time.perf_counter()
+        interp.evaluate(program)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    argparser = argparse.ArgumentParser(description="Measure print() throughput.")
+    argparser.add_argument('--lines', type=int, default=200000,
+                           help="lines printed by each program (default 200000)")
+    argparser.add_argument('--repeat', type=int, default=3,
+                           help="runs per program; the best time is used (default 3)")
+    argparser.add_argument('--output', default=os.devnull,
+                           help="file to print to (default: {})".format(os.devnull))
+    args = argparser.parse_args()
+
+    fd = os.open(args.output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    file = open(args.output, 'w')
+    sinks = [
+        ('fd, unbuffered', lambda: FDSink(fd, 0)),
+        ('fd, buffered', lambda: FDSink(fd)),
+        ('file, unbuffered', lambda: FileSink(file, 0)),
+        ('file, buffered', lambda: FileSink(file)),
+        ('memory', MemorySink),
+    ]
+
+    print("{:10} {:18} {:>9} {:>14}".format("program", "sink", "time", "lines/second"))
+    try:
+        for name, program in PROGRAMS.items():
+            program = program.format(lines=args.lines)
+            for sink_name, make_sink in sinks:
+                elapsed = best_time(program, make_sink, args.repeat)
+                print("{:10} {:18} {:8.3f}s {:14,.0f}".format(
+                    name, sink_name, elapsed, args.lines / elapsed))
+    finally:
+        file.close()
+        os.close(fd)
+
+if __name__ == '__main__':
+    main()
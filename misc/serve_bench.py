@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+#
+# Benchmark a Procyon server (procyon.py --serve SOCKET): send the same program over
+# and over from a number of concurrent clients, and report requests/second and latency.
+#
+# Usage: misc/serve_bench.py [--clients N] [--requests N] [--program file.pr] SOCKET
+#
+# Each client keeps its connection open, and a server worker serves one connection at a
+# time, so use no more clients than the server has workers (procyon.py --jobs).
+#
+
+import os
+import sys
+import time
+import argparse
+import threading
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+from procyon.server import Client
+
+DEFAULT_PROGRAM = """
+func fib(n) { if n < 2 { return n; } return fib(n-1) + fib(n-2); }
+fib(15);
+"""
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+def run_client(path, program, requests, latencies, errors):
+    with Client(path) as client:
+        for i in range(requests):
+            start = time.perf_counter()
+            entry = client.run(program)
+            latencies.append(time.perf_counter() - start)
+            if 'error' in entry:
+                errors.append(entry['error'])
+
+def main():
+    argparser = argparse.ArgumentParser(description="Benchmark a Procyon server.")
+    argparser.add_argument('socket', help="the server's Unix socket")
+    argparser.add_argument('--clients', type=int, default=2,
+                           help="number of concurrent connections (default 2)")
+    argparser.add_argument('--requests', type=int, default=250,
+                           help="number of programs each client sends (default 250)")
+    argparser.add_argument('--program', metavar='FILE',
+                           help="the program to send (default: a small fib() program)")
+    args = argparser.parse_args()
+
+    program = DEFAULT_PROGRAM
+    if args.program:
+        with open(args.program) as f:
+            program = f.read()
+
+    latencies, errors = [], []
+    threads = [threading.Thread(target=run_client,
+                                args=(args.socket, program, args.requests, latencies, errors))
+               for i in range(args.clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print("{} requests from {} clients in {:.2f} s: {:.1f} requests/s".format(
+        len(latencies), args.clients, elapsed, len(latencies) / elapsed))
+    print("latency: p50 {:.2f} ms, p90 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(
+        *(1000 * percentile(latencies, p) for p in (50, 90, 99, 100))))
+    if errors:
+        print("{} programs failed; the first error was {}".format(len(errors), errors[0]))
+
+if __name__ == '__main__':
+    main()
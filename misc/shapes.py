@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+#
+# Count node shapes over a set of Procyon programs, to find out which statement
+# and expression patterns are common enough to deserve a superinstruction.
+#
+# Usage: misc/shapes.py [--depth N] [--top N] [--optimized] <file.pr | directory> ...
+#
+
+import os
+import sys
+import argparse
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+
+from collections import Counter
+from procyon.interpreter import parse, __functions as builtins
+from procyon.optimizer import optimize
+from procyon.analysis import shape_counts
+
+def program_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for f in sorted(files):
+                    if f.endswith('.pr'):
+                        yield os.path.join(root, f)
+        else:
+            yield path
+
+def main():
+    argparser = argparse.ArgumentParser(description="Count AST node shapes in Procyon programs.")
+    argparser.add_argument('paths', nargs='+', help=".pr files, or directories to search")
+    argparser.add_argument('--depth', type=int, default=2, help="shape depth (default 2)")
+    argparser.add_argument('--top', type=int, default=30, help="number of shapes to show")
+    argparser.add_argument('--optimized', action='store_true',
+                           help="count shapes after optimization, rather than as parsed")
+    args = argparser.parse_args()
+
+    counts = Counter()
+    for filename in program_files(args.paths):
+        with open(filename) as f:
+            trees = parse(f.read())
+        if args.optimized:
+            trees = optimize(trees, builtins)
+        counts.update(shape_counts(trees, args.depth))
+
+    total = sum(counts.values())
+    for shape, n in counts.most_common(args.top):
+        print("{:8} {:6.2f}%  {}".format(n, 100 * n / total, shape))
+
+if __name__ == '__main__':
+    main()
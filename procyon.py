@@ -4,19 +4,119 @@
 
 # See README.md for information and such.
 
-from procyon import evaluate, evaluate_command
+from procyon import evaluate, evaluate_command, compiler, memo
+from procyon.profile import Profile
+from procyon.budget import Budget
+from procyon.inputs import MappedSource
 from procyon.common import *  # Exceptions
 
 import sys
 import re
 import glob
+import argparse
+import json
+import sqlite3
 from stat import S_ISDIR
 import os
 from os import _exit
 
-def usage():
-    print("""Procyon interpreter version {}, {}
-Usage: {} <file.pr>""".format(VERSION, DATE, sys.argv[0]), file=sys.stderr)
+def parse_args():
+    argparser = argparse.ArgumentParser(
+        description="Procyon interpreter version {}, {}".format(VERSION, DATE))
+    argparser.add_argument('files', nargs='*', metavar='file.pr',
+                           help="program to run; starts the REPL if omitted. With --jobs, "
+                                "any number of programs and directories of programs; with "
+                                "--serve, libraries for the programs the server runs")
+    argparser.add_argument('-O', '--optimize', type=int, default=1, metavar='LEVEL',
+                           help="optimization level: 0 (none), 1 (default) or 2")
+    argparser.add_argument('--jit-threshold', type=int, default=compiler.JIT_THRESHOLD,
+                           metavar='CALLS',
+                           help="compile functions after this many calls; 0 disables "
+                                "compilation (default: %(default)s)")
+    argparser.add_argument('--osr-threshold', type=int, default=compiler.OSR_THRESHOLD,
+                           metavar='ITERATIONS',
+                           help="compile loops after this many iterations; 0 disables "
+                                "compilation (default: %(default)s)")
+    argparser.add_argument('--debug-jit', action='store_true',
+                           help="log compiled functions, loops and deoptimizations to stderr")
+    argparser.add_argument('--memo-db', metavar='FILE',
+                           help="keep the results of memo functions in FILE across runs")
+    argparser.add_argument('--memo-db-size', type=int, default=memo.MEMO_DB_SIZE,
+                           metavar='RESULTS',
+                           help="maximum number of results in the memo database; the least "
+                                "recently used ones are removed (default: %(default)s)")
+    argparser.add_argument('--max-steps', type=int, metavar='N',
+                           help="stop programs after they have evaluated N nodes")
+    argparser.add_argument('--timeout', type=float, metavar='SECONDS',
+                           help="stop programs that run for longer than this")
+    argparser.add_argument('--max-int-bits', type=int, metavar='BITS',
+                           help="stop programs that calculate ints larger than this")
+    argparser.add_argument('--max-string-length', type=int, metavar='CHARACTERS',
+                           help="stop programs that build strings longer than this")
+    argparser.add_argument('--input', metavar='FILE',
+                           help="read the program's input (input_* and read_*) from FILE "
+                                "instead of stdin; the file is memory-mapped")
+    argparser.add_argument('-j', '--jobs', type=int, metavar='N',
+                           help="batch mode: run the programs in N processes, and write a "
+                                "JSON report of their results and errors. With --serve, the "
+                                "number of worker processes")
+    argparser.add_argument('--report', metavar='FILE',
+                           help="where batch mode writes its report (default: stdout)")
+    argparser.add_argument('--serve', metavar='SOCKET',
+                           help="server mode: run programs sent over the Unix socket SOCKET")
+    argparser.add_argument('--profile-out', metavar='FILE',
+                           help="record a profile of the program's run to FILE")
+    argparser.add_argument('--profile-in', metavar='FILE',
+                           help="optimize using a profile recorded by an earlier run")
+    args = argparser.parse_args()
+    limits = (args.max_steps, args.timeout, args.max_int_bits, args.max_string_length)
+    args.budget = Budget(*limits) if any(limit is not None for limit in limits) else None
+    if args.serve is not None:
+        if args.jobs is not None and args.jobs < 1:
+            argparser.error("--jobs requires a number of processes")
+        return args
+    if args.jobs is None and len(args.files) > 1:
+        argparser.error("use --jobs to run several programs")
+    if args.jobs is not None and (args.jobs < 1 or not args.files):
+        argparser.error("--jobs requires a number of processes, and programs to run")
+    return args
+
+def run_batch(args):
+    """ Batch mode: run many programs in parallel, and write the report. """
+    from procyon.batch import run_batch
+    report = run_batch(args.files, args.jobs, args.optimize, args.budget)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    return 1 if report['failed'] else 0
+
+def run_server(args):
+    """ Server mode: run programs sent over a Unix socket, until stopped. """
+    from procyon.server import serve
+
+    def ready():
+        print("Serving on {} with {} workers".format(args.serve, args.jobs or os.cpu_count()),
+              file=sys.stderr)
+
+    try:
+        serve(args.serve, args.files, args.jobs, args.optimize, ready, args.budget)
+    except ProcyonException as e:
+        (lineno, pos), ex_msg = e.args if len(e.args) == 2 else ((0, 0), str(e))
+        print("Unable to load library {}:{}:{}: {}".format(e.filename, lineno, pos, ex_msg),
+              file=sys.stderr)
+        return 1
+    except (IOError, OSError) as e:
+        print("Unable to start the server: {}".format(e), file=sys.stderr)
+        return 1
+    return 0
+
+def close_memo_db():
+    if memo.store is not None:
+        memo.store.close()
+        memo.store = None
 
 def print_error_pos(e):
     """ Prints out the line that caused an error, with a ^ pointing to the error location. """
@@ -71,18 +171,42 @@ def complete(text, state):
     files.append(None)
     return files[state]
 
-filename = None
+args = parse_args()
+compiler.JIT_THRESHOLD = args.jit_threshold
+compiler.OSR_THRESHOLD = args.osr_threshold
+compiler.DEBUG_JIT = args.debug_jit
+if args.serve is not None:
+    sys.exit(run_server(args))
+if args.jobs is not None:
+    sys.exit(run_batch(args))
+filename = args.files[0] if args.files else None
+
+if args.memo_db:
+    try:
+        memo.store = memo.MemoStore(args.memo_db, args.memo_db_size)
+    except sqlite3.Error as e:
+        print("Unable to open memo database: {}".format(e), file=sys.stderr)
+        _exit(1)
+
+profile_out = Profile() if args.profile_out and filename else None
+profile_in = None
+if args.profile_in and filename:
+    try:
+        profile_in = Profile.load(args.profile_in)
+    except (IOError, OSError, ValueError) as e:
+        print("Unable to read profile: {}".format(e), file=sys.stderr)
 
-if len(sys.argv) == 1:
+input_source = None
+if args.input:
+    try:
+        input_source = MappedSource(args.input)
+    except (IOError, OSError) as e:
+        print("Unable to open input file: {}".format(e), file=sys.stderr)
+        _exit(1)
+
+if filename is None:
     # REPL
     print("Procyon interpreter version " + VERSION + ", " + DATE)
-elif len(sys.argv) == 2:
-    # Interpret a file
-    filename = sys.argv[1]
-else:
-    # Invalid command line
-    usage()
-    sys.exit(1)
 
 if not filename:
     # REPL; set up readline
@@ -147,6 +271,7 @@ while True:
                 continue
             except EOFError:
                 print("^D")
+                close_memo_db()
                 _exit(0)
 
         results = None
@@ -163,7 +288,7 @@ while True:
                     continue
 
                 filetype = "import"
-                evaluate(program)
+                evaluate(program, optimize=args.optimize)
 
                 # If we get here, the evaluation was successful, so clean up
                 # prior to looping again
@@ -177,14 +302,22 @@ while True:
 
         elif filename is None:
             # Save results for the REPL...
-            results = evaluate(program, last=last_result)
+            results = evaluate(program, last=last_result, optimize=args.optimize,
+                               budget=args.budget, input=input_source)
             if results:
                 last_result = results[-1]
 
             keep_going = False
         elif filetype == "arg":
             # ... but not for interpreted files.
-            evaluate(program)
+            if profile_in is not None and not profile_in.matches(program):
+                print("Ignoring profile {}, which was recorded for a different program".format(
+                    args.profile_in), file=sys.stderr)
+            evaluate(program, optimize=args.optimize, profile_out=profile_out,
+                     profile_in=profile_in, budget=args.budget, input=input_source)
+            if profile_out is not None:
+                profile_out.save(args.profile_out)
+            close_memo_db()
             _exit(0)
 
         if results is not None and len([r for r in results if r is not None]) > 0:
@@ -226,6 +359,10 @@ while True:
         keep_going = False
         print_error_pos(e)
         print("Name error: {}".format(e.args[1]))
+    except ProcyonLimitError as e:
+        keep_going = False
+        print_error_pos(e)
+        print("Limit exceeded: {}".format(e.args[1]))
     except OverflowError:
         keep_going = False
         print("Overflow: result is out of range")
@@ -235,4 +372,5 @@ while True:
         print("Type error: {}".format(e.args[1]))
     finally:
         if filetype == "arg" and filename:
+            close_memo_db()
             sys.exit(0)  # TODO: exit code is not reliable; we can get here with errors, too
@@ -1,5 +1,8 @@
 # vim: ts=4 sts=4 et sw=4
 
 # Don't forget to updte the import whenever __all__ is modified!
-from .interpreter import evaluate, evaluate_command, evaluate_file
-__all__ = ['evaluate', 'evaluate_command', 'evaluate_file']
+from .interpreter import Interpreter, evaluate, evaluate_many, evaluate_command, evaluate_file
+from .cooperative import Scheduler, evaluate_async
+from .program import Program, compile
+__all__ = ['Interpreter', 'evaluate', 'evaluate_many', 'evaluate_command', 'evaluate_file',
+           'Scheduler', 'evaluate_async', 'Program', 'compile']
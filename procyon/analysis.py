@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+from collections import Counter
+from .ast import (Value, Ident, BinaryOp, UnaryOp, Function, Conditional, While,
+                  FunctionCall, ControlFlowStatement, Comparison, ComparisonOp,
+                  TempStore, TempLoad, Square, ModPow, Increment, ProductCompare, IfDivisible,
+                  walk, iter_child_nodes)
+
+#
+# Static analyses over the Procyon AST, used by the optimizer (optimizer.py).
+# Nothing in here modifies the tree.
+#
+
+# Built-in functions that have side effects, or whose results depend on more than their
+# arguments. Every other built-in (the math functions, abs, round...) is pure.
+# pmap_reduce calls user functions, which may be impure
+IMPURE_BUILTINS = frozenset(('print', 'abort', 'input_str', 'input_int', 'input_float',
+                             'read_int', 'read_float', 'read_str', 'read_line', 'eof',
+                             'pmap_reduce'))
+
+def function_definitions(trees):
+    """ Map each function name to a list of all Function nodes defining it, anywhere in trees.
+
+        Since functions can be redefined (and nested functions can reuse names),
+        a single name may be bound to several definitions.
+    """
+    defs = {}
+    for node in walk(trees):
+        if isinstance(node, Function):
+            defs.setdefault(node.name.name, []).append(node)
+
+    return defs
+
+def pure_functions(trees, builtins):
+    """ Return the set of names of user functions that are pure.
+
+        A function is pure if it never calls print, abort, input_* or read_*, never assigns to
+        a $global, and only calls pure built-ins and other pure user functions.
+        For names with several definitions, all of them must be pure.
+        Names that are also assigned to (f = g, or a parameter named f) anywhere may refer
+        to any function, so they are never pure.
+        Recursion is handled by assuming every function is pure, and removing functions
+        from the set until nothing changes.
+    """
+    defs = function_definitions(trees)
+    pure = set(defs) - _rebound_names(trees)
+
+    changed = True
+    while changed:
+        changed = False
+        for name in list(pure):
+            if not all(_body_is_pure(f.body, pure, builtins) for f in defs[name]):
+                pure.discard(name)
+                changed = True
+
+    return pure
+
+def _rebound_names(trees):
+    """ The names that are bound to something other than a function definition, anywhere. """
+    names = set()
+    for node in walk(trees):
+        if isinstance(node, BinaryOp) and node.kind == "assign":
+            names.add(node.left.name)
+        elif isinstance(node, Increment):
+            names.add(node.ident.name)
+        elif isinstance(node, Function):
+            names.update(p.name for p in node.params)
+
+    return names
+
+def _body_is_pure(body, pure_funcs, builtins):
+    for node in walk(body):
+        if isinstance(node, BinaryOp) and node.kind == "assign" and node.left.name[0] == '$':
+            return False
+        elif isinstance(node, Increment) and node.ident.name[0] == '$':
+            return False
+        elif isinstance(node, FunctionCall) and not _call_is_pure(node, pure_funcs, builtins):
+            return False
+
+    return True
+
+def _call_is_pure(call, pure_funcs, builtins):
+    """ Test whether the called function (but not necessarily the arguments) is pure. """
+    name = call.func_name.name
+    if name in builtins:
+        return name not in IMPURE_BUILTINS
+    return name in pure_funcs
+
+def is_pure(node, pure_funcs, builtins):
+    """ Test whether evaluating an expression can have side effects.
+
+        A pure expression may still raise an exception (e.g. a NameError or ZeroDivisionError),
+        but evaluating it twice gives the same result as evaluating it once, and it
+        does not change any variables.
+    """
+    if isinstance(node, (Value, Ident, TempLoad)):
+        return True
+    elif isinstance(node, BinaryOp):
+        return (node.kind != "assign" and is_pure(node.left, pure_funcs, builtins) and
+                is_pure(node.right, pure_funcs, builtins))
+    elif isinstance(node, UnaryOp):
+        return is_pure(node.arg, pure_funcs, builtins)
+    elif isinstance(node, Comparison):
+        return all(is_pure(n, pure_funcs, builtins)
+                   for n in node.contents if not isinstance(n, ComparisonOp))
+    elif isinstance(node, FunctionCall):
+        return (_call_is_pure(node, pure_funcs, builtins) and
+                all(is_pure(a, pure_funcs, builtins) for a in node.args))
+    elif isinstance(node, (TempStore, Square, ModPow, ProductCompare)):
+        return all(is_pure(n, pure_funcs, builtins) for n in iter_child_nodes(node))
+
+    # Statements: function definitions, loops, control flow
+    return False
+
+def names_read(node, nested=True):
+    """ Count the variable names read by a tree (or a list of trees).
+
+        Function calls count as reads of the function's name, since functions are
+        looked up in the scope just like variables. If nested is False, the bodies of
+        function definitions inside the tree are skipped.
+    """
+    counts = Counter()
+    _names_read(node, counts, nested)
+    return counts
+
+def _names_read(node, counts, nested):
+    if isinstance(node, list):
+        for n in node:
+            _names_read(n, counts, nested)
+    elif isinstance(node, Ident):
+        counts[node.name] += 1
+    elif isinstance(node, BinaryOp) and node.kind == "assign":
+        # The left side is written, not read; x += 1 has its read of x on the right side
+        _names_read(node.right, counts, nested)
+    elif isinstance(node, Function):
+        if nested:
+            _names_read(node.body, counts, nested)
+    elif isinstance(node, FunctionCall):
+        counts[node.func_name.name] += 1
+        _names_read(node.args, counts, nested)
+    else:
+        for child in iter_child_nodes(node):
+            _names_read(child, counts, nested)
+
+def names_assigned(node):
+    """ Return the set of names a tree (or a list of trees) assigns to in its own scope.
+
+        Function definitions count as assignments to the function's name, but the
+        bodies of nested functions are skipped, since they run in a scope of their own.
+    """
+    names = set()
+    stack = list(node) if isinstance(node, list) else [node]
+    while stack:
+        n = stack.pop()
+        if isinstance(n, BinaryOp) and n.kind == "assign":
+            names.add(n.left.name)
+        elif isinstance(n, Increment):
+            names.add(n.ident.name)
+        elif isinstance(n, TempStore):
+            names.add(n.slot)
+        elif isinstance(n, Function):
+            names.add(n.name.name)
+            continue
+        stack.extend(iter_child_nodes(n))
+
+    return names
+
+def has_loop_jump(body, kind):
+    """ Test if a loop body contains a break or continue (kind) that applies to that loop.
+
+        Jumps inside nested loops apply to those loops instead, and are not counted.
+    """
+    for stmt in body:
+        if isinstance(stmt, ControlFlowStatement) and stmt.kind == kind:
+            return True
+        elif isinstance(stmt, (Conditional, IfDivisible)):
+            if has_loop_jump(stmt.then_body, kind) or has_loop_jump(stmt.else_body or [], kind):
+                return True
+
+    return False
+
+##
+### LIVENESS
+##
+
+# A variable is live at some point in a function if its current value may be read later.
+# The analysis works backwards over a function body, starting with nothing live at the
+# end of the function (locals disappear when it returns).
+#
+# Only plain statement-level assignments (x = ..., x += ...) are considered to kill
+# a variable; assignments nested inside expressions are treated as if they may not happen.
+# That is imprecise, but always safe.
+
+def live_after(body):
+    """ Compute the variables that are live after each statement in a function body.
+
+        Returns a dictionary mapping id(statement) to a frozenset of names, for every
+        statement in the body, including those inside loops and conditionals (but not
+        inside nested function definitions).
+    """
+    after = {}
+    _live_block(body, frozenset(), None, after)
+    return after
+
+def _live_block(stmts, live, loop, after):
+    """ Return the live set before a list of statements, given the set after it.
+
+        loop is None outside loops, and otherwise a tuple of the live sets that
+        break and continue jump to.
+    """
+    for stmt in reversed(stmts):
+        after[id(stmt)] = live
+        live = _live_stmt(stmt, live, loop, after)
+
+    return live
+
+def _live_stmt(stmt, live, loop, after):
+    if isinstance(stmt, ControlFlowStatement):
+        if stmt.kind == "return":
+            return frozenset(names_read(stmt.arg)) if stmt.arg is not None else frozenset()
+        elif loop is None:
+            # break/continue outside of a loop is an error; nothing after it runs
+            return frozenset()
+        return loop[0] if stmt.kind == "break" else loop[1]
+
+    elif isinstance(stmt, Conditional):
+        then_live = _live_block(stmt.then_body, live, loop, after)
+        else_live = _live_block(stmt.else_body or [], live, loop, after)
+        return then_live | else_live | frozenset(names_read(stmt.cond))
+
+    elif isinstance(stmt, While):
+        # The loop head is reached both from before the loop and from the end of the body,
+        # so iterate until the live set at the head stops growing.
+        cond = frozenset(names_read(stmt.cond))
+        head = cond | live
+        while True:
+            body_live = _live_block(stmt.body, head, (live, head), after)
+            new_head = head | body_live
+            if new_head == head:
+                return head
+            head = new_head
+
+    elif isinstance(stmt, Function):
+        # Defining a function reads nothing; what its body reads is only relevant
+        # once it is called, and calls are treated as reads of the function's name.
+        return live
+
+    elif isinstance(stmt, BinaryOp) and stmt.kind == "assign":
+        return (live - {stmt.left.name}) | frozenset(names_read(stmt.right))
+
+    return live | frozenset(names_read(stmt))
+
+##
+### NODE SHAPES
+##
+
+# A node's shape is its type and operator, plus the shapes of its children down to
+# a given depth, e.g. "BinaryOp[assign](Ident, BinaryOp[+](Ident, Value))".
+# Counting shapes over many programs shows which patterns are worth a dedicated
+# node (see the superinstructions in optimizer.py, and misc/shapes.py).
+
+def node_shape(node, depth=2):
+    """ Describe the shape of a tree, down to the given depth. """
+
+    name = type(node).__name__
+    if isinstance(node, Comparison):
+        attrs = [n.op for n in node.contents[1::2]]
+    elif 'op' in node._attrs:
+        attrs = [node.op]
+    elif 'kind' in node._attrs:
+        attrs = [node.kind]
+    else:
+        attrs = []
+    if attrs:
+        name += "[{}]".format(" ".join(attrs))
+
+    if depth <= 0:
+        return name
+
+    children = []
+    for child in iter_child_nodes(node):
+        if isinstance(child, ComparisonOp):
+            continue
+        children.append(node_shape(child, depth - 1))
+
+    if isinstance(node, (Conditional, While, Function)):
+        # Bodies can be arbitrarily long; only the header is interesting
+        children = children[:1] if not isinstance(node, Function) else []
+
+    if children:
+        name += "({})".format(", ".join(children))
+
+    return name
+
+def shape_counts(trees, depth=2):
+    """ Count the shapes of all nodes in a tree, or a list of trees. """
+    return Counter(node_shape(node, depth) for node in walk(trees)
+                   if not isinstance(node, ComparisonOp))
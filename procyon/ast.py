@@ -8,10 +8,29 @@
 #
 
 class Node:
-    pass
+    """ Base class for all AST nodes.
+
+        _fields lists the attributes that hold child nodes (or lists of nodes),
+        and _attrs the plain attributes (names, operators, literal values) that
+        are part of a node's identity. Positions are deliberately not part of either,
+        so that two structurally identical nodes compare equal in structure_key().
+
+        _runtime maps the attributes holding runtime state (such as compiled code) to their
+        initial values; copies and pickled nodes start out with those.
+    """
+    _fields = ()
+    _attrs = ()
+    _runtime = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(self._runtime)
+        return state
 
 class Value(Node):
     """ Represents a value of some kind, such as int, float and string. """
+    _attrs = ('kind', 'value')
+
     def __init__(self, pos, kind, value):
         assert kind in ("int", "float", "string")
         self.pos = pos
@@ -23,6 +42,8 @@ class Value(Node):
 
 class Ident(Node):
     """ Represents a variable. """
+    _attrs = ('name',)
+
     def __init__(self, pos, name):
         self.pos = pos
         self.name = name
@@ -48,6 +69,8 @@ class BinaryOp(Node):
         "logical": &&, ||
         "assign": =
     """
+    _fields = ('left', 'right')
+    _attrs = ('kind', 'op')
 
     def __init__(self, pos, kind, left, right, op=None):
         assert kind in ("math", "logical", "assign")
@@ -68,6 +91,7 @@ class Comparison(Node):
     a > b >= c == d is stored as a single comparison, with "contents" being
     [a, >, b, >=, c, ==, d] (where each value really is a Node instance of some kind).
     """
+    _fields = ('contents',)
 
     def __init__(self, pos, contents):
         self.pos = pos
@@ -83,6 +107,7 @@ class ComparisonOp(Node):
     to be set, but ignored; comparisons don't have left/right sides, since they can be
     comprised of multiple comparison operators.
     """
+    _attrs = ('op',)
 
     def __init__(self, pos, op):
         self.pos = pos
@@ -93,6 +118,9 @@ class ComparisonOp(Node):
 
 class UnaryOp(Node):
     """ Represents a unary operation, such as !arg and -arg. """
+    _fields = ('arg',)
+    _attrs = ('op',)
+
     def __init__(self, pos, op, arg):
         assert op in ('-', '!')
         self.pos = pos
@@ -103,19 +131,38 @@ class UnaryOp(Node):
         return "{}{}".format(self.op, self.arg)
 
 class Function(Node):
-    """ Represents a function definition. """
-    def __init__(self, pos, name, params, body):
+    """ Represents a function definition; memo is True for memo func definitions.
+
+        calls and compiled are runtime state: the number of times the function has been
+        called, and its compiled body once it has been called often enough (see compiler.py).
+        cache holds the results of a memo function (see memo.py) once it has been defined.
+        digest is a hash of a memo function's definition as parsed, before optimization,
+        which identifies its results in the memo database.
+    """
+    _fields = ('name', 'params', 'body')
+    _attrs = ('memo',)
+    _runtime = {'calls': 0, 'compiled': None, 'cache': None}
+
+    def __init__(self, pos, name, params, body, memo=False):
         self.pos = pos
         self.name = name
         self.params = params
         self.body = body
+        self.memo = memo
+        self.calls = 0
+        self.compiled = None
+        self.cache = None
+        self.digest = None
 
     def __repr__(self):
         params = [repr(a) for a in self.params]
-        return "func {}({}) {}".format(self.name, ", ".join(params), self.body)
+        return "{}func {}({}) {}".format("memo " if self.memo else "", self.name,
+                                         ", ".join(params), self.body)
 
 class Conditional(Node):
     """ Represents an if or if-else clause. """
+    _fields = ('cond', 'then_body', 'else_body')
+
     def __init__(self, pos, cond, then_body, else_body):
         self.pos = pos
         self.cond = cond
@@ -129,17 +176,28 @@ class Conditional(Node):
             return "if ({}) {}".format(self.cond, self.then_body)
 
 class While(Node):
-    """ Represents a while loop. """
+    """ Represents a while loop.
+
+        back_edges and compiled are runtime state: the number of completed iterations,
+        over all runs of the loop, and the compiled loop once it gets hot (see compiler.py).
+    """
+    _fields = ('cond', 'body')
+    _runtime = {'back_edges': 0, 'compiled': None}
+
     def __init__(self, pos, cond, body):
         self.pos = pos
         self.cond = cond
         self.body = body
+        self.back_edges = 0
+        self.compiled = None
 
     def __repr__(self):
         return "while ({}) {}".format(self.cond, self.body)
 
 class FunctionCall(Node):
     """ Represents a function call. """
+    _fields = ('func_name', 'args')
+
     def __init__(self, pos, func_name, args):
         self.pos = pos
         self.func_name = func_name
@@ -151,6 +209,9 @@ class FunctionCall(Node):
 
 class ControlFlowStatement(Node):
     """ break, continue or return; only return may have arguments. """
+    _fields = ('arg',)
+    _attrs = ('kind',)
+
     def __init__(self, pos, kind, arg=None):
         assert kind in ("break", "continue", "return")
         if arg:
@@ -164,3 +225,315 @@ class ControlFlowStatement(Node):
             return "{} {}".format(self.kind, self.arg)
         else:
             return self.kind
+
+class TempStore(Node):
+    """ Evaluates an expression, stores the result in a hidden temporary and returns it.
+
+        Created by the optimizer (common subexpression elimination) for the first
+        occurrence of a repeated expression; later occurrences become TempLoad nodes.
+        Temporaries live in the local scope under names that can never be valid
+        identifiers (they begin with a %), so they cannot clash with user variables.
+    """
+    _fields = ('expr',)
+    _attrs = ('slot',)
+
+    def __init__(self, pos, slot, expr):
+        self.pos = pos
+        self.slot = slot
+        self.expr = expr
+
+    def __repr__(self):
+        return "({} := {})".format(self.slot, self.expr)
+
+class TempLoad(Node):
+    """ Reads a hidden temporary previously set by a TempStore in the same scope. """
+    _attrs = ('slot',)
+
+    def __init__(self, pos, slot):
+        self.pos = pos
+        self.slot = slot
+
+    def __repr__(self):
+        return "({})".format(self.slot)
+
+class Square(Node):
+    """ x^2, created by the optimizer. Ints are squared with a multiplication. """
+    _fields = ('arg',)
+
+    def __init__(self, pos, arg):
+        self.pos = pos
+        self.arg = arg
+
+    def __repr__(self):
+        return "(square: {})".format(self.arg)
+
+class ModPow(Node):
+    """ (base ^ exp) % mod, created by the optimizer.
+
+        For ints (with exp >= 0), this is calculated with Python's three-argument pow(),
+        which never creates the (possibly huge) intermediate base ^ exp.
+        pow_pos is the position of the ^ operator, pos that of the %.
+    """
+    _fields = ('base', 'exp', 'mod')
+
+    def __init__(self, pos, pow_pos, base, exp, mod):
+        self.pos = pos
+        self.pow_pos = pow_pos
+        self.base = base
+        self.exp = exp
+        self.mod = mod
+
+    def __repr__(self):
+        return "(modpow: {} ^ {} % {})".format(self.base, self.exp, self.mod)
+
+class Increment(Node):
+    """ x += step or x -= step (also x = x + step) for a constant int step.
+
+        Created by the optimizer.
+
+        op is the original operator ('+' or '-'), which is used to produce the same
+        errors as the original statement for non-numeric values.
+    """
+    _fields = ('ident',)
+    _attrs = ('op', 'step')
+
+    def __init__(self, pos, ident, op, step):
+        assert op in ('+', '-')
+        self.pos = pos
+        self.ident = ident
+        self.op = op
+        self.step = step
+
+    def __repr__(self):
+        return "(incr: {} {}= {})".format(self.ident, self.op, self.step)
+
+class ProductCompare(Node):
+    """ a * b <op> c, e.g. d*d > n, created by the optimizer.
+
+        If left and right are the same variable, it is only read once.
+        mul_pos is the position of the *, pos that of the comparison operator.
+    """
+    _fields = ('left', 'right', 'other')
+    _attrs = ('op',)
+
+    def __init__(self, pos, mul_pos, left, right, op, other):
+        self.pos = pos
+        self.mul_pos = mul_pos
+        self.left = left
+        self.right = right
+        self.op = op
+        self.other = other
+
+    def __repr__(self):
+        return "(prodcomp: {} * {} {} {})".format(self.left, self.right, self.op, self.other)
+
+class WhileCompare(Node):
+    """ A while loop whose condition is a single comparison, e.g. while i < n { ... }.
+
+        Created by the optimizer; pos is the position of the while keyword,
+        and op_pos that of the comparison operator. back_edges and compiled are
+        the same as for While.
+    """
+    _fields = ('left', 'right', 'body')
+    _attrs = ('op',)
+    _runtime = {'back_edges': 0, 'compiled': None}
+
+    def __init__(self, pos, op_pos, left, op, right, body):
+        self.pos = pos
+        self.op_pos = op_pos
+        self.left = left
+        self.op = op
+        self.right = right
+        self.body = body
+        self.back_edges = 0
+        self.compiled = None
+
+    def __repr__(self):
+        return "while ({} {} {}) {}".format(self.left, self.op, self.right, self.body)
+
+class IfDivisible(Node):
+    """ if a % b == 0 (or != 0), with optional else; created by the optimizer.
+
+        pos is the position of the if keyword, mod_pos that of the %, and
+        op_pos that of the comparison operator.
+    """
+    _fields = ('left', 'right', 'then_body', 'else_body')
+    _attrs = ('op',)
+
+    def __init__(self, pos, mod_pos, op_pos, left, right, op, then_body, else_body):
+        assert op in ('==', '!=')
+        self.pos = pos
+        self.mod_pos = mod_pos
+        self.op_pos = op_pos
+        self.left = left
+        self.right = right
+        self.op = op
+        self.then_body = then_body
+        self.else_body = else_body
+
+    def __repr__(self):
+        cond = "{} % {} {} 0".format(self.left, self.right, self.op)
+        if self.else_body:
+            return "if ({}) {} else {}".format(cond, self.then_body, self.else_body)
+        else:
+            return "if ({}) {}".format(cond, self.then_body)
+
+class ReturnVar(Node):
+    """ return ident, created by the optimizer. """
+    _fields = ('ident',)
+
+    def __init__(self, pos, ident):
+        self.pos = pos
+        self.ident = ident
+
+    def __repr__(self):
+        return "return {}".format(self.ident)
+
+class CountedLoop(Node):
+    """ A counting loop, while i < bound { ...; i += step }, created by the optimizer.
+
+        The loop counter (ident) is only modified by the final increment, and the bound
+        is loop-invariant, so the loop can be run with a Python range().
+        body holds the statements before the increment; op and op_pos describe the
+        original comparison, which is needed to fall back to a regular while loop.
+        back_edges is the same as for While, but compiled holds only the compiled body.
+    """
+    _fields = ('ident', 'bound', 'body', 'increment')
+    _attrs = ('op', 'step')
+    _runtime = {'back_edges': 0, 'compiled': None}
+
+    def __init__(self, pos, op_pos, ident, op, bound, step, body, increment):
+        assert op in ('<', '<=', '>', '>=')
+        self.pos = pos
+        self.op_pos = op_pos
+        self.ident = ident
+        self.op = op
+        self.bound = bound
+        self.step = step
+        self.body = body
+        self.increment = increment
+        self.back_edges = 0
+        self.compiled = None
+
+    def __repr__(self):
+        return "(counted: while ({} {} {}) {} + {})".format(
+            self.ident, self.op, self.bound, self.body, self.increment)
+
+class Reduction(Node):
+    """ A counted loop that only accumulates into a variable, created by the optimizer.
+
+        For example, while i < n { if i % 3 == 0 { sum += i^2; } i += 1; }
+        The loop adds (op '+'), subtracts ('-') or multiplies ('*') acc by a polynomial
+        in the loop counter, poly (int coefficients, lowest degree first), for every value
+        that passes the filter given by divisors; see series.py. This is calculated
+        without running the loop at all, unless a value turns out not to be an int,
+        in which case the original loop is run instead.
+    """
+    _fields = ('loop', 'acc')
+    _attrs = ('op', 'poly', 'divisors')
+
+    def __init__(self, pos, loop, acc, op, poly, divisors):
+        assert op in ('+', '-', '*')
+        self.pos = pos
+        self.loop = loop
+        self.acc = acc
+        self.op = op
+        self.poly = poly
+        self.divisors = divisors
+
+    def __repr__(self):
+        return "(reduction: {} {}= {} {})".format(self.acc, self.op, self.poly, self.loop)
+
+class ReorderedChain(Node):
+    """ An if/else if chain comparing one variable to constants, tested in another order.
+
+        Created by the optimizer from a profile: if x == 1 { ... } else if x == 2 { ... }
+        is tested with the most frequently taken case first. Since x can only equal one
+        of the (different) constants, the order doesn't matter, as long as the comparisons
+        can't fail; if x has a type that can't be compared to the constants, the original
+        chain is run instead, so that the errors are the same.
+
+        chain is the original first if statement, cases all of the if statements in the
+        chain, order the indexes into cases in the order to test them, and else_body that
+        of the last if statement.
+    """
+    _fields = ('ident', 'chain')
+    _attrs = ('order',)
+
+    def __init__(self, pos, ident, chain, cases, order):
+        self.pos = pos
+        self.ident = ident
+        self.chain = chain
+        self.cases = cases
+        self.order = order
+        self.else_body = cases[-1].else_body
+        self.numeric = cases[0].cond.contents[2].kind != "string"
+
+    def __repr__(self):
+        return "(reordered {}: {})".format(self.order, self.chain)
+
+class SpecializedCall(Node):
+    """ A call to a function with some constant arguments, created by the optimizer.
+
+        func is a copy of the called function (target), with the constant parameters
+        replaced by their values and optimized again. If the name still refers to target
+        when the call runs, func is called instead; otherwise this is a regular call.
+        Neither function is a child node; both are also reachable from elsewhere.
+    """
+    _fields = ('call',)
+
+    def __init__(self, pos, call, target, func):
+        self.pos = pos
+        self.call = call
+        self.target = target
+        self.func = func
+
+    def __repr__(self):
+        return "(specialized {})".format(self.call)
+
+#
+# Generic helpers for walking the AST. These rely on _fields, so new node types
+# only need to list their children there to be supported.
+#
+
+def iter_child_nodes(node):
+    """ Yield all direct children of a node, flattening lists of nodes. """
+    for field in node._fields:
+        child = getattr(node, field)
+        if isinstance(child, list):
+            for c in child:
+                if isinstance(c, Node):
+                    yield c
+        elif isinstance(child, Node):
+            yield child
+
+def walk(trees):
+    """ Yield every node in a tree (or a list of trees), parents before children. """
+    stack = list(reversed(trees)) if isinstance(trees, list) else [trees]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(list(iter_child_nodes(node))))
+
+def count_nodes(trees):
+    """ Count the number of nodes in a tree, or a list of trees. """
+    return sum(1 for _ in walk(trees))
+
+def structure_key(node):
+    """ Return a hashable key describing a tree's structure, ignoring positions.
+
+        Two trees have the same key exactly when they would be printed identically
+        and contain the same literal values (1 and 1.0 are kept apart by kind).
+    """
+    if isinstance(node, list):
+        return tuple(structure_key(n) for n in node)
+    elif not isinstance(node, Node):
+        return _atom_key(node)
+
+    return ((type(node).__name__,) +
+            tuple(_atom_key(getattr(node, a)) for a in node._attrs) +
+            tuple(structure_key(getattr(node, f)) for f in node._fields))
+
+def _atom_key(value):
+    # 0.0 == -0.0, but 1/0.0 and 1/-0.0 differ; floats are compared by repr instead
+    return ('float', repr(value)) if type(value) is float else value
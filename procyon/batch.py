@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .common import *  # Exceptions
+from . import compiler
+from .interpreter import Interpreter
+from .output import MemorySink
+
+#
+# Batch mode: run many programs in parallel, one per worker process, and collect what
+# happened into a report (procyon.py --jobs N file.pr dir/ ...).
+#
+# Each worker has a single interpreter, whose parser is built when the worker starts, so
+# that programs don't pay for that. The interpreter is reset between programs, and their
+# output is captured and put in the report rather than printed.
+#
+
+def find_programs(paths):
+    """ Expand directories to the .pr files in them (recursively); files are kept as is. """
+    programs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                programs += [os.path.join(root, f) for f in sorted(files) if f.endswith('.pr')]
+        else:
+            programs.append(path)
+    return programs
+
+# The interpreter of a worker process
+_worker = None
+
+def _start_worker(optimize, jit_threshold, osr_threshold, budget):
+    global _worker
+    # Workers that are started rather than forked don't inherit the settings
+    _worker = Interpreter(optimize, budget=budget, jit_threshold=jit_threshold,
+                          osr_threshold=osr_threshold)
+    _worker.parse("0;")
+
+def _json_value(value):
+    """ Results that JSON has no type for (functions) are written as they are printed. """
+    return value if value is None or type(value) in (int, float, str) else str(value)
+
+def _error(e):
+    """ Describe an exception raised by a program. """
+    if isinstance(e, ProcyonControlFlowException):
+        t = e.args[1]["type"]
+        message = "abort() called" if t == "abort" else "{} called outside of a {}".format(
+            t, "function" if t == "return" else "loop")
+    elif isinstance(e, ProcyonException) and len(e.args) == 2:
+        message = e.args[1]
+    else:
+        message = str(e)
+
+    error = {'type': type(e).__name__.replace('Procyon', ''), 'message': message}
+    if isinstance(e, ProcyonException) and len(e.args) == 2 and e.args[0][0] > 0:
+        error['line'], error['column'] = e.args[0]
+    return error
+
+def run_captured(interp, entry, read_program, library=None):
+    """ Run the program read_program() returns in interp, with its output captured.
+
+        The interpreter is reset first, to the variables and functions in the library
+        dict if one is given. The results (or error), run time and output are added to
+        entry, which is returned.
+    """
+    output = MemorySink()
+    interp.output = output
+    interp.reset()
+    if library:
+        interp.globals.update(library)
+
+    start = time.perf_counter()
+    try:
+        results = interp.evaluate(read_program()) or []
+        entry['results'] = [_json_value(r) for r in results]
+    except Exception as e:  # The batch goes on, whatever happens to a program
+        entry['error'] = _error(e)
+    entry['seconds'] = time.perf_counter() - start
+    entry['output'] = output.getvalue()
+    return entry
+
+def _read(filename):
+    with open(filename, 'r') as f:
+        return f.read()
+
+def run_program(filename):
+    """ Run a program in this worker's interpreter; returns its entry in the report. """
+    return run_captured(_worker, {'file': filename}, lambda: _read(filename))
+
+def run_batch(paths, jobs=None, optimize=1, budget=None):
+    """ Run all programs found in paths (see find_programs) using jobs worker processes.
+
+        jobs defaults to the number of CPUs. If a budget.Budget is given, it limits
+        each program. Returns the report, a dict that can be
+        written as JSON; its "programs" entry has an entry per program, in the same
+        order as the programs were found, with either its "results" or an "error".
+    """
+    programs = find_programs(paths)
+
+    start = time.perf_counter()
+    settings = (optimize, compiler.JIT_THRESHOLD, compiler.OSR_THRESHOLD, budget)
+    with ProcessPoolExecutor(jobs, initializer=_start_worker, initargs=settings) as pool:
+        entries = list(pool.map(run_program, programs))
+
+    return {'jobs': jobs or os.cpu_count(),
+            'seconds': time.perf_counter() - start,
+            'failed': sum(1 for e in entries if 'error' in e),
+            'programs': entries}
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+import operator
+import time
+from .common import *  # Exceptions
+from . import interpreter
+
+#
+# Execution budgets: limits on how much work a program may do.
+#
+# A Budget is given to an Interpreter (or to a single evaluate() call), and limits each
+# program it runs to a number of steps, a number of seconds, a size for ints, and a
+# length for strings. A program that goes over a limit is stopped with one of the
+# ProcyonLimitError exceptions, with the position of the node where that happened.
+#
+# Steps are the nodes the tree walker evaluates, after optimization; a fused node counts
+# as one. Each node counts down budget.countdown, and only when that reaches zero, every
+# CHECK_INTERVAL steps (or at the step limit, if sooner), does the tree walker call
+# check(), which also checks the clock. A program with a budget is never compiled, so
+# that all of it runs in the tree walker; this also makes the step count the same from
+# run to run.
+#
+# Ints and strings are checked where they grow: math operations on ints check that the
+# result has at most int_bits bits, and string concatenations that the result has at
+# most string_length characters. Exponentiations and multiplications are checked before
+# they are calculated, since calculating the result can take a long time by itself.
+# Since Procyon has no data structures, that also limits the memory a program can use.
+#
+
+# How often (in steps) the deadline is checked
+CHECK_INTERVAL = 1000
+
+# Math operators on two ints, as _math in interpreter.py calculates them
+_int_ops = {'+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.truediv,
+            '//': operator.floordiv, '^': operator.pow, '%': operator.mod}
+
+class Budget:
+    """ Limits for a program; None means unlimited.
+
+        steps -- the number of nodes the program may evaluate
+        seconds -- how long the program may run (wall-clock time)
+        int_bits -- the maximum size of ints calculated by the program
+        string_length -- the maximum length of strings built by the program
+
+        A budget is restarted by every program run with it, so it can be reused, but
+        should only be used by one program at a time.
+    """
+
+    def __init__(self, steps=None, seconds=None, int_bits=None, string_length=None):
+        self.steps = steps
+        self.seconds = seconds
+        self.int_bits = int_bits
+        self.string_length = string_length
+        self.start()
+
+    def __repr__(self):
+        return "Budget(steps={}, seconds={}, int_bits={}, string_length={})".format(
+            self.steps, self.seconds, self.int_bits, self.string_length)
+
+    def start(self):
+        """ Restart the budget, for a new program. """
+        self.used = 0
+        self.deadline = None if self.seconds is None else time.monotonic() + self.seconds
+        self._refill()
+
+    @property
+    def steps_used(self):
+        return self.used + self.chunk - self.countdown
+
+    def _refill(self):
+        # The next check is due after this many steps; at the step limit, that is the
+        # step that exceeds it
+        chunk = CHECK_INTERVAL
+        if self.steps is not None:
+            chunk = min(chunk, self.steps + 1 - self.used)
+        self.chunk = self.countdown = chunk
+
+    def check(self, pos):
+        """ Called by the tree walker when countdown reaches zero. """
+        self.used += self.chunk
+        if self.steps is not None and self.used > self.steps:
+            self.countdown = self.chunk = 0
+            raise ProcyonStepLimitError(pos, "step limit of {} exceeded".format(self.steps))
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.chunk = self.countdown = 0
+            raise ProcyonTimeoutError(
+                pos, "time limit of {} seconds exceeded".format(self.seconds))
+        self._refill()
+
+    def split(self, parts):
+        """ Return budgets for parts of the program that run elsewhere (the chunks of a
+            pmap_reduce), with the same limits, which together have the steps left in
+            this one; add the steps they use with charge().
+        """
+        left = None if self.steps is None else max(self.steps - self.steps_used, 0)
+        budgets = []
+        for i in range(parts):
+            part = Budget(None if left is None else left * (i + 1) // parts - left * i // parts,
+                          None, self.int_bits, self.string_length)
+            part.seconds, part.deadline = self.seconds, self.deadline
+            budgets.append(part)
+        return budgets
+
+    def charge(self, steps):
+        """ Count steps used elsewhere, by the budgets split() returned. """
+        self.used += steps
+
+    def math(self, pos, op, left, right):
+        """ Calculate a math operation, like _math in interpreter.py, within the limits. """
+        if type(left) is int and type(right) is int:
+            if self.int_bits is not None:
+                # A lower bound of the size of the result, so that we don't start a huge
+                # calculation; the result is checked below
+                if op == '^' and right > 0 and abs(left) > 1:
+                    self._check_bits(pos, (abs(left).bit_length() - 1) * right + 1)
+                elif op == '*' and left and right:
+                    self._check_bits(pos, left.bit_length() + right.bit_length() - 1)
+
+                # Both are ints, so _math's type checks can be skipped
+                result = _int_ops[op](left, right)
+                if type(result) is int:
+                    self._check_bits(pos, result.bit_length())
+                return result
+
+        elif type(left) is str and type(right) is str and op == '+':
+            if self.string_length is not None:
+                self.check_string(pos, len(left) + len(right))
+
+        return interpreter._math(pos, op, left, right)
+
+    def _check_bits(self, pos, bits):
+        if bits > self.int_bits:
+            raise ProcyonIntSizeError(
+                pos, "int result would have more than {} bits".format(self.int_bits))
+
+    def check_int(self, pos, value):
+        """ Check the size of an int calculated outside of math(). """
+        if self.int_bits is not None and type(value) is int:
+            self._check_bits(pos, value.bit_length())
+
+    def check_string(self, pos, length):
+        if self.string_length is not None and length > self.string_length:
+            raise ProcyonStringSizeError(
+                pos, "string would be longer than {} characters".format(self.string_length))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+import pickle
+import threading
+from collections import OrderedDict
+
+#
+# The program cache: evaluate() remembers the optimized syntax trees of the last
+# CACHE_SIZE programs it has run, keyed on their source and optimization level, so that
+# programs (or REPL lines) that are run again skip the lexer, the parser, the purity
+# checks and the optimizer.
+#
+# Syntax trees also hold runtime state (compiled code, loop counters and memo caches;
+# see _runtime in ast.py), and functions defined by a program end up in its global
+# variables, so a tree can't simply be run twice. The cache holds each tree pickled,
+# which leaves out the runtime state, and every run unpickles a fresh copy; that is
+# still much faster than parsing. Nothing in a tree depends on the global state it
+# runs against (the optimizer never looks at variables), so entries can be used by
+# any interpreter, whatever its state.
+#
+# The REPL's .cache command shows the statistics, and .cache clear empties the cache.
+#
+
+# The number of programs kept; 0 disables the cache.
+CACHE_SIZE = 256
+
+class ProgramCache:
+    """ A least recently used cache of optimized programs, with hit/miss statistics.
+
+        Entries are the syntax tree and the optimizer's report; get() returns copies.
+        The cache can be used from several threads at a time.
+    """
+
+    def __init__(self, size=None):
+        self.size = CACHE_SIZE if size is None else size
+        self.programs = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, source, optimize):
+        """ Return a copy of a cached (trees, report) pair (and count a hit), or None (and
+            count a miss).
+        """
+        key = (source, optimize)
+        with self.lock:
+            entry = self.programs.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.programs.move_to_end(key)
+
+        data, report = entry
+        return pickle.loads(data), report.copy()
+
+    def put(self, source, optimize, trees, report):
+        """ Cache a program, before it runs: trees must not hold any runtime state yet. """
+        if self.size <= 0:
+            return
+        try:
+            data = pickle.dumps(trees, pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            return  # Too deeply nested; it is simply parsed every time
+
+        with self.lock:
+            programs = self.programs
+            programs[(source, optimize)] = (data, report.copy())
+            programs.move_to_end((source, optimize))
+            while len(programs) > self.size:
+                programs.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.programs.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.programs)
+
+# The cache used by evaluate()
+programs = ProgramCache()
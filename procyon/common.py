@@ -33,6 +33,30 @@ class ProcyonTypeError(ProcyonException):
     """ Raised when the interpreter encounters a type error, such as adding an int to a string. """
     pass
 
+class ProcyonEOFError(ProcyonException, EOFError):
+    """ Raised when a program reads past the end of its input (see inputs.py). """
+    pass
+
+class ProcyonLimitError(ProcyonException):
+    """ Base class for the errors raised when a program exceeds its Budget (see budget.py). """
+    pass
+
+class ProcyonStepLimitError(ProcyonLimitError):
+    """ Raised when a program has evaluated more nodes than its budget allows. """
+    pass
+
+class ProcyonTimeoutError(ProcyonLimitError):
+    """ Raised when a program runs past its deadline. """
+    pass
+
+class ProcyonIntSizeError(ProcyonLimitError):
+    """ Raised when a calculation would produce an int with too many bits. """
+    pass
+
+class ProcyonStringSizeError(ProcyonLimitError):
+    """ Raised when a calculation would produce a string that is too long. """
+    pass
+
 class ProcyonControlFlowException(ProcyonException):
     """ Raised by return, break, continue and abort(); exception arguments show the type.
 
@@ -42,6 +66,18 @@ class ProcyonControlFlowException(ProcyonException):
     """
     pass
 
+_ESCAPE_SEQUENCE_RE = re.compile(r'''
+    ( \\U........      # 8-digit hex escapes
+    | \\u....          # 4-digit hex escapes
+    | \\x..            # 2-digit hex escapes
+    | \\[0-7]{1,3}     # Octal escapes
+    | \\N\{[^}]+\}     # Unicode characters by name
+    | \\[\\'"abfnrtv]  # Single-character escapes
+    )''', re.UNICODE | re.VERBOSE)
+
+def _decode_match(match):
+    return codecs.decode(match.group(0), 'unicode-escape')
+
 def decode_escapes(s):
     r""" Handle escape sequences in strings.
 
@@ -53,16 +89,4 @@ def decode_escapes(s):
     if type(s) is not str:
         return s
 
-    ESCAPE_SEQUENCE_RE = re.compile(r'''
-        ( \\U........      # 8-digit hex escapes
-        | \\u....          # 4-digit hex escapes
-        | \\x..            # 2-digit hex escapes
-        | \\[0-7]{1,3}     # Octal escapes
-        | \\N\{[^}]+\}     # Unicode characters by name
-        | \\[\\'"abfnrtv]  # Single-character escapes
-        )''', re.UNICODE | re.VERBOSE)
-
-    def decode_match(match):
-        return codecs.decode(match.group(0), 'unicode-escape')
-
-    return ESCAPE_SEQUENCE_RE.sub(decode_match, s)
+    return _ESCAPE_SEQUENCE_RE.sub(_decode_match, s)
@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+import operator
+import sys
+from .common import *  # Exceptions
+from . import interpreter
+from .ast import (Value, Ident, BinaryOp, UnaryOp, Function, Conditional, While,
+                  FunctionCall, ControlFlowStatement, Comparison,
+                  TempStore, TempLoad, Square, Increment, ProductCompare,
+                  WhileCompare, IfDivisible, ReturnVar, CountedLoop, SpecializedCall,
+                  ReorderedChain)
+
+#
+# The second tier of the interpreter: a compiler from the AST to Python closures.
+#
+# Every node is turned into a function taking the scope, which does the same work as the
+# corresponding _evaluate_* function in interpreter.py. All decisions that only depend on
+# the node (which operator, which kind of assignment, how many arguments...) are made once,
+# at compile time, instead of every time the node is evaluated.
+#
+# Functions start out in the tree walker, and are compiled once they have been called
+# JIT_THRESHOLD times (see _call_function in interpreter.py), so short programs never pay
+# for compilation. Nodes without a compiled version simply call the tree walker.
+#
+# Loops running in the tree walker are compiled too, once they have gone around
+# OSR_THRESHOLD times (in total, over all the times they have run), and the rest of the
+# loop then runs in the compiled version (on-stack replacement), as do later runs.
+# This matters for programs that spend all their time in a single loop, at the top level
+# or in a function that is only called once.
+#
+# Function calls remember the function they called the first time (an inline cache),
+# and skip the usual checks as long as the name keeps referring to it. If it changes,
+# the call site is deoptimized: it goes back to the tree walker's regular call.
+#
+
+# The number of calls after which a function is compiled; 0 disables the compiler.
+JIT_THRESHOLD = 100
+
+# The number of iterations after which a loop is compiled; 0 disables on-stack replacement.
+OSR_THRESHOLD = 1000
+
+# If set, tier-ups and deoptimizations are logged to stderr.
+DEBUG_JIT = False
+
+def _log(msg):
+    if DEBUG_JIT:
+        print("jit: " + msg, file=sys.stderr)
+
+def _describe(func):
+    return '{}() at {}:{}'.format(func.name.name, *func.pos)
+
+def tier_up(func):
+    """ Compile a function's body; later calls run the compiled version. """
+    func.compiled = compile_block(func.body)
+    _log("compiled {} after {} calls".format(_describe(func), func.calls))
+
+def osr_entry(loop):
+    """ Compile a hot loop, and return the function to continue it with.
+
+        For while loops, the function runs the loop from the next test of its condition.
+        For counted loops, which the interpreter runs with range(), it runs one iteration
+        of the body, since the interpreter keeps control of the counter.
+        The function is also saved in loop.compiled, for the next time the loop runs.
+    """
+    if loop.compiled is None:
+        if isinstance(loop, CountedLoop):
+            loop.compiled = compile_block(loop.body)
+        else:
+            loop.compiled = compile_node(loop)
+        _log("compiled loop at {}:{} after {} iterations".format(*loop.pos, loop.back_edges))
+
+    return loop.compiled
+
+def compile_block(stmts):
+    """ Compile a list of statements into a single function. """
+    compiled = tuple(compile_node(stmt) for stmt in stmts)
+
+    if len(compiled) == 1:
+        return compiled[0]
+
+    def block(scope):
+        for stmt in compiled:
+            stmt(scope)
+    return block
+
+def compile_node(node):
+    """ Compile a node into a function taking the scope, which returns the node's value. """
+    compiler = _compilers.get(node.__class__)
+    if compiler is None:
+        return _fallback(node)
+    return compiler(node)
+
+def _fallback(node):
+    evaluate = interpreter._evaluate_tree
+
+    def run(scope):
+        return evaluate(node, scope)
+    return run
+
+def _compile_value(node):
+    value = node.value
+
+    def run(scope):
+        return value
+    return run
+
+def _compile_ident(node):
+    name = node.name
+    if name in interpreter.__functions or name[0] == '$':
+        # Errors, and globals; both are rare enough to leave to the tree walker
+        return _fallback(node)
+
+    def read(scope):
+        try:
+            return scope[1][name]
+        except KeyError:
+            scope = scope[0]
+            while scope is not None:
+                if name in scope[1]:
+                    return scope[1][name]
+                scope = scope[0]
+            raise ProcyonNameError(node.pos, 'unknown identifier "{}"'.format(name))
+    return read
+
+def _local_store(node, name):
+    """ Return a function that stores a value in a variable, like _assign_var. """
+    if name[0] == '$':
+        assign_var = interpreter._assign_var
+
+        def store(scope, value):
+            return assign_var(scope, name, value)
+    else:
+        def store(scope, value):
+            scope[1][name] = value
+            return value
+    return store
+
+def _compile_binary_op(node):
+    if node.kind == "assign":
+        if node.left.name in interpreter.__functions:
+            return _fallback(node)
+        store = _local_store(node, node.left.name)
+        right = compile_node(node.right)
+
+        def assign(scope):
+            return store(scope, right(scope))
+        return assign
+
+    left, right = compile_node(node.left), compile_node(node.right)
+    if node.kind == "logical":
+        if node.op == '||':
+            def logical_or(scope):
+                return 1 if left(scope) or right(scope) else 0
+            return logical_or
+        else:
+            def logical_and(scope):
+                return 1 if left(scope) and right(scope) else 0
+            return logical_and
+
+    math, pos, op = interpreter._math, node.pos, node.op
+    if getattr(node, 'type_hint', None) == 'float' and op in _float_ops:
+        # The profile says this only ever produced floats, so test for those first
+        float_op = _float_ops[op]
+
+        def float_first(scope):
+            a, b = left(scope), right(scope)
+            if type(a) is float and type(b) is float:
+                return float_op(a, b)
+            return math(pos, op, a, b)
+        return float_first
+    elif op == '+':
+        def add(scope):
+            a, b = left(scope), right(scope)
+            if type(a) is int and type(b) is int:
+                return a + b
+            return math(pos, op, a, b)
+        return add
+    elif op == '-':
+        def sub(scope):
+            a, b = left(scope), right(scope)
+            if type(a) is int and type(b) is int:
+                return a - b
+            return math(pos, op, a, b)
+        return sub
+    elif op == '*':
+        def mul(scope):
+            a, b = left(scope), right(scope)
+            if type(a) is int and type(b) is int:
+                return a * b
+            return math(pos, op, a, b)
+        return mul
+
+    def binary_op(scope):
+        return math(pos, op, left(scope), right(scope))
+    return binary_op
+
+_float_ops = {'+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.truediv}
+
+def _compile_unary_op(node):
+    arg = compile_node(node.arg)
+    if node.op == '-':
+        def negate(scope):
+            return -arg(scope)
+        return negate
+    else:
+        def logical_not(scope):
+            return 0 if arg(scope) else 1
+        return logical_not
+
+def _compile_comparison(node):
+    compare, int_comparisons = interpreter._compare, interpreter._int_comparisons
+    operands = [compile_node(n) for n in node.contents[0::2]]
+    ops = node.contents[1::2]
+
+    if len(ops) == 1:
+        left, right = operands
+        pos, op = ops[0].pos, ops[0].op
+        int_compare = int_comparisons[op]
+
+        def compare_two(scope):
+            a, b = left(scope), right(scope)
+            if type(a) is int and type(b) is int:
+                return 1 if int_compare(a, b) else 0
+            return 1 if compare(pos, op, a, b) else 0
+        return compare_two
+
+    first, rest = operands[0], list(zip(ops, operands[1:]))
+
+    def compare_chain(scope):
+        a = first(scope)
+        for op_node, operand in rest:
+            b = operand(scope)
+            if not compare(op_node.pos, op_node.op, a, b):
+                return 0
+            a = b
+        return 1
+    return compare_chain
+
+# Inline cache states for call sites
+_UNCACHED = object()
+_DEOPTIMIZED = object()
+
+def _compile_call(node):
+    name = node.func_name.name
+    if name in interpreter.__functions:
+        return _fallback(node)
+
+    lookup, missing = interpreter._lookup_var, interpreter._MISSING
+    call_function, evaluate_call = interpreter._call_function, interpreter._evaluate_call
+    args = tuple(compile_node(a) for a in node.args)
+    nargs = len(args)
+    cache = [_UNCACHED]  # The function called the first time, or _DEOPTIMIZED
+
+    def call(scope):
+        f = lookup(scope, name)
+        cached = cache[0]
+        if f is cached:
+            return call_function(f, [a(scope) for a in args], scope)
+
+        if cached is _UNCACHED:
+            if isinstance(f, Function) and len(f.params) == nargs:
+                cache[0] = f
+                return call_function(f, [a(scope) for a in args], scope)
+        elif cached is not _DEOPTIMIZED and f is not missing:
+            _log("deoptimized call to {}() at {}:{}, which no longer refers to {}".format(
+                name, *node.func_name.pos, _describe(cached)))
+            cache[0] = _DEOPTIMIZED
+
+        # Uncached: let the tree walker handle it, with all the usual checks and errors
+        return evaluate_call(node, scope)
+    return call
+
+def _compile_specialized_call(node):
+    call = node.call
+    lookup, call_function = interpreter._lookup_var, interpreter._call_function
+    target, specialized = node.target, node.func
+    args = tuple(compile_node(a) for a in call.args)
+    regular = compile_node(call)
+
+    def specialized_call(scope):
+        if lookup(scope, call.func_name.name) is target:
+            return call_function(specialized, [a(scope) for a in args], scope)
+        return regular(scope)
+    return specialized_call
+
+def _compile_conditional(node):
+    cond = compile_node(node.cond)
+    then_body = compile_block(node.then_body)
+    else_body = compile_block(node.else_body) if node.else_body else None
+
+    def conditional(scope):
+        if cond(scope):
+            then_body(scope)
+        elif else_body is not None:
+            else_body(scope)
+    return conditional
+
+def _compile_reordered_chain(node):
+    read = compile_node(node.ident)
+    chain = compile_node(node.chain)
+    cases = [(node.cases[i].cond.contents[2].value, compile_block(node.cases[i].then_body))
+             for i in node.order]
+    else_body = compile_block(node.else_body) if node.else_body else None
+    types = (int, float) if node.numeric else (str,)
+
+    def reordered_chain(scope):
+        value = read(scope)
+        if type(value) not in types:
+            return chain(scope)
+        for constant, body in cases:
+            if value == constant:
+                body(scope)
+                return None
+        if else_body is not None:
+            else_body(scope)
+    return reordered_chain
+
+def _loop(cond, body):
+    """ The common part of all while loops: run body for as long as cond(scope) is true. """
+
+    def loop(scope):
+        while cond(scope):
+            try:
+                body(scope)
+            except ProcyonControlFlowException as ex:
+                t = ex.args[1]["type"]
+                if t == "break":
+                    return None
+                elif t != "continue":
+                    raise  # return or abort; this is handled elsewhere
+    return loop
+
+def _compile_while(node):
+    return _loop(compile_node(node.cond), compile_block(node.body))
+
+def _compile_while_compare(node):
+    compare, int_compare = interpreter._compare, interpreter._int_comparisons[node.op]
+    left, right = compile_node(node.left), compile_node(node.right)
+    pos, op = node.op_pos, node.op
+
+    def cond(scope):
+        a, b = left(scope), right(scope)
+        if type(a) is int and type(b) is int:
+            return int_compare(a, b)
+        return compare(pos, op, a, b)
+    return _loop(cond, compile_block(node.body))
+
+def _compile_counted_loop(node):
+    range_stop, read = interpreter._range_stop, compile_node(node.ident)
+    bound, body = compile_node(node.bound), compile_block(node.body)
+    increment = compile_node(node.increment)
+    fallback = _compile_while(interpreter._counted_loop_fallback(node))
+    name, op, step = node.ident.name, node.op, node.step
+
+    def counted_loop(scope):
+        local_vars = scope[1]
+        start = read(scope)
+        stop = range_stop(op, bound(scope)) if type(start) is int else None
+        if stop is None:
+            return fallback(scope)
+
+        i = None
+        try:
+            for i in range(start, stop, step):
+                local_vars[name] = i
+                body(scope)
+                if local_vars.get(name) is not i:
+                    increment(scope)
+                    return fallback(scope)
+        except ProcyonControlFlowException as ex:
+            if ex.args[1]["type"] == "break":
+                return None
+            raise
+
+        if i is not None:
+            local_vars[name] = i + step
+    return counted_loop
+
+def _compile_control_flow(node):
+    kind, pos = node.kind, node.pos
+    if kind != "return":
+        def jump(scope):
+            raise ProcyonControlFlowException(pos, {"type": kind})
+        return jump
+
+    if node.arg is None:
+        def return_none(scope):
+            raise ProcyonControlFlowException(pos, {"type": "return", "value": None})
+        return return_none
+
+    arg = compile_node(node.arg)
+
+    def return_value(scope):
+        raise ProcyonControlFlowException(pos, {"type": "return", "value": arg(scope)})
+    return return_value
+
+def _compile_return_var(node):
+    read, pos = compile_node(node.ident), node.pos
+
+    def return_var(scope):
+        raise ProcyonControlFlowException(pos, {"type": "return", "value": read(scope)})
+    return return_var
+
+def _compile_if_divisible(node):
+    math, compare = interpreter._math, interpreter._compare
+    left, right = compile_node(node.left), compile_node(node.right)
+    then_body = compile_block(node.then_body)
+    else_body = compile_block(node.else_body) if node.else_body else None
+    mod_pos, op_pos, wanted = node.mod_pos, node.op_pos, node.op == '=='
+
+    def if_divisible(scope):
+        a, b = left(scope), right(scope)
+        if type(a) is int and type(b) is int and b != 0:
+            divisible = a % b == 0
+        else:
+            divisible = compare(op_pos, '==', math(mod_pos, '%', a, b), 0)
+
+        if divisible == wanted:
+            then_body(scope)
+        elif else_body is not None:
+            else_body(scope)
+    return if_divisible
+
+def _compile_increment(node):
+    if node.ident.name in interpreter.__functions:
+        return _fallback(node)
+    math, read = interpreter._math, compile_node(node.ident)
+    store = _local_store(node, node.ident.name)
+    pos, op = node.pos, node.op
+    step = node.step if op == '+' else -node.step
+
+    def increment(scope):
+        val = read(scope)
+        if type(val) is int:
+            return store(scope, val + step)
+        return store(scope, math(pos, op, val, node.step))
+    return increment
+
+def _compile_square(node):
+    math, arg, pos = interpreter._math, compile_node(node.arg), node.pos
+
+    def square(scope):
+        val = arg(scope)
+        if type(val) is int:
+            return val * val
+        return math(pos, '^', val, 2)
+    return square
+
+def _compile_product_compare(node):
+    math, compare = interpreter._math, interpreter._compare
+    int_compare = interpreter._int_comparisons[node.op]
+    left, other = compile_node(node.left), compile_node(node.other)
+    right = None if node.right is node.left else compile_node(node.right)
+    mul_pos, pos, op = node.mul_pos, node.pos, node.op
+
+    def product_compare(scope):
+        a = left(scope)
+        b = a if right is None else right(scope)
+        if type(a) is int and type(b) is int:
+            product = a * b
+        else:
+            product = math(mul_pos, '*', a, b)
+        c = other(scope)
+        if type(product) is int and type(c) is int:
+            return 1 if int_compare(product, c) else 0
+        return 1 if compare(pos, op, product, c) else 0
+    return product_compare
+
+def _compile_temp_load(node):
+    slot = node.slot
+
+    def temp_load(scope):
+        return scope[1][slot]
+    return temp_load
+
+def _compile_temp_store(node):
+    slot, expr = node.slot, compile_node(node.expr)
+
+    def temp_store(scope):
+        val = scope[1][slot] = expr(scope)
+        return val
+    return temp_store
+
+_compilers = {
+    Value: _compile_value,
+    Ident: _compile_ident,
+    BinaryOp: _compile_binary_op,
+    UnaryOp: _compile_unary_op,
+    Comparison: _compile_comparison,
+    FunctionCall: _compile_call,
+    Conditional: _compile_conditional,
+    While: _compile_while,
+    ControlFlowStatement: _compile_control_flow,
+    TempLoad: _compile_temp_load,
+    TempStore: _compile_temp_store,
+    Square: _compile_square,
+    Increment: _compile_increment,
+    ProductCompare: _compile_product_compare,
+    WhileCompare: _compile_while_compare,
+    IfDivisible: _compile_if_divisible,
+    ReturnVar: _compile_return_var,
+    CountedLoop: _compile_counted_loop,
+    SpecializedCall: _compile_specialized_call,
+    ReorderedChain: _compile_reordered_chain,
+    # ModPow, Reduction and function definitions use the tree walker
+}
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+import asyncio
+import inspect
+from collections import deque
+from .common import *  # Exceptions
+from . import interpreter as interp_module, memo
+from .ast import (BinaryOp, UnaryOp, Function, Conditional, While, FunctionCall,
+                  ControlFlowStatement, Comparison, walk)
+
+#
+# Cooperative evaluation: running many programs in a single thread, taking turns.
+#
+# evaluate() runs a program to the end before it returns. steps() instead returns a
+# generator that runs the program a little at a time: it yields after every STEP_QUANTUM
+# steps (statements run, and loop iterations), so that the caller can run something else
+# in between. When the program calls input_str/int/float, the generator yields an
+# InputRequest, and expects the line of input to be sent back. The read_* built-ins and
+# eof() read from the interpreter's input source, which would block every other program,
+# so in this mode calling them is a type error.
+#
+# Scheduler runs any number of such programs round-robin; evaluate_async() runs one as an
+# asyncio coroutine, so that asyncio's own (round-robin) scheduling interleaves them.
+#
+# The step-wise evaluator is a second, generator-based tree walker for the nodes the
+# parser creates; programs are not optimized or compiled in this mode, as the optimizer's
+# fused nodes and the compiled code can't stop halfway. Expressions without calls to user
+# functions or input can't run for long, so they are evaluated by the regular tree walker.
+#
+
+STEP_QUANTUM = 1000
+
+# The built-in functions' names and numbers of arguments
+_builtins = interp_module.__functions
+
+# The built-ins that read input, and those of them that can't be used in this mode
+_input_functions = interp_module._input_functions
+_stream_functions = {f for f in _input_functions if not f.startswith('input_')}
+
+class InputRequest:
+    """ Yielded by a step-wise program that needs a line of input; pos is the call's. """
+
+    def __init__(self, pos, prompt):
+        self.pos = pos
+        self.prompt = prompt
+
+    def __repr__(self):
+        return "InputRequest({!r})".format(self.prompt)
+
+def steps(s, interpreter=None, clear_state=False, quantum=None):
+    """ Return a generator that evaluates a program step by step.
+
+        The generator yields None after every quantum (default STEP_QUANTUM) steps, and an
+        InputRequest when the program needs input; send() the line of input back.
+        When the program has finished, the generator returns (as StopIteration.value)
+        the list of results evaluate() would have returned.
+
+        Programs run in a new Interpreter unless one is given. An interpreter should
+        only run one step-wise program at a time.
+    """
+    if interpreter is None:
+        interpreter = interp_module.Interpreter()
+    if clear_state:
+        interpreter.reset()
+
+    trees = interpreter.parse(s) if s.strip() else []
+    memo.check_purity(trees, _builtins)
+    if interpreter.budget is not None:
+        interpreter.budget.start()
+    run = _Run(quantum or STEP_QUANTUM, interpreter.sink)
+    return run.flushing(run.statements(trees, interpreter.scope, results=True))
+
+class _Run:
+    """ The state of a step-wise program: its step counter, which nodes are simple, and
+        its output sink, which is flushed whenever the program yields.
+    """
+
+    def __init__(self, quantum, sink):
+        self.quantum = quantum
+        self.sink = sink
+        self.steps = 0
+        self.simple = {}  # id(node) -> True if the regular tree walker can evaluate it
+
+    def tick(self):
+        """ Count a step; returns True when it is time to yield. """
+        self.steps += 1
+        if self.steps >= self.quantum:
+            self.steps = 0
+            self.sink.flush()
+            return True
+        return False
+
+    def flushing(self, program):
+        try:
+            return (yield from program)
+        finally:
+            self.sink.flush()
+
+    def is_simple(self, node):
+        try:
+            return self.simple[id(node)]
+        except KeyError:
+            simple = not any(
+                isinstance(n, (While, Conditional, ControlFlowStatement)) or
+                (isinstance(n, FunctionCall) and
+                 (n.func_name.name not in _builtins or n.func_name.name in _input_functions))
+                for n in walk(node) if not isinstance(n, Function))
+            self.simple[id(node)] = simple
+            return simple
+
+    def statements(self, trees, scope, results=False):
+        values = []
+        for tree in trees:
+            values.append((yield from self.evaluate(tree, scope)))
+            if self.tick():
+                yield None
+        return values if results else None
+
+    def evaluate(self, tree, scope):
+        if isinstance(tree, Function) or self.is_simple(tree):
+            return interp_module._evaluate_tree(tree, scope)
+
+        budget = scope[2].budget
+        if budget is not None:
+            budget.countdown -= 1
+            if budget.countdown <= 0:
+                budget.check(tree.pos)
+
+        try:
+            evaluator = _evaluators[tree.__class__]
+        except KeyError:
+            raise ProcyonInternalError('no step-wise evaluator for {}'.format(tree))
+        return (yield from evaluator(self, tree, scope))
+
+    def binary_op(self, tree, scope):
+        if tree.kind == "assign":
+            name = tree.left.name
+            if name in _builtins:
+                raise ProcyonTypeError(
+                    tree.left.pos, 'cannot assign to built-in function "{}"'.format(name))
+            value = yield from self.evaluate(tree.right, scope)
+            return interp_module._assign_var(scope, name, value)
+
+        left = yield from self.evaluate(tree.left, scope)
+        if tree.kind == "logical":
+            if tree.op == '||' and left:
+                return 1
+            elif tree.op == '&&' and not left:
+                return 0
+            return 1 if (yield from self.evaluate(tree.right, scope)) else 0
+
+        right = yield from self.evaluate(tree.right, scope)
+        budget = scope[2].budget
+        if budget is not None:
+            return budget.math(tree.pos, tree.op, left, right)
+        return interp_module._math(tree.pos, tree.op, left, right)
+
+    def unary_op(self, tree, scope):
+        value = yield from self.evaluate(tree.arg, scope)
+        return -value if tree.op == '-' else int(not value)
+
+    def comparison(self, tree, scope):
+        contents = tree.contents
+        left = yield from self.evaluate(contents[0], scope)
+        for i in range(1, len(contents), 2):
+            op_node = contents[i]
+            right = yield from self.evaluate(contents[i + 1], scope)
+            if not interp_module._compare(op_node.pos, op_node.op, left, right):
+                return 0
+            left = right
+        return 1
+
+    def conditional(self, tree, scope):
+        if (yield from self.evaluate(tree.cond, scope)):
+            yield from self.statements(tree.then_body, scope)
+        elif tree.else_body:
+            yield from self.statements(tree.else_body, scope)
+        return None
+
+    def while_loop(self, tree, scope):
+        while (yield from self.evaluate(tree.cond, scope)):
+            try:
+                yield from self.statements(tree.body, scope)
+            except ProcyonControlFlowException as ex:
+                t = ex.args[1]["type"]
+                if t == "break":
+                    return None
+                elif t != "continue":
+                    raise
+            if self.tick():
+                yield None
+        return None
+
+    def control_flow(self, tree, scope):
+        if tree.kind == "return" and tree.arg is not None:
+            value = yield from self.evaluate(tree.arg, scope)
+            raise ProcyonControlFlowException(tree.pos, {"type": "return", "value": value})
+        return interp_module._evaluate_control_flow(tree, scope)
+
+    def call(self, tree, scope):
+        func = interp_module._resolve_call(tree, scope)
+        if func is not None:
+            interp_module._check_arity(func, len(tree.args))
+
+        args = []
+        for arg in tree.args:
+            args.append((yield from self.evaluate(arg, scope)))
+
+        if func is None:
+            name = tree.func_name.name
+            if name in _stream_functions:
+                raise ProcyonTypeError(tree.func_name.pos, "{}() can't be used in step-wise "
+                                       "programs; use input_* instead".format(name))
+            elif name.startswith('input_'):
+                self.sink.flush()
+                line = yield InputRequest(tree.func_name.pos, args[0])
+                return interp_module._convert_input(tree.func_name, line)
+            return interp_module._call_builtin(tree.func_name, args, scope)
+
+        cache = func.cache
+        if cache is not None and interp_module._lookup_var(scope, func.name.name) is func:
+            key = cache.key(args)
+            store = scope[2].memo_store
+            result = cache.get(key, interp_module._MISSING, store)
+            if result is interp_module._MISSING:
+                result = yield from self.run_function(func, args, scope)
+                cache.put(key, result, store)
+            return result
+
+        return (yield from self.run_function(func, args, scope))
+
+    def run_function(self, func, args, scope):
+        func_scope = interp_module._new_scope(scope, [p.name for p in func.params], args)
+        try:
+            yield from self.statements(func.body, func_scope)
+        except ProcyonControlFlowException as ex:
+            if ex.args[1]["type"] == "return":
+                return ex.args[1]["value"]
+            raise
+        return None
+
+_evaluators = {
+    BinaryOp: _Run.binary_op,
+    UnaryOp: _Run.unary_op,
+    Comparison: _Run.comparison,
+    Conditional: _Run.conditional,
+    While: _Run.while_loop,
+    ControlFlowStatement: _Run.control_flow,
+    FunctionCall: _Run.call,
+}
+
+##
+### SCHEDULING
+##
+
+class Task:
+    """ A program run by a Scheduler; result or error is set once it has finished. """
+
+    def __init__(self, program):
+        self.program = program
+        self.done = False
+        self.result = None
+        self.error = None
+
+class Scheduler:
+    """ Runs step-wise programs round-robin in the current thread.
+
+        input is called with the prompt when a program calls input_*, and should return
+        the line of input; it defaults to the input() built-in. Calling read_* or eof()
+        is a type error.
+    """
+
+    def __init__(self, quantum=None, input=input):
+        self.quantum = quantum
+        self.input = input
+        self.ready = deque()
+
+    def add(self, s, interpreter=None):
+        """ Add a program (run in interpreter, or a new one); returns its Task. """
+        task = Task(steps(s, interpreter, quantum=self.quantum))
+        self.ready.append(task)
+        return task
+
+    def run(self):
+        """ Run all programs until they have finished. """
+        while self.ready:
+            task = self.ready.popleft()
+            self._step(task)
+            if not task.done:
+                self.ready.append(task)
+
+    def _step(self, task):
+        """ Run a task until its next yield. """
+        try:
+            request = next(task.program)
+            while isinstance(request, InputRequest):
+                request = task.program.send(self.input(request.prompt))
+        except StopIteration as e:
+            task.done, task.result = True, e.value
+        except Exception as e:  # The other programs go on, whatever happens to this one
+            task.done, task.error = True, e
+
+async def evaluate_async(s, interpreter=None, clear_state=False, input=None, quantum=None):
+    """ Evaluate a program as an asyncio coroutine, letting other tasks run every quantum steps.
+
+        input is called with the prompt when the program calls input_*; it may be a
+        coroutine function. If it is not given, calling input_* is a type error; calling
+        read_* or eof() always is.
+    """
+    program = steps(s, interpreter, clear_state, quantum)
+    value = None
+    while True:
+        try:
+            request = program.send(value)
+        except StopIteration as e:
+            return e.value
+
+        value = None
+        if isinstance(request, InputRequest):
+            if input is None:
+                program.close()
+                raise ProcyonTypeError(request.pos, "no input is available")
+            value = input(request.prompt)
+            if inspect.isawaitable(value):
+                value = await value
+        else:
+            await asyncio.sleep(0)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+import builtins
+import mmap
+import os
+import re
+import sys
+from .common import *  # Exceptions
+
+#
+# Input sources: where input_* and the read_* built-ins read from.
+#
+# input_str/int/float(prompt) read a line, after showing the prompt. For programs that
+# read lots of data, the read_* built-ins skip the prompt and read from a buffer:
+#
+# * read_int(), read_float() and read_str() read the next token (a run of characters
+#   that aren't whitespace), so numbers can be separated by spaces, newlines or both;
+# * read_line() reads the rest of the current line;
+# * eof() returns 1 if nothing but whitespace is left, so that a program can loop
+#   until its input runs out: while !eof() { total += read_int(); }
+#
+# Reading past the end of the input raises ProcyonEOFError.
+#
+# Sources read their input in blocks of BLOCK_SIZE bytes, and split each block into
+# tokens at once, so a read_int() costs little more than the int() it ends with.
+# Procyon has no lists, so there is no batch-reading built-in; the batching is done here.
+#
+# The input argument of an Interpreter can be a source, or anything make_source()
+# accepts:
+#
+# * None, for sys.stdin (whatever it is when the input is read); if it is a terminal,
+#   input_* uses Python's input(), with line editing;
+# * a file object, opened in text or binary mode;
+# * a str or bytes, which is the input itself.
+#
+# MappedSource reads a file through mmap(), so that a program can stream over files
+# larger than memory; procyon.py --input FILE uses it. The input is UTF-8.
+#
+
+# How many bytes a source reads (and splits into tokens) at a time
+BLOCK_SIZE = 64 * 1024
+
+_TOKEN = re.compile(rb'\S+')
+_NON_WHITESPACE = re.compile(rb'\S')
+
+class Source:
+    """ Base class for sources; subclasses implement _read(). """
+
+    def __init__(self):
+        self.buffer = b""
+        self.pos = 0  # Where the unread part of buffer starts
+        self.tokens = []  # The tokens in buffer after pos, once it's been split
+        self.next = 0  # The index of the next unread token
+        self.split_end = 0  # Where the last token ends
+        self.at_end = False
+
+    def _read(self):
+        """ Return the next block of input, or b"" at the end. """
+        raise NotImplementedError
+
+    def _fill(self):
+        """ Add a block of input to the buffer; returns False at the end of the input. """
+        if self.at_end:
+            return False
+        block = self._read()
+        if not block:
+            self.at_end = True
+            return False
+        self._sync()
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def _sync(self):
+        """ Move pos past the tokens that have been read, and forget the rest. """
+        if not self.tokens:
+            return
+        elif self.next == len(self.tokens):
+            # All of them; the last one ends where the whitespace after it starts
+            self.pos = self.split_end
+        elif self.next:
+            # Only when read_line() follows read_int() etc., so it's found the slow way
+            for i, match in zip(range(self.next), _TOKEN.finditer(self.buffer, self.pos)):
+                self.pos = match.end()
+        self.tokens = []
+        self.next = 0
+
+    def token(self):
+        """ Return the next token, as bytes, or None at the end of the input. """
+        next = self.next
+        if next < len(self.tokens):
+            self.next = next + 1
+            return self.tokens[next]
+
+        self._sync()
+        while True:
+            # Split up to BLOCK_SIZE bytes into tokens, up to whitespace, as the last
+            # token may continue after that
+            buffer, pos = self.buffer, self.pos
+            end = min(len(buffer), pos + BLOCK_SIZE)
+            if end < len(buffer) or not self.at_end:
+                while end > pos and not buffer[end - 1:end].isspace():
+                    end -= 1
+            chunk = buffer[pos:end].rstrip()
+            if not chunk:
+                # Only whitespace, or a token longer than that
+                match = _TOKEN.search(buffer, pos)
+                if match is not None and (match.end() < len(buffer) or self.at_end):
+                    chunk = match.group()
+                    pos = match.start()
+                elif self.at_end:
+                    return None
+                else:
+                    self._fill()
+                    continue
+
+            self.tokens = chunk.split()
+            self.split_end = pos + len(chunk)
+            self.next = 1
+            return self.tokens[0]
+
+    def readline(self):
+        """ Return the rest of the current line, without the line break, or None at the
+            end of the input.
+        """
+        self._sync()
+        while True:
+            newline = self.buffer.find(b"\n", self.pos)
+            if newline >= 0:
+                line = self.buffer[self.pos:newline]
+                self.pos = newline + 1
+                break
+            if not self._fill():
+                if self.pos == len(self.buffer):
+                    return None
+                line = self.buffer[self.pos:]
+                self.pos = len(self.buffer)
+                break
+        if line.endswith(b"\r"):
+            line = line[:-1]
+        return line.decode('utf-8')
+
+    def input(self, prompt):
+        """ Read a line for input_*, after writing the prompt to sys.stdout. """
+        if prompt:
+            sys.stdout.write(str(prompt))
+            sys.stdout.flush()
+        return self.readline()
+
+    def eof(self):
+        """ Return True if nothing but whitespace is left. """
+        if self.next < len(self.tokens):
+            return False
+        self._sync()
+        scan = self.pos
+        while not _NON_WHITESPACE.search(self.buffer, scan):
+            # The whitespace isn't consumed, as readline() returns the empty lines in it
+            scanned = len(self.buffer) - self.pos
+            if not self._fill():
+                return True
+            scan = self.pos + scanned
+        return False
+
+def _reader(file):
+    """ Return a function that reads a block of input from a file, as bytes. """
+    file = getattr(file, 'buffer', file)  # Text files have a binary buffer
+    # Read what is available, rather than wait for a full block, e.g. from pipes
+    read = getattr(file, 'read1', file.read)
+
+    def read_block():
+        block = read(BLOCK_SIZE)
+        return block.encode('utf-8') if isinstance(block, str) else block
+    return read_block
+
+class FileSource(Source):
+    """ Reads from a file object, in text or binary mode. """
+
+    def __init__(self, file):
+        super().__init__()
+        self.file = file
+        self._read = _reader(file)
+
+class StdinSource(Source):
+    """ Reads from sys.stdin; input_* uses input() if it is a terminal. """
+
+    def __init__(self):
+        super().__init__()
+        self.stdin = None
+
+    def _read(self):
+        if sys.stdin is not self.stdin:
+            # sys.stdin was replaced; anything buffered from the old one is still read
+            self.stdin = sys.stdin
+            self.read_block = _reader(sys.stdin)
+        return self.read_block()
+
+    def input(self, prompt):
+        if self.pos == len(self.buffer) and not self.tokens and _isatty(sys.stdin):
+            try:
+                return builtins.input(prompt)
+            except EOFError:
+                return None
+        return super().input(prompt)
+
+class StringSource(Source):
+    """ Reads from a str or bytes. """
+
+    def __init__(self, data):
+        super().__init__()
+        self.buffer = data.encode('utf-8') if isinstance(data, str) else bytes(data)
+        self.at_end = True
+
+class MappedSource(Source):
+    """ Reads a file through mmap(), a block at a time; close() unmaps it. """
+
+    def __init__(self, filename):
+        super().__init__()
+        self.map = None
+        self.offset = 0
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > 0:  # Empty files can't be mapped
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.at_end = self.map is None
+
+    def _read(self):
+        block = self.map[self.offset:self.offset + BLOCK_SIZE]
+        self.offset += len(block)
+        return block
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.at_end = True
+
+def _isatty(file):
+    try:
+        return file.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+def make_source(input):
+    """ Return the source for an interpreter's input argument; see above. """
+    if input is None:
+        return StdinSource()
+    elif isinstance(input, Source):
+        return input
+    elif isinstance(input, (str, bytes)):
+        return StringSource(input)
+    elif hasattr(input, 'read'):
+        return FileSource(input)
+    raise TypeError("input must be a file, str, bytes or source, not {!r}".format(input))
@@ -3,14 +3,22 @@
 # vim: ts=4 sts=4 et sw=4
 
 import math
+import operator
 import sys
+import threading
+import time
 from ply import lex, yacc
-from .common import *  # decode_escapes, VERSION, DATE and exceptions, mostly
-from . import lexer, parser
-from .ast import (Node, Value, Ident, BinaryOp, UnaryOp, Function, Conditional,
-                  While, FunctionCall, ControlFlowStatement, Comparison, ComparisonOp)
-
-__all__ = ['evaluate', 'evaluate_command', 'evaluate_file']
+from .common import *  # VERSION, DATE and exceptions, mostly
+from . import lexer, parser, optimizer, series, compiler, profile, memo, parallel, cache
+from .output import make_sink
+from .inputs import make_source
+from .ast import (Value, Ident, BinaryOp, UnaryOp, Function, Conditional,
+                  While, FunctionCall, ControlFlowStatement, Comparison, ComparisonOp,
+                  TempStore, TempLoad, Square, ModPow, Increment, ProductCompare,
+                  WhileCompare, IfDivisible, ReturnVar, CountedLoop, Reduction,
+                  SpecializedCall, ReorderedChain)
+
+__all__ = ['Interpreter', 'evaluate', 'evaluate_many', 'evaluate_command', 'evaluate_file']
 
 #
 # The Procyon interpreter. Takes a string and passes it to lex and yacc,
@@ -70,22 +78,15 @@ __all__ = ['evaluate', 'evaluate_command', 'evaluate_file']
 # from the global scope, as long as the access from the global scope occurs later in the
 # interpretation process.
 
-# A scope is written as a tuple, (outer/parent scope, {'name': val, 'name2': val2, ...})
-# The global scope has None as its parent.
+# A scope is written as a tuple,
+# (outer/parent scope, {'name': val, 'name2': val2, ...}, interpreter)
+# The global scope has None as its parent. All scopes refer to the Interpreter running
+# the program, whose globals dict is its global scope's, for $name variables.
 
 def _new_scope(cur_scope, vars, values):
     """ Create a new scope, for e.g. a function. """
     assert len(vars) == len(values)
-    return (cur_scope, {k: v for k, v in zip(vars, values)})
-
-def _var_exists(scope, var):
-    """ Test if a variable exists in a given scope, or (recursively) in any outer scope. """
-    try:
-        _read_var(scope, var)
-    except ProcyonNameError:
-        return False
-
-    return True
+    return (cur_scope, {k: v for k, v in zip(vars, values)}, cur_scope[2])
 
 def _read_var(scope, var):
     """ Look for a variable in the current scope, and if found, return its value.
@@ -101,7 +102,7 @@ def _read_var(scope, var):
 
     if name[0] == '$':
         try:
-            return __global_scope[1][name]
+            return scope[2].globals[name]
         except KeyError:
             raise ProcyonNameError(var.pos, 'unknown identifier "{}"'.format(name))
     else:
@@ -117,6 +118,27 @@ def _read_var(scope, var):
                 # There is no parent scope, and we still haven't found it. Give up.
                 raise ProcyonNameError(var.pos, 'unknown identifier "{}"'.format(name))
 
+# Returned by _lookup_var for variables that don't exist
+_MISSING = object()
+
+def _lookup_var(scope, name):
+    """ Like _read_var, but takes a name, and returns _MISSING instead of raising an exception.
+
+        Used where a missing variable is an expected case, such as when calling built-in
+        functions, which never exist as variables.
+    """
+
+    if name[0] == '$':
+        return scope[2].globals.get(name, _MISSING)
+
+    while scope is not None:
+        val = scope[1].get(name, _MISSING)
+        if val is not _MISSING:
+            return val
+        scope = scope[0]
+
+    return _MISSING
+
 def _assign_var(scope, var, value):
     """ Set a variable in a given scope. Returns the value that was assigned.
 
@@ -130,7 +152,7 @@ def _assign_var(scope, var, value):
     """
 
     if var[0] == '$':
-        __global_scope[1][var] = value
+        scope[2].globals[var] = value
         return value
     else:
         scope[1][var] = value
@@ -152,30 +174,276 @@ __functions = {'sin': 1, 'cos': 1, 'tan': 1,
                'asinh': 1, 'acosh': 1, 'atanh': 1,
                'abs': 1, 'sqrt': 1, 'ceil': 1, 'floor': 1,
                'trunc': 1, 'round': 2, 'print': -1, 'abort': 0,
-               'input_str': 1, 'input_int': 1, 'input_float': 1}
+               'input_str': 1, 'input_int': 1, 'input_float': 1,
+               'read_int': 0, 'read_float': 0, 'read_str': 0, 'read_line': 0, 'eof': 0,
+               'pmap_reduce': 4}
+
+# The built-ins that read input (see inputs.py)
+_input_functions = frozenset(('input_str', 'input_int', 'input_float',
+                              'read_int', 'read_float', 'read_str', 'read_line', 'eof'))
 
-def _init_global_scope():
-    global __global_scope
-    __global_scope = (None, __initial_state.copy())
+# The Python functions implementing the built-ins; abort, input and pmap_reduce
+# are special cases
+__implementations = {f: getattr(math, f, None) or getattr(sys.modules['builtins'], f)
+                     for f in __functions if f not in ('abort', 'pmap_reduce') and
+                     f not in _input_functions}
 
 # Built-in constants; these are overwritable by design
 __initial_state = {'e': math.e, 'pi': math.pi}
-_init_global_scope()
 
-def evaluate(s, clear_state=False, last=None):
-    """ Evaluate an entire program, in the form of a string.
+def _initial_globals():
+    return __initial_state.copy()
+
+# ply's yacc() may write the parser tables to disk the first time it runs
+_parser_lock = threading.Lock()
+
+def _new_parser():
+    """ Return a new (lexer, parser) pair. Each can only parse one program at a time. """
+    with _parser_lock:
+        lex_lexer = lex.lex(module=lexer, debug=False, optimize=False)
+        yacc_parser = yacc.yacc(module=parser, debug=True, start="toplevel")
+    return (lex_lexer, yacc_parser)
+
+def parse(s):
+    """ Parse a program, in the form of a string, and return the list of statements. """
+
+    lex_lexer, yacc_parser = _new_parser()
+    return yacc_parser.parse(s, lexer=lex_lexer, debug=DEBUGPARSE)
+
+##
+### INTERPRETER INSTANCES
+##
+
+class Interpreter:
+    """ A Procyon interpreter, with its own global variables and settings.
+
+        Interpreters are independent of each other, so that several programs can run at
+        the same time, e.g. in different threads. Each interpreter runs one program at a
+        time; calls from other threads wait for the current one to finish.
+
+        The module-level evaluate() and evaluate_command() use a default interpreter,
+        which is what the REPL uses.
+
+        Keyword arguments:
+        optimize -- the default optimization level for evaluate()
+        output -- where print() writes to: a sink, or anything output.make_sink() takes,
+                  such as a file; None means whatever sys.stdout is
+        budget -- a budget.Budget limiting each program, or None for no limits
+        input -- where input_* and read_* read from: a source, or anything
+                 inputs.make_source() takes, such as a file or a string; None means
+                 whatever sys.stdin is
+        program_cache -- the cache.ProgramCache for evaluate(); None means cache.programs
+        memo_store -- the memo.MemoStore for memo functions; None means memo.store
+        jit_threshold, osr_threshold -- how many calls (loop iterations) it takes to
+                 compile a function (loop); None means compiler.JIT_THRESHOLD
+                 (OSR_THRESHOLD)
+
+        The settings that are None follow the module-level defaults, also when those
+        change. The built-in functions are a table shared by all interpreters; nothing
+        changes it.
+
+        The output is buffered; it is flushed when evaluate() returns, and before input_*.
+    """
+
+    def __init__(self, optimize=1, output=None, budget=None, input=None, program_cache=None,
+                 memo_store=None, jit_threshold=None, osr_threshold=None):
+        self.optimize = optimize
+        self.output = output
+        self.budget = budget
+        self.input = input
+        self._program_cache = program_cache
+        self._memo_store = memo_store
+        self._jit_threshold = jit_threshold
+        self._osr_threshold = osr_threshold
+        self.lock = threading.RLock()
+        self.parser = None
+        self.reset()
+
+    @property
+    def output(self):
+        return self._output
+
+    @output.setter
+    def output(self, output):
+        self._output = output
+        self.sink = make_sink(output)
+
+    @property
+    def input(self):
+        return self._input
+
+    @input.setter
+    def input(self, input):
+        self._input = input
+        self.source = make_source(input)
+
+    @property
+    def program_cache(self):
+        return cache.programs if self._program_cache is None else self._program_cache
+
+    @program_cache.setter
+    def program_cache(self, program_cache):
+        self._program_cache = program_cache
+
+    @property
+    def memo_store(self):
+        return memo.store if self._memo_store is None else self._memo_store
+
+    @memo_store.setter
+    def memo_store(self, memo_store):
+        self._memo_store = memo_store
+
+    @property
+    def jit_threshold(self):
+        return compiler.JIT_THRESHOLD if self._jit_threshold is None else self._jit_threshold
+
+    @jit_threshold.setter
+    def jit_threshold(self, jit_threshold):
+        self._jit_threshold = jit_threshold
+
+    @property
+    def osr_threshold(self):
+        return compiler.OSR_THRESHOLD if self._osr_threshold is None else self._osr_threshold
+
+    @osr_threshold.setter
+    def osr_threshold(self, osr_threshold):
+        self._osr_threshold = osr_threshold
+
+    def reset(self):
+        """ Forget all variables and functions, as in a new interpreter. """
+        self.globals = _initial_globals()
+        self.scope = (None, self.globals, self)
+
+    def parse(self, s):
+        """ Parse a program, in the form of a string, and return the list of statements. """
+        with self.lock:
+            if self.parser is None:
+                self.parser = _new_parser()
+            lex_lexer, yacc_parser = self.parser
+            lex_lexer.lineno = 1
+            return yacc_parser.parse(s, lexer=lex_lexer, debug=DEBUGPARSE)
+
+    def evaluate(self, s, clear_state=False, last=None, optimize=None, report=None,
+                 profile_out=None, profile_in=None, budget=None, input=None):
+        """ Evaluate an entire program, in the form of a string; see evaluate().
+
+            A budget or input given here is used instead of the interpreter's own.
+        """
+        with self.lock:
+            saved, saved_source = self.budget, self.source
+            if budget is not None:
+                self.budget = budget
+            if input is not None:
+                self.source = make_source(input)
+            try:
+                return _evaluate_program(self, s, clear_state, last,
+                                         self.optimize if optimize is None else optimize,
+                                         report, profile_out, profile_in)
+            finally:
+                self.budget, self.source = saved, saved_source
+                self.sink.flush()
+
+    def evaluate_many(self, sources, shared_state=False, optimize=None, stats=None):
+        """ Evaluate a number of programs one after the other; see evaluate_many(). """
+        if stats is None:
+            stats = {}
+        stats.update(programs=0, failed=0, seconds=0.0, programs_per_second=0.0)
+        for s in sources:
+            start = time.perf_counter()
+            try:
+                item = (self.evaluate(s, not shared_state, optimize=optimize), None)
+            except Exception as e:  # The batch goes on, whatever happens to a program
+                item = (None, e)
+                stats['failed'] += 1
+            # Only the time spent in the programs counts, not the caller's
+            stats['seconds'] += time.perf_counter() - start
+            stats['programs'] += 1
+            if stats['seconds'] > 0:
+                stats['programs_per_second'] = stats['programs'] / stats['seconds']
+            yield item
+
+    def evaluate_command(self, cmd):
+        """ Evaluate a REPL command; see evaluate_command(). """
+        with self.lock:
+            return _evaluate_command(self, cmd)
+
+_default = Interpreter()
+
+def evaluate(s, clear_state=False, last=None, optimize=1, report=None, profile_out=None,
+             profile_in=None, budget=None, input=None):
+    """ Evaluate an entire program, in the form of a string, in the default interpreter.
 
     Keyword arguments:
     clear_state -- if True, the interpreter state is reset prior to evaluating the program
     last -- the value to assign to the _ variable throughout the evaluation of the entire program
+    optimize -- optimization level passed to the optimizer; 0 disables all optimizations
+    report -- if a dict is passed, it is filled with statistics from the optimizer, such as
+              the number of AST nodes before and after optimization
+    profile_out -- if a profile.Profile is passed, the run is recorded in it
+    profile_in -- a profile.Profile from an earlier run, used to optimize this one; it is
+                  ignored unless it was recorded for this exact program
+    budget -- a budget.Budget with limits for this program; exceeding them raises a
+              ProcyonLimitError
+    input -- where the program's input is read from instead of sys.stdin, as for
+             Interpreter
     """
 
+    return _default.evaluate(s, clear_state, last, optimize, report, profile_out, profile_in,
+                             budget, input)
+
+def evaluate_many(sources, shared_state=False, optimize=1, stats=None):
+    """ Evaluate many (small) programs in the default interpreter, and yield a
+    (results, error) pair for each, as they finish.
+
+    This saves building a parser and an interpreter per program. Each program starts with
+    a fresh global state, unless shared_state is True, in which case each program sees the
+    variables and functions defined by the ones before it. A program that fails has None as
+    its results and the exception as its error; the others still run.
+
+    Keyword arguments:
+    optimize -- optimization level passed to the optimizer, as for evaluate()
+    stats -- if a dict is passed, it is kept up to date with the number of programs run,
+             how many of them failed, the seconds spent running them, and programs_per_second
+    """
+
+    return _default.evaluate_many(sources, shared_state, optimize, stats)
+
+def _evaluate_program(interp, s, clear_state, last, optimize, report, profile_out, profile_in):
     if len(s.rstrip()) == 0:
         return None
 
-    lex_lexer = lex.lex(module=lexer, debug=False, optimize=False)
-    yacc_parser = yacc.yacc(module=parser, debug=True, start="toplevel")
-    parse_tree = yacc_parser.parse(s, lexer=lex_lexer, debug=DEBUGPARSE)
+    if report is None:
+        report = {}
+    if profile_in is not None and not profile_in.matches(s):
+        profile_in = None
+
+    # The optimizer's output depends on the profile, so such runs aren't cached
+    cached = interp.program_cache.get(s, optimize) if profile_in is None else None
+    if cached is not None:
+        parse_tree, cached_report = cached
+        report.update(cached_report)
+    else:
+        parse_tree = _parse_program(interp, s, optimize, report, profile_in)
+
+    if clear_state:
+        interp.reset()
+
+    if last:  # ignore coverage
+        # This is only used in the REPL, which isn't automatically tested.
+        interp.globals['_'] = last
+
+    if interp.budget is not None:
+        interp.budget.start()
+
+    if profile_out is not None:
+        with profile.Recorder(profile_out, s, parse_tree, interp):
+            return _evaluate_all(parse_tree, interp.scope)
+
+    return _evaluate_all(parse_tree, interp.scope)
+
+def _parse_program(interp, s, optimize, report, profile_in):
+    """ Parse and optimize a program, and add it to the program cache. """
+    parse_tree = interp.parse(s)
 
     if DEBUGPARSE:
         # Yep, this is (up to) 200 chars wide!
@@ -190,14 +458,21 @@ def evaluate(s, clear_state=False, last=None):
         print(tstr)
         print("-" * max_len)
 
-    if clear_state:
-        _init_global_scope()
+    memo.check_purity(parse_tree, __functions)
 
-    if last:  # ignore coverage
-        # This is only used in the REPL, which isn't automatically tested.
-        __global_scope[1]['_'] = last
+    parse_tree = optimizer.optimize(parse_tree, __functions, optimize, report, profile_in)
+    if profile_in is not None:
+        report['profile_compiled'] = profile.apply(profile_in, parse_tree, interp.jit_threshold,
+                                                   interp.osr_threshold)
+    else:
+        interp.program_cache.put(s, optimize, parse_tree, report)
 
-    return _evaluate_all(parse_tree, __global_scope)
+    if DEBUGPARSE:
+        print("Optimizer: {} nodes removed ({} -> {}); {}".format(
+            report['nodes_before'] - report['nodes_after'], report['nodes_before'],
+            report['nodes_after'], report))
+
+    return parse_tree
 
 def evaluate_file(filename, clear_state=False):
     """ Evaluate a program file, by reading it and passing the contents to evaluate().
@@ -211,247 +486,575 @@ def evaluate_file(filename, clear_state=False):
         program = f.read()
         return evaluate(program, clear_state)
 
+def _math(pos, op, left, right):
+    """ Calculate the result of a math operation, or raise a type error. """
+
+    if type(left) != type(right) and not (
+            type(left) in (int, float) and type(right) in (int, float)):
+        raise ProcyonTypeError(
+            pos, "binary operation on expressions of different types: "
+            "{} {} {}".format(left, op, right))
+
+    if type(left) is str and type(right) is str and op != '+':
+        raise ProcyonTypeError(pos, "operator {} is not defined on strings".format(op))
+
+    if op == '+':
+        return left + right
+    elif op == '-':
+        return left - right
+    elif op == '*':
+        return left * right
+    elif op == '/':
+        return left / right
+    elif op == '//':
+        return left // right
+    elif op == '^':
+        return left ** right
+    elif op == '%':
+        return left % right
+
+def _compare(pos, op, left, right):
+    """ Compare two values, returning True or False, or raise a type error. """
+
+    if type(left) != type(right) and not (
+            type(left) in (int, float) and type(right) in (int, float)):
+        raise ProcyonTypeError(
+            pos, "comparison between incompatible types: "
+            "{} {} {}".format(left, op, right))
+
+    if op == '==':
+        return left == right
+    elif op == '!=':
+        return left != right
+    elif op == '>':
+        return left > right
+    elif op == '<':
+        return left < right
+    elif op == '<=':
+        return left <= right
+    elif op == '>=':
+        return left >= right
+    else:
+        raise ProcyonInternalError("unknown operator in comparison")
+
+# Used by nodes that compare two ints directly, skipping the type checks in _compare()
+_int_comparisons = {'==': operator.eq, '!=': operator.ne, '<': operator.lt,
+                    '>': operator.gt, '<=': operator.le, '>=': operator.ge}
+
 def _evaluate_all(trees, scope):
     """ Evaluate a full set of statements and return a list of results. """
 
     return [_evaluate_tree(tree, scope) for tree in trees]
 
 def _evaluate_tree(tree, scope):
-    """ Recursively evaluate a parse tree and return the result. """
-
-    if isinstance(tree, BinaryOp):
-        if tree.kind == 'math':
-            left_child, op, right_child = tree.left, tree.op, tree.right
-            left = _evaluate_tree(left_child, scope)
-            right = _evaluate_tree(right_child, scope)
-
-            if type(left) != type(right) and not (
-                    type(left) in (int, float) and type(right) in (int, float)):
-                raise ProcyonTypeError(
-                    tree.pos, "binary operation on expressions of different types: "
-                    "{} {} {}".format(left, op, right))
-
-            if type(left) is str and type(right) is str and op != '+':
-                raise ProcyonTypeError(tree.pos, "operator {} is not defined on strings".format(op))
-
-            if op == '+':
-                return left + right
-            elif op == '-':
-                return left - right
-            elif op == '*':
-                return left * right
-            elif op == '/':
-                return left / right
-            elif op == '//':
-                return left // right
-            elif op == '^':
-                return left ** right
-            elif op == '%':
-                return left % right
-
-        elif tree.kind == "logical":
-            # && and || are a bit special in that they must use
-            # short-circuit evaluation.
-            # (I assume that *could* be used for other comparisons as well, but
-            #  it seems more important for these.)
-
-            left_child, op, right_child = tree.left, tree.op, tree.right
-
-            left = _evaluate_tree(left_child, scope)
-
-            # Test if we can short-circuit
-            if op == '||' and left:
-                return 1
-            elif op == '&&' and not left:
-                return 0
-
-            # We couldn't, so we must evaluate the right side also
-            right = _evaluate_tree(right_child, scope)
-
-            # If this is an AND operation, we know the left side is true already,
-            # so if the right side is true, we return 1.
-            # If this is an OR operation, we know the left side is *false* already,
-            # so if the right side is true, we return 1.
-            return 1 if right else 0
-
-        elif tree.kind == "assign":
-            name = tree.left.name
-
-            if name in __functions:
-                raise ProcyonTypeError(
-                    tree.left.pos, 'cannot assign to built-in function "{}"'.format(name))
-
-            val = tree.right
-            return _assign_var(scope, name, _evaluate_tree(val, scope))
-
-    elif isinstance(tree, UnaryOp):
-        if tree.op == '-':
-            return -_evaluate_tree(tree.arg, scope)
-        elif tree.op == '!':
-            return int(not _evaluate_tree(tree.arg, scope))
-
-    elif isinstance(tree, Value):
-        # kind does not matter, we want to return the value in all cases
-        return tree.value
-
-    elif isinstance(tree, Comparison):
-        # chunk(['a', '>', 'b', '>=', 'c', '==', 'd']) generates the list
-        # [['a', '>', 'b'], ['b', '>=', 'c'], ['c', '==', 'd']]
-        # except it uses Python generators
-        def chunk(l):
-            for i in range(0, len(l) - 1, 2):
-                yield l[i:i+3]
-
-        def comp_one(left_tree, op_node, right_tree):
-            left = _evaluate_tree(left_tree, scope)
-            right = _evaluate_tree(right_tree, scope)
-
-            if type(left) != type(right) and not (
-                    type(left) in (int, float) and type(right) in (int, float)):
-                raise ProcyonTypeError(
-                    op_node.pos, "comparison between incompatible types: "
-                    "{} {} {}".format(left, op_node.op, right))
-
-            op = op_node.op
-
-            if op == '==':
-                return int(left == right)
-            elif op == '!=':
-                return int(left != right)
-            elif op == '>':
-                return int(left > right)
-            elif op == '<':
-                return int(left < right)
-            elif op == '<=':
-                return int(left <= right)
-            elif op == '>=':
-                return int(left >= right)
-            else:
-                raise ProcyonInternalError("unknown operator in comp_one")
+    """ Recursively evaluate a parse tree and return the result.
+
+        Each node type has its own _evaluate_* function, found through the _evaluators
+        table at the end of this section, so that every node costs a single lookup.
+        With a budget, every node also counts as a step; see budget.py.
+    """
+
+    budget = scope[2].budget
+    if budget is not None:
+        budget.countdown -= 1
+        if budget.countdown <= 0:
+            budget.check(tree.pos)
 
-        # ("a", ">", "b") -> [comp_one(a, >, b)]
-        # ("a", ">", "b", ">=", "c") -> [comp_one(a, >, b), comp_one(b, >=, c)]
-        return int(all(comp_one(*c) for c in chunk(tree.contents)))
+    try:
+        evaluator = _evaluators[tree.__class__]
+    except KeyError:
+        raise ProcyonInternalError('reached end of _evaluate_tree! tree: {}'.format(tree))
+
+    return evaluator(tree, scope)
+
+def _evaluate_binary_op(tree, scope):
+    if tree.kind == 'math':
+        left = _evaluate_tree(tree.left, scope)
+        right = _evaluate_tree(tree.right, scope)
+        budget = scope[2].budget
+        if budget is not None:
+            return budget.math(tree.pos, tree.op, left, right)
+        return _math(tree.pos, tree.op, left, right)
+
+    elif tree.kind == "logical":
+        # && and || are a bit special in that they must use
+        # short-circuit evaluation.
+        # (I assume that *could* be used for other comparisons as well, but
+        #  it seems more important for these.)
+
+        left_child, op, right_child = tree.left, tree.op, tree.right
+
+        left = _evaluate_tree(left_child, scope)
+
+        # Test if we can short-circuit
+        if op == '||' and left:
+            return 1
+        elif op == '&&' and not left:
+            return 0
+
+        # We couldn't, so we must evaluate the right side also
+        right = _evaluate_tree(right_child, scope)
+
+        # If this is an AND operation, we know the left side is true already,
+        # so if the right side is true, we return 1.
+        # If this is an OR operation, we know the left side is *false* already,
+        # so if the right side is true, we return 1.
+        return 1 if right else 0
 
-    elif isinstance(tree, Ident):
-        if tree.name in __functions:
+    elif tree.kind == "assign":
+        name = tree.left.name
+
+        if name in __functions:
             raise ProcyonTypeError(
-                tree.pos, "can't use built-in function \"{}\" as a variable".format(tree.name))
+                tree.left.pos, 'cannot assign to built-in function "{}"'.format(name))
 
-        try:
-            return _read_var(scope, tree)
-        except ProcyonNameError:
-            raise ProcyonNameError(tree.pos, 'unknown identifier "{}"'.format(tree.name))
-
-    elif isinstance(tree, FunctionCall):
-        func_ident = tree.func_name
-        func_name = func_ident.name
-        args = tree.args
-
-        if func_name == "abort":
-            # Bit of a hack, but hey... This can't really be implemented
-            # as an actual function, so it has to be some sort of special case.
-            raise ProcyonControlFlowException(func_ident.pos, {"type": "abort"})
-
-        if func_name not in __functions and not _var_exists(scope, func_ident):
-            raise ProcyonNameError(func_ident.pos, 'unknown function "{}"'.format(func_name))
-
-        # OK, so it exists either as a built-in (__functions) or a user-defined function.
-        # Check if it's user-defined, first:
-
-        if _var_exists(scope, func_ident):
-            f = _read_var(scope, func_ident)
-            if isinstance(f, Function):
-                return _evaluate_function(f, args, scope)
-            else:
-                raise ProcyonTypeError(
-                    func_ident.pos, 'attempted to call non-function "{}"'.format(func_name))
+        val = tree.right
+        return _assign_var(scope, name, _evaluate_tree(val, scope))
+
+def _evaluate_unary_op(tree, scope):
+    if tree.op == '-':
+        return -_evaluate_tree(tree.arg, scope)
+    elif tree.op == '!':
+        return int(not _evaluate_tree(tree.arg, scope))
+
+def _evaluate_value(tree, scope):
+    # kind does not matter, we want to return the value in all cases
+    return tree.value
+
+def _evaluate_comparison(tree, scope):
+    # a > b >= c is evaluated as a > b && b >= c, except that b is only evaluated once.
+    # Like && it short-circuits, so c is not evaluated unless a > b.
+    contents = tree.contents
+    left = _evaluate_tree(contents[0], scope)
+
+    for i in range(1, len(contents), 2):
+        op_node = contents[i]
+        right = _evaluate_tree(contents[i + 1], scope)
+        result = _compare(op_node.pos, op_node.op, left, right)
 
-        assert not _var_exists(scope, func_ident)
-        assert func_name in __functions
+        if not result:
+            return 0
 
-        # If we got here, the function is a Python function,
-        # either from math, or a built-in (abs, round, print and possibly others).
+        left = right
 
-        if __functions[func_name] > 0 and len(args) != __functions[func_name]:
+    return 1
+
+def _evaluate_ident(tree, scope):
+    if tree.name in __functions:
+        raise ProcyonTypeError(
+            tree.pos, "can't use built-in function \"{}\" as a variable".format(tree.name))
+
+    try:
+        return _read_var(scope, tree)
+    except ProcyonNameError:
+        raise ProcyonNameError(tree.pos, 'unknown identifier "{}"'.format(tree.name))
+
+def _evaluate_increment(tree, scope):
+    # Reading the variable gives the same errors as the original x += 1 would
+    val = _evaluate_tree(tree.ident, scope)
+    if type(val) is int:
+        val = val + tree.step if tree.op == '+' else val - tree.step
+    else:
+        val = _math(tree.pos, tree.op, val, tree.step)
+    return _assign_var(scope, tree.ident.name, val)
+
+def _evaluate_product_compare(tree, scope):
+    left = _evaluate_tree(tree.left, scope)
+    right = left if tree.right is tree.left else _evaluate_tree(tree.right, scope)
+    if type(left) is int and type(right) is int:
+        product = left * right
+    else:
+        product = _math(tree.mul_pos, '*', left, right)
+    return int(_compare(tree.pos, tree.op, product, _evaluate_tree(tree.other, scope)))
+
+def _evaluate_square(tree, scope):
+    val = _evaluate_tree(tree.arg, scope)
+    budget = scope[2].budget
+    if budget is not None:
+        return budget.math(tree.pos, '^', val, 2)
+    if type(val) is int:
+        return val * val
+    return _math(tree.pos, '^', val, 2)
+
+def _evaluate_mod_pow(tree, scope):
+    base = _evaluate_tree(tree.base, scope)
+    exp = _evaluate_tree(tree.exp, scope)
+    if type(base) is int and type(exp) is int and exp >= 0:
+        mod = _evaluate_tree(tree.mod, scope)
+        if type(mod) is int and mod != 0:
+            return pow(base, exp, mod)
+        if scope[2].budget is not None:
+            return _math(tree.pos, '%', scope[2].budget.math(tree.pow_pos, '^', base, exp), mod)
+        return _math(tree.pos, '%', base ** exp, mod)
+
+    # Not all ints; calculate it like the original expression would
+    budget = scope[2].budget
+    val = (_math if budget is None else budget.math)(tree.pow_pos, '^', base, exp)
+    return _math(tree.pos, '%', val, _evaluate_tree(tree.mod, scope))
+
+def _evaluate_temp_load(tree, scope):
+    return scope[1][tree.slot]
+
+def _evaluate_temp_store(tree, scope):
+    val = _evaluate_tree(tree.expr, scope)
+    scope[1][tree.slot] = val
+    return val
+
+def _evaluate_call(tree, scope):
+    f = _resolve_call(tree, scope)
+    if f is not None:
+        # _evaluate_function, inlined to save a Python stack frame per Procyon call
+        _check_arity(f, len(tree.args))
+        args = [_evaluate_tree(a, scope) for a in tree.args]
+        if f.cache is None:
+            return _run_function(f, args, scope)
+        return _call_function(f, args, scope)
+
+    args = [_evaluate_tree(arg, scope) for arg in tree.args]
+    return _call_builtin(tree.func_name, args, scope)
+
+def _resolve_call(tree, scope):
+    """ Find the function a call refers to.
+
+        Returns the Function for calls to user-defined functions, and None for built-in
+        functions, once the number of arguments has been checked.
+    """
+    func_ident = tree.func_name
+    func_name = func_ident.name
+    args = tree.args
+
+    if func_name == "abort":
+        # Bit of a hack, but hey... This can't really be implemented
+        # as an actual function, so it has to be some sort of special case.
+        raise ProcyonControlFlowException(func_ident.pos, {"type": "abort"})
+
+    # Check if it's user-defined, first:
+    f = _lookup_var(scope, func_name)
+    if f is not _MISSING:
+        if isinstance(f, Function):
+            return f
+        else:
             raise ProcyonTypeError(
-                func_ident.pos, '{} requires exactly {} arguments, {} provided'.format(
-                    func_name, __functions[func_name], len(args)))
+                func_ident.pos, 'attempted to call non-function "{}"'.format(func_name))
 
-        args = [_evaluate_tree(arg, scope) for arg in args]
+    if func_name not in __functions:
+        raise ProcyonNameError(func_ident.pos, 'unknown function "{}"'.format(func_name))
 
-        if func_name in ('input_str', 'input_int', 'input_float'):
-            return _handle_input(func_ident, args[0])  # ignore coverage
+    # If we got here, the function is a Python function,
+    # either from math, or a built-in (abs, round, print and possibly others).
 
-        func = None
-        try:
-            func = getattr(math, func_name)
-        except AttributeError:
-            func = getattr(sys.modules['builtins'], func_name)
-
-        if func == print:
-            # Backslashes need some help. The string "Hello\\ \n" is printed
-            # verbatim (followed by the newline print inserts), instead of
-            # having a backslash, a space, and a blank line (itself ended by
-            # another newline).
-            print(*[decode_escapes(a) for a in args])
+    if __functions[func_name] >= 0 and len(args) != __functions[func_name]:
+        raise ProcyonTypeError(
+            func_ident.pos, '{} requires exactly {} arguments, {} provided'.format(
+                func_name, __functions[func_name], len(args)))
+
+    return None
+
+def _call_builtin(func_ident, args, scope):
+    """ Call a built-in function with already evaluated arguments. """
+    func_name = func_ident.name
+
+    if func_name in _input_functions:
+        return _read_input(func_ident, args, scope[2])
+    elif func_name == 'pmap_reduce':
+        return parallel.pmap_reduce(func_ident.pos, args, scope)
+
+    func = __implementations[func_name]
+
+    if func == print:
+        # Escape sequences in string literals were decoded by the lexer
+        scope[2].sink.write(" ".join([str(a) for a in args]) + "\n")
+        return None
+    else:
+        return func(*args)
+
+def _evaluate_specialized_call(tree, scope):
+    call = tree.call
+    if _lookup_var(scope, call.func_name.name) is tree.target:
+        return _evaluate_function(tree.func, call.args, scope)
+    return _evaluate_call(call, scope)
+
+def _evaluate_conditional(tree, scope):
+    # NOTE: if statements (and loops) do NOT create new scopes.
+    # The closest function's scope is used, so creating a variable
+    # inside an if block and later using it outside is fine.
+    if _evaluate_tree(tree.cond, scope):
+        for stmt in tree.then_body:
+            _evaluate_tree(stmt, scope)
+    elif tree.else_body:
+        for stmt in tree.else_body:
+            _evaluate_tree(stmt, scope)
+
+    return None
+
+def _evaluate_reordered_chain(tree, scope):
+    # Reading the variable first gives the same errors as the original chain would
+    value = _evaluate_ident(tree.ident, scope)
+    if not (type(value) in (int, float) if tree.numeric else type(value) is str):
+        # The first comparison raises a type error; leave that to the original
+        return _evaluate_conditional(tree.chain, scope)
+
+    cases = tree.cases
+    for i in tree.order:
+        if value == cases[i].cond.contents[2].value:
+            for stmt in cases[i].then_body:
+                _evaluate_tree(stmt, scope)
             return None
+
+    if tree.else_body:
+        for stmt in tree.else_body:
+            _evaluate_tree(stmt, scope)
+    return None
+
+def _evaluate_while(tree, scope):
+    # Programs with a budget run in the tree walker only
+    if tree.compiled is not None and scope[2].budget is None:
+        return tree.compiled(scope)
+
+    while _evaluate_tree(tree.cond, scope):
+        try:
+            for stmt in tree.body:
+                _evaluate_tree(stmt, scope)
+        except ProcyonControlFlowException as ex:
+            # I'd like to call this variable "type", but that didn't work out too well...
+            # (Python's type() function stopped working elsewhere :-)
+            t = ex.args[1]["type"]
+            if t == "break":
+                return None
+            elif t != "continue":
+                raise  # return or abort; this is handled elsewhere
+
+        tree.back_edges += 1
+        if tree.back_edges == scope[2].osr_threshold and scope[2].budget is None:
+            # This loop is hot; continue in the compiled version (on-stack replacement).
+            # All its state is in the scope, so it simply starts at the next test.
+            return compiler.osr_entry(tree)(scope)
+
+    return None
+
+def _evaluate_control_flow(tree, scope):
+    if tree.kind in ("break", "continue"):
+        raise ProcyonControlFlowException(tree.pos, {"type": tree.kind})
+    elif tree.kind == "return":
+        if tree.arg is not None:
+            val = _evaluate_tree(tree.arg, scope)
+            raise ProcyonControlFlowException(tree.pos, {"type": "return", "value": val})
         else:
-            return func(*args)
+            raise ProcyonControlFlowException(tree.pos, {"type": "return", "value": None})
 
-    elif isinstance(tree, Conditional):
-        # NOTE: if statements (and loops) do NOT create new scopes.
-        # The closest function's scope is used, so creating a variable
-        # inside an if block and later using it outside is fine.
-        if _evaluate_tree(tree.cond, scope):
-            _evaluate_all(tree.then_body, scope)
-        elif tree.else_body:
-            _evaluate_all(tree.else_body, scope)
+#
+# Superinstructions: fused nodes for the most common statement shapes.
+# They do the work of several regular nodes at once, and fall back to the
+# same code as those regular nodes for anything but ints.
+#
 
-        return None
+def _evaluate_while_compare(tree, scope):
+    left_node, right_node, op = tree.left, tree.right, tree.op
+    int_compare = _int_comparisons[op]
+    if tree.compiled is not None and scope[2].budget is None:
+        return tree.compiled(scope)
+
+    while True:
+        left = _evaluate_tree(left_node, scope)
+        right = _evaluate_tree(right_node, scope)
+        if type(left) is int and type(right) is int:
+            if not int_compare(left, right):
+                return None
+        elif not _compare(tree.op_pos, op, left, right):
+            return None
 
-    elif isinstance(tree, While):
-        while _evaluate_tree(tree.cond, scope):
-            try:
-                _evaluate_all(tree.body, scope)
-            except ProcyonControlFlowException as ex:
-                # I'd like to call this variable "type", but that didn't work out too well...
-                # (Python's type() function stopped working elsewhere :-)
-                t = ex.args[1]["type"]
-                if t == "break":
-                    return None
-                elif t == "continue":
-                    continue
-                else:
-                    raise  # return or abort; this is handled elsewhere
+        try:
+            for stmt in tree.body:
+                _evaluate_tree(stmt, scope)
+        except ProcyonControlFlowException as ex:
+            t = ex.args[1]["type"]
+            if t == "break":
+                return None
+            elif t != "continue":
+                raise  # return or abort; this is handled elsewhere
+
+        tree.back_edges += 1
+        if tree.back_edges == scope[2].osr_threshold and scope[2].budget is None:
+            return compiler.osr_entry(tree)(scope)
+
+def _evaluate_if_divisible(tree, scope):
+    left = _evaluate_tree(tree.left, scope)
+    right = _evaluate_tree(tree.right, scope)
+    if type(left) is int and type(right) is int and right != 0:
+        divisible = left % right == 0
+    else:
+        divisible = _compare(tree.op_pos, '==', _math(tree.mod_pos, '%', left, right), 0)
+
+    if divisible == (tree.op == '=='):
+        for stmt in tree.then_body:
+            _evaluate_tree(stmt, scope)
+    elif tree.else_body:
+        for stmt in tree.else_body:
+            _evaluate_tree(stmt, scope)
 
+    return None
+
+def _evaluate_return_var(tree, scope):
+    val = _evaluate_ident(tree.ident, scope)
+    raise ProcyonControlFlowException(tree.pos, {"type": "return", "value": val})
+
+def _range_stop(op, bound):
+    """ Find the range() stop value for a counted loop, or None if range() can't be used.
+
+        For example, i < 10 and i <= 9 both give 10, and i < 9.5 also gives 10.
+    """
+    if type(bound) is float:
+        if not math.isfinite(bound):
+            return None
+        if op == '<':
+            bound = math.ceil(bound)
+        elif op == '<=':
+            bound = math.floor(bound)
+        elif op == '>':
+            bound = math.floor(bound)
+        else:
+            bound = math.ceil(bound)
+    elif type(bound) is not int:
         return None
 
-    elif isinstance(tree, ControlFlowStatement):
-        if tree.kind in ("break", "continue"):
-            raise ProcyonControlFlowException(tree.pos, {"type": tree.kind})
-        elif tree.kind == "return":
-            if tree.arg is not None:
-                val = _evaluate_tree(tree.arg, scope)
-                raise ProcyonControlFlowException(tree.pos, {"type": "return", "value": val})
+    return {'<': bound, '<=': bound + 1, '>': bound, '>=': bound - 1}[op]
+
+def _evaluate_counted_loop(tree, scope):
+    name = tree.ident.name
+    local_vars = scope[1]
+
+    # Evaluated in the same order as the original condition
+    start = _evaluate_ident(tree.ident, scope)
+    bound = _evaluate_tree(tree.bound, scope)
+    stop = _range_stop(tree.op, bound) if type(start) is int else None
+    if stop is None:
+        return _evaluate_while(_counted_loop_fallback(tree), scope)
+
+    i = None
+    budget = scope[2].budget
+    compiled = tree.compiled if budget is None else None
+    try:
+        for i in range(start, stop, tree.step):
+            local_vars[name] = i
+            if compiled is not None:
+                compiled(scope)
             else:
-                raise ProcyonControlFlowException(tree.pos, {"type": "return", "value": None})
+                if budget is not None:
+                    # The counter is updated here rather than by a node; count a step
+                    budget.countdown -= 1
+                    if budget.countdown <= 0:
+                        budget.check(tree.pos)
+                for stmt in tree.body:
+                    _evaluate_tree(stmt, scope)
+                tree.back_edges += 1
+                if tree.back_edges == scope[2].osr_threshold and budget is None:
+                    # Hot loop; run the rest of the iterations with a compiled body
+                    compiled = compiler.osr_entry(tree)
+
+            if local_vars.get(name) is not i:
+                # Something changed the counter after all; finish this iteration
+                # and continue as a regular while loop.
+                _evaluate_tree(tree.increment, scope)
+                return _evaluate_while(_counted_loop_fallback(tree), scope)
+    except ProcyonControlFlowException as ex:
+        if ex.args[1]["type"] == "break":
+            return None
+        raise  # return or abort; this is handled elsewhere
+
+    if i is not None:
+        # The final increment, which made the condition false
+        local_vars[name] = i + tree.step
+
+    return None
+
+def _counted_loop_fallback(tree):
+    """ Recreate the original while loop from a CountedLoop. """
+    cond = Comparison(tree.op_pos, [tree.ident, ComparisonOp(tree.op_pos, tree.op), tree.bound])
+    return While(tree.pos, cond, tree.body + [tree.increment])
+
+def _evaluate_reduction(tree, scope):
+    loop = tree.loop
+    start = _evaluate_ident(loop.ident, scope)
+    stop = None
+    if type(start) is int:
+        stop = _range_stop(loop.op, _evaluate_tree(loop.bound, scope))
+    if stop is None:
+        return _evaluate_counted_loop(loop, scope)
+
+    n = series.progression_length(start, stop, loop.step)
+    if n == 0:
+        return None
 
-    elif isinstance(tree, Function):
-        # We ran across a function definition. Bind its set of statements etc. to
-        # a name in the local scope.
-        name = tree.name.name
+    # A missing accumulator (or a string, or a float, where the order of the
+    # additions matters) is left to the loop, which also raises any errors
+    acc = _lookup_var(scope, tree.acc.name)
+    if type(acc) is not int or tree.acc.name in __functions:
+        return _evaluate_counted_loop(loop, scope)
 
-        if name in __functions:
-            raise ProcyonTypeError(
-                tree.name.pos, 'cannot ovewrite built-in function "{}"'.format(name))
+    budget = scope[2].budget
+    if tree.op == '*' and budget is not None and budget.int_bits is not None:
+        # The product can be huge; leave it to the loop, which checks every step
+        return _evaluate_counted_loop(loop, scope)
+
+    if tree.op == '*':
+        if tree.poly == (0, 1):
+            acc *= math.prod(range(start, stop, loop.step))
+        else:
+            acc *= math.prod(series.poly_eval(tree.poly, i)
+                             for i in range(start, stop, loop.step))
+    else:
+        total = series.filtered_sum(tree.poly, start, loop.step, n, tree.divisors)
+        acc = acc + total if tree.op == '+' else acc - total
+        if budget is not None:
+            budget.check_int(tree.pos, acc)
 
-        _assign_var(scope, name, tree)
+    _assign_var(scope, tree.acc.name, acc)
+    scope[1][loop.ident.name] = start + n * loop.step
 
-        return None
+    return None
 
-    raise ProcyonInternalError('reached end of _evaluate_tree! kind={}, tree: {}'.format(
-        kind, tree))
+def _evaluate_function_def(tree, scope):
+    # We ran across a function definition. Bind its set of statements etc. to
+    # a name in the local scope.
+    name = tree.name.name
+
+    if name in __functions:
+        raise ProcyonTypeError(
+            tree.name.pos, 'cannot ovewrite built-in function "{}"'.format(name))
+
+    if tree.memo and tree.cache is None:
+        tree.cache = memo.MemoCache(tree)
+
+    _assign_var(scope, name, tree)
+
+    return None
+
+_evaluators = {
+    Value: _evaluate_value,
+    Ident: _evaluate_ident,
+    BinaryOp: _evaluate_binary_op,
+    UnaryOp: _evaluate_unary_op,
+    Comparison: _evaluate_comparison,
+    FunctionCall: _evaluate_call,
+    Conditional: _evaluate_conditional,
+    While: _evaluate_while,
+    ControlFlowStatement: _evaluate_control_flow,
+    Function: _evaluate_function_def,
+    # Nodes created by the optimizer
+    TempLoad: _evaluate_temp_load,
+    TempStore: _evaluate_temp_store,
+    Square: _evaluate_square,
+    ModPow: _evaluate_mod_pow,
+    Increment: _evaluate_increment,
+    ProductCompare: _evaluate_product_compare,
+    WhileCompare: _evaluate_while_compare,
+    IfDivisible: _evaluate_if_divisible,
+    ReturnVar: _evaluate_return_var,
+    CountedLoop: _evaluate_counted_loop,
+    Reduction: _evaluate_reduction,
+    SpecializedCall: _evaluate_specialized_call,
+    ReorderedChain: _evaluate_reordered_chain,
+}
 
 # Executes a user-defined function
 # Note: "args" refers to the arguments the function is passed,
@@ -461,21 +1064,55 @@ def _evaluate_tree(tree, scope):
 # sqrt(2);
 # params is ["x"], while args is [2]
 def _evaluate_function(func, args, scope):
-    name = func.name
-    params = [p.name for p in func.params]
-    body = func.body
+    _check_arity(func, len(args))
+
+    # Evaluate arguments in the *calling* scope!
+    args = [_evaluate_tree(a, scope) for a in args]
+
+    if func.cache is None:
+        return _run_function(func, args, scope)
+    return _call_function(func, args, scope)
 
-    if len(args) != len(params):
+def _check_arity(func, nargs):
+    name = func.name
+    if nargs != len(func.params):
         raise ProcyonTypeError(
             name.pos, 'attempted to call {}() with {} argument{}, exactly {} required'.format(
-                name, len(args), "s" if len(args) != 1 else "", len(params)))
+                name, nargs, "s" if nargs != 1 else "", len(func.params)))
 
-    # Evaluate arguments in the *calling* scope!
-    args = [_evaluate_tree(a, scope) for a in args]
+def _call_function(func, args, scope):
+    """ Call a user-defined function with already evaluated arguments.
+
+        Once a function has been called jit_threshold times (see Interpreter), it is
+        compiled, and the compiled body is used from then on.
+    """
+    cache = func.cache
+    if cache is not None and _lookup_var(scope, func.name.name) is func:
+        # (A memo function called under another name may have had its own replaced, and
+        # the recursive calls would then go to another function; see memo.py.)
+        key = cache.key(args)
+        store = scope[2].memo_store
+        result = cache.get(key, _MISSING, store)
+        if result is _MISSING:
+            result = _run_function(func, args, scope)
+            cache.put(key, result, store)
+        return result
+
+    return _run_function(func, args, scope)
+
+def _run_function(func, args, scope):
+    func.calls += 1
+    budgeted = scope[2].budget is not None
+    if func.calls == scope[2].jit_threshold and not budgeted:
+        compiler.tier_up(func)
 
     try:
-        func_scope = _new_scope(scope, params, args)
-        _evaluate_all(body, func_scope)
+        func_scope = _new_scope(scope, [p.name for p in func.params], args)
+        if func.compiled is not None and not budgeted:
+            func.compiled(func_scope)
+        else:
+            for stmt in func.body:
+                _evaluate_tree(stmt, func_scope)
     except ProcyonControlFlowException as ex:
         args = ex.args[1]
         if args["type"] == "return":
@@ -483,11 +1120,33 @@ def _evaluate_function(func, args, scope):
         else:
             raise  # break or continue called outside of loop, or abort()
 
-def _handle_input(func, prompt):
-    """ Handle input_* calls (int, float and str). """
+def _read_input(func, args, interp):
+    """ Handle input_* (int, float and str), read_* and eof() calls. """
+    source = interp.source
+    name = func.name
+    if name == 'eof':
+        return int(source.eof())
+
+    if name.startswith('input_'):
+        interp.sink.flush()  # The program's output so far comes before the prompt
+        val = source.input(args[0])
+    elif name == 'read_line':
+        val = source.readline()
+    else:
+        val = source.token()  # int() and float() take bytes as they are
+        if val is not None and name == 'read_str':
+            val = val.decode('utf-8')
+
+    if val is None:
+        raise ProcyonEOFError(func.pos, "{}() called at the end of the input".format(name))
+    return _convert_input(func, val)
+
+def _convert_input(func, val):
+    """ Convert a line (or token) of input to the type the input_* (or read_*) function
+        returns.
+    """
 
-    type_ = func.name[6:]
-    val = input(prompt)
+    type_ = func.name[func.name.index('_') + 1:]
 
     if type_ == 'float':
         try:
@@ -500,17 +1159,21 @@ def _handle_input(func, prompt):
         except ValueError:
             raise ProcyonTypeError(func.pos, "user-entered string is not a valid int")
     else:
-        assert type_ == 'str'
+        assert type_ in ('str', 'line')
         return val
 
 def evaluate_command(cmd):  # ignore coverage
-    """ Evaluate a command, as entered in the REPL.
+    """ Evaluate a command, as entered in the REPL, in the default interpreter.
 
         Commands are not supported for programming; they're merely
         intended as minor helpers for interactive use.
     """
 
+    return _default.evaluate_command(cmd)
+
+def _evaluate_command(interp, cmd):  # ignore coverage
     (cmd_name, *args) = re.split(r'\s+', cmd)
+    global_vars = interp.globals
 
     if cmd_name == 'vars':
         # Bit of a mess... Fetch each variable name.
@@ -518,18 +1181,42 @@ def evaluate_command(cmd):  # ignore coverage
         # *UNLESS* the user has assigned other values to those names.
         # XXX: Only lists values in the global scope. This by design, at least for now;
         # commands aren't intended for use when programming, but only in the REPL.
-        vars = [v for v in __global_scope[1] if (
-            v != '_' and not (
-                v in __initial_state and __initial_state[v] == __global_scope[1][v]))]
+        # Names beginning with % are the optimizer's hidden temporaries.
+        vars = [v for v in global_vars if (
+            v != '_' and v[0] != '%' and not (
+                v in __initial_state and __initial_state[v] == global_vars[v]))]
 
         for var in sorted(vars):
-            print("{}:\t{}".format(var, __global_scope[1][var]))
+            print("{}:\t{}".format(var, global_vars[var]))
+
+    elif cmd_name == 'memo':
+        # Like .vars, only functions in the global scope are listed
+        funcs = [(name, f) for (name, f) in global_vars.items()
+                 if isinstance(f, Function) and f.cache is not None]
+        if not funcs:
+            print("No memo functions defined")
+        for name, f in sorted(funcs, key=lambda item: item[0]):
+            if args and args[0] == 'clear':
+                f.cache.clear()
+            print("{}():\t{} results cached, {} hits, {} misses{}".format(
+                name, len(f.cache), f.cache.hits, f.cache.misses,
+                ", {} found in the memo database".format(f.cache.stored_hits)
+                if interp.memo_store is not None else ""))
+
+    elif cmd_name == 'cache':
+        programs = interp.program_cache
+        if args and args[0] == 'clear':
+            programs.clear()
+        print("{} of {} programs cached, {} hits, {} misses, {} evicted".format(
+            len(programs), programs.size, programs.hits, programs.misses, programs.evictions))
 
     elif cmd_name == 'help':
         print("# Procyon REPL v" + VERSION + ", " + DATE)
         print("# Supported commands (in the REPL only):")
         print("# .help - this text")
         print("# .vars - show all variables, except non-modified builtins")
+        print("# .memo [clear] - show (or reset) the caches of memo functions")
+        print("# .cache [clear] - show (or empty) the cache of parsed programs")
         print("# .import <file.pr> - interpret a file, making its functions/variables available")
         print("#")
         print("# Built-in functions (number of arguments, if not 1):")
@@ -544,7 +1231,8 @@ def evaluate_command(cmd):  # ignore coverage
 
     elif cmd_name == 'import':
         if len(args) == 1:
-            evaluate_file(args[0])
+            with open(args[0], 'r') as f:
+                interp.evaluate(f.read())
         else:
             print("Usage: .import <file.py>")
 
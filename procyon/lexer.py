@@ -2,7 +2,8 @@
 
 # vim: ts=4 sts=4 et sw=4
 
-from .common import ProcyonSyntaxError
+import re
+from .common import ProcyonSyntaxError, decode_escapes
 
 #
 # Proycon lexer definitions.
@@ -17,6 +18,10 @@ from .common import ProcyonSyntaxError
 
 keywords = ('if', 'else', 'while', 'break', 'continue', 'func', 'return')
 
+# Only keywords right before the given keyword, and names everywhere else, so that
+# programs from before they were added still work (e.g. memo = 3;)
+contextual_keywords = {'memo': 'func'}
+
 tokens = ['INT', 'OCT', 'BIN', 'HEX', 'FLOAT',             # Number literals
           'PLUS', 'MINUS', 'TIMES', 'DIVIDE', 'EXPONENT', 'REMAINDER', 'INTDIVIDE',
           'NOT',
@@ -25,7 +30,7 @@ tokens = ['INT', 'OCT', 'BIN', 'HEX', 'FLOAT',             # Number literals
           'LPAREN', 'RPAREN', 'LBRACE', 'RBRACE', 'SEMICOLON', 'COMMA',
           'ASSIGN', 'ASSIGN_PLUS', 'ASSIGN_MINUS', 'ASSIGN_TIMES', 'ASSIGN_DIVIDE',
           'ASSIGN_EXPONENT', 'ASSIGN_REMAINDER', 'ASSIGN_INTDIVIDE',
-          'IDENT', 'STRING', 'ELSEIF'] + [k.upper() for k in keywords]
+          'IDENT', 'STRING', 'ELSEIF'] + [k.upper() for k in keywords + tuple(contextual_keywords)]
 
 # Matches e.g. 1., 1.4, 2.3e2 (230), 4e-3 (0.004)
 def t_FLOAT(t):
@@ -66,17 +71,30 @@ def t_IDENT(t):
     r'\$?[A-Za-z_][A-Za-z0-9_]*'
     if t.value in keywords:
         t.type = t.value.upper()
+    elif t.value in contextual_keywords:
+        # Whitespace and comments may come in between
+        following = _next_word.match(t.lexer.lexdata, t.lexer.lexpos)
+        if following.group(1) == contextual_keywords[t.value]:
+            t.type = t.value.upper()
     return t
 
+_next_word = re.compile(r'(?:\s|\#.*)*([A-Za-z0-9_]*)')
+
 # Match a double quote, followed by any number of:
 # 1) Anything except backslashes and quotes, or
 # 2) a backslash followed by anything,
 # finally followed by a lone quote.
 # This matches all strings including ones with
 # escaped double quotes inside.
+# Escape sequences are decoded here, once, so that strings hold the actual characters;
+# strings built while a program runs are never decoded.
 def t_STRING(t):
     r'"(?:[^"\\]|\\.)*"'
-    t.value = t.value[1:-1]
+    try:
+        t.value = decode_escapes(t.value[1:-1])
+    except UnicodeDecodeError as e:
+        raise ProcyonSyntaxError((t.lineno, column(t.lexer.lexdata, t.lexpos)),
+                                 'invalid escape sequence in string: {}'.format(e.reason))
     return t
 
 # Tokens that don't need any transformations
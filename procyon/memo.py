@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+import hashlib
+import json
+from math import copysign
+import sqlite3
+import threading
+from collections import OrderedDict
+from .common import ProcyonTypeError
+from . import analysis
+from .ast import (Value, Ident, BinaryOp, UnaryOp, Function, Conditional, While, FunctionCall,
+                  ControlFlowStatement, Comparison, walk, structure_key)
+
+#
+# Memoized functions: memo func fib(n) { ... } remembers the results of its calls, keyed on
+# the arguments, so that recursive functions that solve the same subproblems over and over
+# (Fibonacci numbers, binomial coefficients, ...) only solve each one once.
+#
+# That is only correct for pure functions, whose result depends on nothing but their
+# arguments and which have no side effects. Since functions see their caller's variables
+# (see the scoping notes in interpreter.py), that rules out a lot; check_purity() accepts a
+# memo function only if it:
+#
+# * only reads its parameters, and local variables that have definitely been assigned to
+#   at that point (anything else may be one of its caller's variables);
+# * doesn't read or write global ($name) variables;
+# * only calls itself and the built-in math functions (not print, input_* or read_*);
+# * doesn't define nested functions.
+#
+# Calls to itself are looked up by name like all calls, so the cache is only used while the
+# name refers to the function, e.g. not after g = fib; func fib(n) { ... } redefines fib.
+#
+# The results are kept in a bounded cache per function; once it holds MEMO_SIZE results,
+# the least recently used one is evicted.
+#
+# Optionally, results are also kept across runs in an SQLite database (procyon.py
+# --memo-db FILE, which sets store below); see MemoStore.
+#
+
+MEMO_SIZE = 10000
+
+# The MemoStore used by memo functions, if any, unless their Interpreter has its own
+store = None
+
+# Built-in functions with side effects, or that call other functions (see analysis.py);
+# abort() is fine, as it never returns a result
+_IMPURE_BUILTINS = analysis.IMPURE_BUILTINS - {'abort'}
+
+class MemoCache:
+    """ A least recently used cache of a function's results, with hit/miss statistics.
+
+        If func is given and get() and put() are given a MemoStore, results missing from
+        the cache are looked up in the store, and new results are added to it;
+        stored_hits counts the former.
+    """
+
+    def __init__(self, func=None, size=None):
+        self.size = MEMO_SIZE if size is None else size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stored_hits = 0
+        self.func = func
+        self.digest = func.digest if func is not None else None
+
+    @staticmethod
+    def key(args):
+        # 1 == 1.0 in Python, but f(1) and f(1.0) may well return different things; so may
+        # f(0.0) and f(-0.0), so floats are keyed on their sign instead of their type
+        return tuple(args) + tuple(copysign(1, a) if type(a) is float else type(a)
+                                   for a in args)
+
+    def get(self, key, default=None, store=None):
+        """ Return a cached result (and count a hit), or default (and count a miss). """
+        results = self.results
+        if key in results:
+            self.hits += 1
+            results.move_to_end(key)
+            return results[key]
+
+        if store is not None and self.digest is not None:
+            result = store.get(self.func.name.name, self.digest, key, _MISSING)
+            if result is not _MISSING:
+                self.stored_hits += 1
+                self._add(key, result)
+                return result
+
+        self.misses += 1
+        return default
+
+    def put(self, key, result, store=None):
+        self._add(key, result)
+        if store is not None and self.digest is not None:
+            store.put(self.func.name.name, self.digest, key, result)
+
+    def _add(self, key, result):
+        results = self.results
+        results[key] = result
+        if len(results) > self.size:
+            results.popitem(last=False)
+
+    def clear(self):
+        self.results.clear()
+        self.hits = self.misses = self.stored_hits = 0
+
+    def __len__(self):
+        return len(self.results)
+
+_MISSING = object()
+
+def function_hash(func):
+    """ A hash of a function's code, ignoring positions; changes whenever its source does.
+
+        This must be taken before the optimizer changes the function, as the optimizer's
+        output (e.g. the numbering of CSE temporaries) also depends on the rest of the
+        program, and on the optimizer itself.
+    """
+    return hashlib.sha1(repr(structure_key(func)).encode('utf-8')).hexdigest()
+
+##
+### PERSISTENT STORE
+##
+
+# The store holds the results of all memo functions, keyed by the function's name and
+# code hash and by the arguments. When a function's code changes, its results are no
+# longer looked up, since the hash changes; they are not removed right away, as a
+# function by the same name in another program would remove them right back, but they
+# are the first to go once the store is full.
+#
+# Only results and arguments that are ints, floats or strings are stored. Values are
+# encoded as JSON, which keeps 1 and 1.0 apart, as the in-memory cache does.
+#
+# Each result has a "last used" stamp; once the store holds more than max_results results,
+# the least recently used ones are removed. Changes are committed every COMMIT_INTERVAL
+# writes, and by close().
+
+MEMO_DB_SIZE = 1000000
+COMMIT_INTERVAL = 1000
+
+_STORABLE = (int, float, str)
+
+class MemoStore:
+    """ Results of memo functions, stored in an SQLite database.
+
+        A store can be shared by interpreters running in different threads.
+    """
+
+    def __init__(self, filename, max_results=None):
+        self.max_results = MEMO_DB_SIZE if max_results is None else max_results
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS results (
+            name TEXT, digest TEXT, args TEXT, result TEXT, used INTEGER,
+            PRIMARY KEY (name, digest, args))""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        self.count = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        self.clock = self.db.execute("SELECT MAX(used) FROM results").fetchone()[0] or 0
+        self.writes = 0
+
+    @staticmethod
+    def _encode(key):
+        # MemoCache.key() is the arguments followed by their types (or signs)
+        args = key[:len(key) // 2]
+        if not all(type(a) in _STORABLE for a in args):
+            return None
+        return json.dumps(args)
+
+    def get(self, name, digest, key, default=None):
+        args = self._encode(key)
+        if args is None:
+            return default
+        with self.lock:
+            row = self.db.execute(
+                "SELECT result FROM results WHERE name=? AND digest=? AND args=?",
+                (name, digest, args)).fetchone()
+            if row is None:
+                return default
+
+            self.clock += 1
+            self._write("UPDATE results SET used=? WHERE name=? AND digest=? AND args=?",
+                        (self.clock, name, digest, args))
+        return json.loads(row[0])
+
+    def put(self, name, digest, key, result):
+        args = self._encode(key)
+        if args is None or type(result) not in _STORABLE:
+            return
+
+        with self.lock:
+            self.clock += 1
+            self.count += self._write(
+                "INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?)",
+                (name, digest, args, json.dumps(result), self.clock))
+            if self.count > self.max_results:
+                self.count -= self._write(
+                    "DELETE FROM results WHERE rowid IN "
+                    "(SELECT rowid FROM results ORDER BY used LIMIT ?)",
+                    (self.count - self.max_results,))
+
+    def _write(self, sql, params):
+        """ Run a statement that changes the database; returns the number of rows it added
+            (for INSERT) or removed (for DELETE).
+        """
+        cursor = self.db.execute(sql, params)
+        self.writes += 1
+        if self.writes % COMMIT_INTERVAL == 0:
+            self.db.commit()
+        return max(cursor.rowcount, 0)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+##
+### PURITY CHECK
+##
+
+def check_purity(trees, builtins):
+    """ Raise ProcyonTypeError for the first memo function in a program that isn't pure.
+
+        This runs on the program as parsed, so it also sets the digest of the memo
+        functions (see function_hash).
+    """
+    for node in walk(trees):
+        if isinstance(node, Function) and node.memo:
+            checker = _Checker(node, builtins)
+            for param in node.params:
+                if param.name == checker.name:
+                    checker.impure(param.pos, "has a parameter with its own name")
+            checker.statements(node.body, {p.name for p in node.params})
+            node.digest = function_hash(node)
+
+class _Checker:
+    def __init__(self, func, builtins):
+        self.func = func
+        self.name = func.name.name
+        self.builtins = builtins
+
+    def impure(self, pos, reason):
+        raise ProcyonTypeError(pos, "memo function {}() is not pure: it {}".format(
+            self.name, reason))
+
+    def statements(self, stmts, assigned):
+        """ Check a list of statements; returns the variables definitely assigned after it. """
+        for stmt in stmts:
+            assigned = self.statement(stmt, assigned)
+        return assigned
+
+    def statement(self, node, assigned):
+        if isinstance(node, Conditional):
+            assigned = self.expr(node.cond, assigned)
+            then_assigned = self.statements(node.then_body, set(assigned))
+            else_assigned = self.statements(node.else_body or [], set(assigned))
+            return then_assigned & else_assigned
+        elif isinstance(node, While):
+            # The body may not run at all, so nothing assigned in it counts afterwards
+            assigned = self.expr(node.cond, assigned)
+            self.statements(node.body, set(assigned))
+            return assigned
+        elif isinstance(node, ControlFlowStatement):
+            return self.expr(node.arg, assigned) if node.arg else assigned
+        elif isinstance(node, Function):
+            self.impure(node.pos, "defines function {}()".format(node.name.name))
+        return self.expr(node, assigned)
+
+    def expr(self, node, assigned):
+        """ Check an expression; returns the variables definitely assigned after it. """
+        if isinstance(node, Value):
+            return assigned
+        elif isinstance(node, Ident):
+            name = node.name
+            if name[0] == '$':
+                self.impure(node.pos, 'reads global variable "{}"'.format(name))
+            elif name not in assigned and name != self.name:
+                self.impure(node.pos, 'reads "{}", which may be a variable of its caller'.format(
+                    name))
+            return assigned
+        elif isinstance(node, BinaryOp):
+            if node.kind == "assign":
+                assigned = self.expr(node.right, assigned)
+                name = node.left.name
+                if name[0] == '$':
+                    self.impure(node.left.pos, 'assigns to global variable "{}"'.format(name))
+                elif name == self.name:
+                    self.impure(node.left.pos, 'assigns to its own name')
+                return assigned | {name}
+            assigned = self.expr(node.left, assigned)
+            if node.kind == "logical":
+                # The right side may not be evaluated
+                self.expr(node.right, set(assigned))
+                return assigned
+            return self.expr(node.right, assigned)
+        elif isinstance(node, UnaryOp):
+            return self.expr(node.arg, assigned)
+        elif isinstance(node, Comparison):
+            # Only the first two operands are always evaluated
+            contents = node.contents
+            assigned = self.expr(contents[2], self.expr(contents[0], assigned))
+            for operand in contents[4::2]:
+                self.expr(operand, set(assigned))
+            return assigned
+        elif isinstance(node, FunctionCall):
+            name = node.func_name.name
+            if name in _IMPURE_BUILTINS:
+                self.impure(node.func_name.pos, "calls {}()".format(name))
+            elif name not in self.builtins and name != self.name:
+                self.impure(node.func_name.pos, "calls {}(), which may not be pure".format(name))
+            for arg in node.args:
+                assigned = self.expr(arg, assigned)
+            return assigned
+        elif isinstance(node, Function):
+            self.impure(node.pos, "defines function {}()".format(node.name.name))
+        return assigned
@@ -0,0 +1,922 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+from .ast import (Node, Value, Ident, BinaryOp, UnaryOp, Function, Conditional, While,
+                  FunctionCall, ControlFlowStatement, Comparison, TempStore, TempLoad,
+                  Square, ModPow, Increment, ProductCompare, WhileCompare, IfDivisible,
+                  ReturnVar, CountedLoop, Reduction, SpecializedCall, ReorderedChain, count_nodes,
+                  structure_key, walk)
+from .analysis import (pure_functions, is_pure, function_definitions, names_read, live_after,
+                       names_assigned, has_loop_jump)
+from .series import poly_add, poly_neg, poly_mul
+from math import gcd
+import copy
+
+#
+# The Procyon optimizer. Takes the statement list created by the parser and
+# rewrites it into an equivalent, but cheaper to evaluate, statement list.
+# Called from evaluate() in interpreter.py, between parsing and evaluation.
+#
+# Every pass must keep the exact semantics of the original program: the same
+# results, the same output, and the same exceptions (raised at the same positions).
+#
+
+def optimize(trees, builtins, level=1, report=None, profile=None):
+    """ Optimize a parsed program, and return the optimized list of statements.
+
+    Arguments:
+    trees -- the list of top-level statements, as returned by the parser
+    builtins -- the names of the built-in functions
+    level -- 0 disables all optimizations, 1 enables the default set, and 2 also
+             evaluates reduction loops (sums, counts and products) in closed form,
+             and specializes functions for constant arguments
+    report -- if a dict is passed, it is filled with per-pass statistics
+    profile -- a profile.Profile recorded for this program, if any, used to reorder
+               if/else if chains
+    """
+
+    if report is None:
+        report = {}
+
+    report['nodes_before'] = count_nodes(trees)
+
+    if level >= 1:
+        pure = pure_functions(trees, builtins)
+
+        trees = [_rewrite(t, _fold) for t in trees]
+
+        # Specialized copies of functions go through the same passes as the program,
+        # but are kept out of the top-level statements (and the results).
+        functions = _Specializer(trees, builtins, report).run() if level >= 2 else []
+        trees = functions + trees
+
+        trees = _DCE(trees, builtins, report).run()
+        _CSE(pure, builtins, report).statements(trees)
+
+        report['peephole'] = 0
+        trees = [_rewrite(t, lambda node: _peephole(node, builtins, report)) for t in trees]
+
+        report['counted_loops'] = 0
+        trees = [_rewrite(t, lambda node: _counted_loop(node, report)) for t in trees]
+
+        if level >= 2:
+            report['reductions'] = 0
+            trees = [_rewrite(t, lambda node: _reduction(node, report)) for t in trees]
+
+        report['superinstructions'] = 0
+        trees = [_rewrite(t, lambda node: _superinstruction(node, report)) for t in trees]
+
+        trees = trees[len(functions):]
+
+        if profile is not None:
+            report['reordered_chains'] = 0
+            trees = [_reorder_chains(t, profile, report) for t in trees]
+
+    report['nodes_after'] = count_nodes(trees)
+
+    return trees
+
+def _rewrite(node, fn):
+    """ Rewrite a tree bottom-up: children are rewritten first, then fn is called on the node.
+
+        fn returns the node to use in place of the one it was given (often the same node).
+    """
+    for field in node._fields:
+        child = getattr(node, field)
+        if isinstance(child, list):
+            setattr(node, field, [_rewrite(c, fn) if isinstance(c, Node) else c for c in child])
+        elif isinstance(child, Node):
+            setattr(node, field, _rewrite(child, fn))
+
+    return fn(node)
+
+##
+### CONSTANT FOLDING
+##
+
+# Don't fold exponentiations that produce ints larger than this many bits;
+# the folded value would be kept in memory for as long as the program is.
+MAX_FOLDED_BITS = 4096
+
+def _constant(value):
+    """ Return the Value kind for a Python value, or None if it can't be a literal. """
+    return {int: "int", float: "float", str: "string"}.get(type(value))
+
+def _fold_math(op, left, right):
+    """ Calculate a math operation on two literals, like the interpreter would.
+
+        Raises an exception if the interpreter would, or if the result would be
+        too large to keep around.
+    """
+    if type(left) != type(right) and not (
+            type(left) in (int, float) and type(right) in (int, float)):
+        raise TypeError(op)
+    if type(left) is str and op != '+':
+        raise TypeError(op)
+
+    if op == '^' and type(left) is int and type(right) is int and right > 0 and (
+            left.bit_length() * right > MAX_FOLDED_BITS):
+        raise OverflowError(op)
+
+    return {'+': lambda: left + right, '-': lambda: left - right,
+            '*': lambda: left * right, '/': lambda: left / right,
+            '//': lambda: left // right, '%': lambda: left % right,
+            '^': lambda: left ** right}[op]()
+
+def _fold_comparison(contents):
+    values = [n.value for n in contents[0::2]]
+    ops = [n.op for n in contents[1::2]]
+    for left, op, right in zip(values, ops, values[1:]):
+        if type(left) != type(right) and not (
+                type(left) in (int, float) and type(right) in (int, float)):
+            raise TypeError(op)
+        if not {'==': left == right, '!=': left != right, '<': left < right,
+                '>': left > right, '<=': left <= right, '>=': left >= right}[op]:
+            return 0
+    return 1
+
+def _fold(node):
+    """ Replace an operation on literals with its result, where that is safe.
+
+        Anything that would raise an exception (1/0, "a" - "b") is left alone, so that
+        the error is still raised when (and if) the expression is evaluated.
+    """
+    try:
+        if isinstance(node, BinaryOp) and node.kind == "math":
+            if isinstance(node.left, Value) and isinstance(node.right, Value):
+                value = _fold_math(node.op, node.left.value, node.right.value)
+            else:
+                return node
+        elif isinstance(node, BinaryOp) and node.kind == "logical":
+            if not isinstance(node.left, Value):
+                return node
+            # 1 || x is always 1, and 0 && x is always 0, without evaluating x
+            if (node.op == '||') == bool(node.left.value):
+                value = 1 if node.left.value else 0
+            elif isinstance(node.right, Value):
+                value = 1 if node.right.value else 0
+            else:
+                return node
+        elif isinstance(node, UnaryOp) and isinstance(node.arg, Value):
+            if node.op == '!':
+                value = int(not node.arg.value)
+            elif node.arg.kind != "string":
+                value = -node.arg.value
+            else:
+                return node
+        elif isinstance(node, Comparison) and all(isinstance(n, Value)
+                                                  for n in node.contents[0::2]):
+            value = _fold_comparison(node.contents)
+        else:
+            return node
+    except Exception:
+        return node
+
+    if _constant(value) is None:
+        return node
+
+    return Value(node.pos, _constant(value), value)
+
+##
+### SPECIALIZATION
+##
+
+# A call with constant arguments, such as largest_prime_factor(600851475143), gets its own
+# copy of the function, where the parameters are replaced by the constants so that the other
+# passes can fold them. The parameters are still set when the copy is called, since
+# functions called from it may read them (see the scoping notes in interpreter.py).
+#
+# Only functions with a single definition in the program are specialized, and only
+# parameters that the function never assigns to. Since the name may refer to another
+# function when the call runs (e.g. one defined earlier in the REPL), SpecializedCall
+# checks that it still refers to the specialized one first.
+#
+# Each function/constants combination is copied once, however many calls use it, and the
+# number (and size) of copies is limited, to keep the program from growing too much.
+
+MAX_SPECIALIZATIONS = 16
+MAX_SPECIALIZED_NODES = 500
+
+class _Specializer:
+    def __init__(self, trees, builtins, report):
+        self.trees = trees
+        self.builtins = builtins
+        self.report = report
+        self.defs = function_definitions(trees)
+        self.cache = {}  # (id(function), constants) -> specialized copy
+        self.sites = {}  # id(FunctionCall) -> (function, copy)
+
+    def run(self):
+        """ Specialize the calls in the program (modified in place); returns the new functions. """
+
+        # Copy all functions before any calls are replaced, so that the copies
+        # only contain regular calls.
+        for node in walk(self.trees):
+            if isinstance(node, FunctionCall):
+                self.call(node)
+
+        self.trees[:] = [_rewrite(t, self.replace) for t in self.trees]
+        self.report['specializations'] = len(self.cache)
+        return list(self.cache.values())
+
+    def call(self, node):
+        defs = self.defs.get(node.func_name.name)
+        if not defs or len(defs) != 1 or len(node.args) != len(defs[0].params):
+            return
+
+        func = defs[0]
+        if func.memo:
+            # A copy would get its own cache
+            return
+        assigned = names_assigned(func.body)
+        constants = {}
+        for param, arg in zip(func.params, node.args):
+            # A $global parameter is set by the call, but can then be changed anywhere
+            if (isinstance(arg, Value) and param.name not in assigned and
+                    param.name not in self.builtins and param.name[0] != '$'):
+                constants[param.name] = (arg.kind, arg.value)
+        if not constants:
+            return
+
+        key = (id(func), tuple(sorted(constants.items())))
+        if key not in self.cache:
+            if len(self.cache) >= MAX_SPECIALIZATIONS or count_nodes(func) > MAX_SPECIALIZED_NODES:
+                return
+            specialized = copy.deepcopy(func)
+            specialized.body = [_rewrite(_substitute(stmt, constants), _fold)
+                                for stmt in specialized.body]
+            self.cache[key] = specialized
+
+        self.sites[id(node)] = (func, self.cache[key])
+
+    def replace(self, node):
+        if isinstance(node, FunctionCall) and id(node) in self.sites:
+            func, specialized = self.sites[id(node)]
+            return SpecializedCall(node.pos, node, func, specialized)
+        return node
+
+def _substitute(node, constants):
+    """ Replace reads of variables with constants, outside of nested functions.
+
+        The variables must never be assigned to, so every Ident with their name is a read.
+    """
+    if isinstance(node, Ident) and node.name in constants:
+        kind, value = constants[node.name]
+        return Value(node.pos, kind, value)
+    elif isinstance(node, Function):
+        return node
+    elif isinstance(node, FunctionCall):
+        # The function name is looked up like a variable, but isn't one of the constants
+        node.args = [_substitute(a, constants) for a in node.args]
+        return node
+
+    for field in node._fields:
+        child = getattr(node, field)
+        if isinstance(child, list):
+            setattr(node, field, [_substitute(c, constants) if isinstance(c, Node) else c
+                                  for c in child])
+        elif isinstance(child, Node):
+            setattr(node, field, _substitute(child, constants))
+
+    return node
+
+##
+### DEAD CODE ELIMINATION
+##
+
+# Three kinds of dead code are removed:
+# 1) Statements that can never run, because they follow an unconditional return,
+#    break or continue (or an if/else whose branches all end in one).
+# 2) if statements and while loops with constant conditions, after folding; the branch
+#    that is never taken is removed, and the other is merged into the surrounding block.
+# 3) Assignments to local variables that are never read afterwards (in function bodies only).
+#    The assigned expression is kept as a statement, unless it is a constant, so that any
+#    side effects (and errors) remain.
+#
+# The top-level statement list is special: evaluate() returns one result per
+# top-level statement, so statements there are never merged or removed, only trimmed.
+
+class _DCE:
+    def __init__(self, trees, builtins, report):
+        self.trees = trees
+        self.builtins = builtins
+        self.report = report
+        defs = function_definitions(trees)
+        self.defined = set(defs)
+        self.reads = names_read(trees)
+        self.function_reads = set()
+        for funcs in defs.values():
+            for f in funcs:
+                self.function_reads |= set(names_read(f.body))
+
+    def run(self):
+        before = count_nodes(self.trees)
+        trees = self.block(self.trees, toplevel=True)
+        self.report['dce'] = before - count_nodes(trees)
+        return trees
+
+    def block(self, stmts, toplevel=False):
+        new = []
+        for stmt in stmts:
+            stmt = self.statement(stmt, toplevel)
+            if isinstance(stmt, list):
+                new.extend(stmt)
+            elif stmt is not None and (toplevel or not isinstance(stmt, Value)):
+                # A lone constant in a block does nothing, since its value is thrown away
+                new.append(stmt)
+
+            if new and _terminates(new[-1]):
+                # Nothing after this can run
+                break
+
+        return new
+
+    def statement(self, node, toplevel):
+        """ Optimize a statement; returns a node, a list of statements to merge, or None. """
+
+        if isinstance(node, Conditional):
+            if isinstance(node.cond, Value):
+                taken = node.then_body if node.cond.value else (node.else_body or [])
+                if not toplevel:
+                    return self.block(taken)
+                node.cond = Value(node.cond.pos, "int", 1)
+                node.then_body = self.block(taken)
+                node.else_body = None
+            else:
+                node.then_body = self.block(node.then_body)
+                node.else_body = self.block(node.else_body) if node.else_body else None
+
+        elif isinstance(node, While):
+            if isinstance(node.cond, Value) and not node.cond.value:
+                if not toplevel:
+                    return None
+                node.body = []
+            else:
+                node.body = self.block(node.body)
+
+        elif isinstance(node, Function):
+            node.body = self.block(node.body)
+            self.remove_dead_stores(node)
+
+        return node
+
+    def remove_dead_stores(self, func):
+        # Functions see their caller's variables (see the scoping notes in interpreter.py),
+        # so a store is only dead if no other code could read the name. If the function
+        # calls other functions (itself included), any name read by a function counts.
+        called = {n.func_name.name for n in walk(func.body) if isinstance(n, FunctionCall)}
+        if any(name not in self.builtins and name not in self.defined for name in called):
+            # This calls a function defined elsewhere, e.g. earlier in the REPL
+            return
+
+        local_reads = names_read(func.body, nested=False)
+        escaping = {name for name in self.reads if self.reads[name] > local_reads[name]}
+        if any(name not in self.builtins for name in called):
+            escaping |= self.function_reads
+
+        after = live_after(func.body)
+
+        def dead(stmt):
+            return (isinstance(stmt, BinaryOp) and stmt.kind == "assign" and
+                    stmt.left.name[0] != '$' and stmt.left.name not in escaping and
+                    stmt.left.name not in self.builtins and
+                    stmt.left.name not in after[id(stmt)])
+
+        def visit(stmts):
+            new = []
+            for stmt in stmts:
+                if isinstance(stmt, Conditional):
+                    stmt.then_body = visit(stmt.then_body)
+                    stmt.else_body = visit(stmt.else_body) if stmt.else_body else None
+                elif isinstance(stmt, While):
+                    stmt.body = visit(stmt.body)
+                elif dead(stmt):
+                    stmt = stmt.right
+                    if isinstance(stmt, Value):
+                        continue
+                new.append(stmt)
+            return new
+
+        func.body = visit(func.body)
+
+def _terminates(stmt):
+    """ Test whether a statement always jumps away (return, break or continue). """
+    if isinstance(stmt, ControlFlowStatement):
+        return True
+    elif isinstance(stmt, Conditional):
+        return (stmt.else_body is not None and
+                bool(stmt.then_body) and _terminates(stmt.then_body[-1]) and
+                bool(stmt.else_body) and _terminates(stmt.else_body[-1]))
+    return False
+
+##
+### PEEPHOLE OPTIMIZATIONS
+##
+
+# Small patterns that are replaced by cheaper, specialized nodes.
+# The new nodes handle ints themselves, and fall back to the interpreter's regular
+# math and comparison code for anything else, so errors are unchanged.
+
+def _is_int(node, value=None):
+    return (isinstance(node, Value) and node.kind == "int" and
+            (value is None or node.value == value))
+
+def _peephole(node, builtins, report):
+    new = _peephole_match(node, builtins)
+    if new is not node:
+        report['peephole'] += 1
+    return new
+
+def _peephole_match(node, builtins):
+    if isinstance(node, BinaryOp) and node.kind == "math":
+        if node.op == '^' and _is_int(node.right, 2):
+            # x^2 -> x*x
+            return Square(node.pos, node.left)
+
+        if (node.op == '%' and isinstance(node.left, BinaryOp) and
+                node.left.kind == "math" and node.left.op == '^'):
+            # (a^b) % m -> pow(a, b, m)
+            power = node.left
+            return ModPow(node.pos, power.pos, power.left, power.right, node.right)
+
+    elif isinstance(node, BinaryOp) and node.kind == "assign":
+        # x += k and x -= k, for constant ints k; the parser creates these as x = x + k
+        # and x = x - k, so this also matches those when written out. Assignments to
+        # built-ins are left alone, as the error comes before the read of x there
+        right = node.right
+        if (node.left.name not in builtins and
+                isinstance(right, BinaryOp) and right.kind == "math" and right.op in ('+', '-') and
+                isinstance(right.left, Ident) and right.left.name == node.left.name and
+                _is_int(right.right)):
+            return Increment(right.pos, right.left, right.op, right.right.value)
+
+    elif isinstance(node, Comparison) and len(node.contents) == 3:
+        # d*d > n and similar
+        left, op, other = node.contents
+        if isinstance(left, BinaryOp) and left.kind == "math" and left.op == '*':
+            a, b = left.left, left.right
+            if isinstance(a, Ident) and isinstance(b, Ident) and a.name == b.name:
+                b = a
+            return ProductCompare(op.pos, left.pos, a, b, op.op, other)
+
+    return node
+
+##
+### COUNTED LOOPS
+##
+
+# while i < n { ...; i += k } where nothing but the final statement changes i, and n
+# doesn't change either, becomes a CountedLoop, which the interpreter runs with range().
+# The loop must not contain a continue, as that would skip the increment.
+#
+# The bound may be any expression of literals, variables and math, as long as none of
+# the variables are assigned in the loop; it is then only evaluated once.
+
+_directions = {'<': 1, '<=': 1, '>': -1, '>=': -1}
+
+def _invariant_bound(node, assigned):
+    if isinstance(node, Value):
+        return node.kind != "string"
+    elif isinstance(node, Ident):
+        return node.name[0] != '$' and node.name not in assigned
+    elif isinstance(node, BinaryOp) and node.kind == "math":
+        return _invariant_bound(node.left, assigned) and _invariant_bound(node.right, assigned)
+    elif isinstance(node, UnaryOp):
+        return _invariant_bound(node.arg, assigned)
+    elif isinstance(node, Square):
+        return _invariant_bound(node.arg, assigned)
+    return False
+
+def _counted_loop(node, report):
+    if not (isinstance(node, While) and isinstance(node.cond, Comparison) and
+            len(node.cond.contents) == 3 and node.body):
+        return node
+
+    ident, op, bound = node.cond.contents
+    increment = node.body[-1]
+    body = node.body[:-1]
+
+    if not (isinstance(ident, Ident) and ident.name[0] != '$' and
+            isinstance(increment, Increment) and increment.ident.name == ident.name and
+            op.op in _directions):
+        return node
+
+    step = increment.step if increment.op == '+' else -increment.step
+    if step == 0 or (step > 0) != (_directions[op.op] > 0):
+        # Counting in the wrong direction; this loop runs either forever or not at all
+        return node
+
+    assigned = names_assigned(body)
+    if (ident.name in assigned or not _invariant_bound(bound, assigned | {ident.name}) or
+            has_loop_jump(body, "continue")):
+        return node
+
+    report['counted_loops'] += 1
+    return CountedLoop(node.pos, op.pos, ident, op.op, bound, step, body, increment)
+
+##
+### REDUCTIONS
+##
+
+# A counted loop whose body only does acc += term, acc -= term or acc *= term, possibly
+# inside an if with a divisibility test on the counter, becomes a Reduction:
+#
+# while i < 1000 { if i % 3 == 0 || i % 5 == 0 { sum += i; } i += 1; }
+#
+# The term must be a polynomial in the counter with int coefficients, and the test may
+# combine any number of i % m == 0 and i % m != 0 (for constant m) with &&, || and !.
+# The interpreter then calculates the result with exact integer formulas (see series.py),
+# or runs the original loop if any of the values involved is not an int.
+
+# The largest polynomial degree, and number of divisibility terms, to accept
+MAX_REDUCTION_DEGREE = 32
+MAX_REDUCTION_DIVISORS = 64
+
+def _polynomial(node, counter):
+    """ Convert an expression to a polynomial in the counter, or return None. """
+    if _is_int(node):
+        return (node.value,)
+    elif isinstance(node, Ident):
+        return (0, 1) if node.name == counter else None
+    elif isinstance(node, UnaryOp):
+        arg = _polynomial(node.arg, counter) if node.op == '-' else None
+        return poly_neg(arg) if arg is not None else None
+    elif isinstance(node, Square):
+        arg = _polynomial(node.arg, counter)
+        return poly_mul(arg, arg) if arg is not None else None
+    elif isinstance(node, BinaryOp) and node.kind == "math":
+        left = _polynomial(node.left, counter)
+        if left is None:
+            return None
+        if node.op == '^':
+            if not (_is_int(node.right) and 0 <= node.right.value <= MAX_REDUCTION_DEGREE):
+                return None
+            result = (1,)
+            for _ in range(node.right.value):
+                result = poly_mul(result, left)
+            return result
+
+        right = _polynomial(node.right, counter)
+        if right is None:
+            return None
+        elif node.op == '+':
+            return poly_add(left, right)
+        elif node.op == '-':
+            return poly_add(left, poly_neg(right))
+        elif node.op == '*':
+            return poly_mul(left, right)
+
+    return None
+
+def _divisibility_filter(node, counter):
+    """ Convert a condition to a dict {m: coefficient}, or return None.
+
+        The condition is true for x exactly when sum(coefficient for every m that divides x)
+        is 1 (and it is 0 otherwise); m = 1 divides everything, so {1: 1} is always true.
+        || chains double the number of terms at every step, so conditions that would need
+        more than MAX_REDUCTION_DIVISORS terms give None as soon as they get there.
+    """
+    if isinstance(node, Comparison) and len(node.contents) == 3:
+        mod, op, zero = node.contents
+        if (op.op in ('==', '!=') and _is_int(zero, 0) and isinstance(mod, BinaryOp) and
+                mod.kind == "math" and mod.op == '%' and isinstance(mod.left, Ident) and
+                mod.left.name == counter and _is_int(mod.right) and mod.right.value != 0):
+            divisible = {abs(mod.right.value): 1}
+            return divisible if op.op == '==' else _filter_not(divisible)
+
+    elif isinstance(node, UnaryOp) and node.op == '!':
+        arg = _divisibility_filter(node.arg, counter)
+        return _filter_not(arg) if arg is not None else None
+
+    elif isinstance(node, BinaryOp) and node.kind == "logical":
+        left = _divisibility_filter(node.left, counter)
+        if left is None:
+            return None
+        right = _divisibility_filter(node.right, counter)
+        if right is None:
+            return None
+        both = _filter_and(left, right)
+        if node.op == '&&' or both is None:
+            return both
+        # a || b is a + b - (a && b)
+        either = _filter_sum(left, right)
+        return _filter_sum(either, _filter_scale(both, -1)) if either is not None else None
+
+    return None
+
+def _filter_sum(a, b):
+    """ Add two filters; returns None if the sum has too many terms. """
+    result = dict(a)
+    for m, c in b.items():
+        result[m] = result.get(m, 0) + c
+    return _filter_limit(result)
+
+def _filter_limit(result):
+    result = {m: c for m, c in result.items() if c != 0}
+    return result if len(result) <= MAX_REDUCTION_DIVISORS else None
+
+def _filter_scale(a, factor):
+    return {m: c * factor for m, c in a.items()}
+
+def _filter_not(a):
+    return _filter_sum({1: 1}, _filter_scale(a, -1))
+
+def _filter_and(a, b):
+    """ Multiply two filters; returns None if the product has too many terms. """
+    # Both m1 and m2 divide x exactly when their least common multiple does
+    result = {}
+    for m1, c1 in a.items():
+        for m2, c2 in b.items():
+            m = m1 * m2 // gcd(m1, m2)
+            result[m] = result.get(m, 0) + c1 * c2
+    return _filter_limit(result)
+
+def _accumulation(stmt, counter):
+    """ Match acc += term, acc -= term or acc *= term; return (acc, op, polynomial) or None. """
+    if isinstance(stmt, Increment):
+        return (stmt.ident, stmt.op, (stmt.step,))
+
+    if not (isinstance(stmt, BinaryOp) and stmt.kind == "assign" and
+            isinstance(stmt.right, BinaryOp) and stmt.right.kind == "math" and
+            stmt.right.op in ('+', '-', '*')):
+        return None
+
+    acc = stmt.left.name
+    left, right = stmt.right.left, stmt.right.right
+    if isinstance(left, Ident) and left.name == acc:
+        acc_node, term = left, right
+    elif stmt.right.op != '-' and isinstance(right, Ident) and right.name == acc:
+        # term + acc or term * acc; ints commute
+        acc_node, term = right, left
+    else:
+        return None
+
+    poly = _polynomial(term, counter)
+    if poly is None:
+        return None
+    return (acc_node, stmt.right.op, poly)
+
+def _reduction(node, report):
+    if not (isinstance(node, CountedLoop) and len(node.body) == 1):
+        return node
+
+    counter = node.ident.name
+    stmt = node.body[0]
+    divisors = {1: 1}
+    if isinstance(stmt, Conditional) and not stmt.else_body and len(stmt.then_body) == 1:
+        divisors = _divisibility_filter(stmt.cond, counter)
+        stmt = stmt.then_body[0]
+        if divisors is None:
+            return node
+
+    match = _accumulation(stmt, counter)
+    if match is None:
+        return node
+
+    acc, op, poly = match
+    if acc.name == counter or len(poly) > MAX_REDUCTION_DEGREE + 1:
+        return node
+    if op == '*' and divisors != {1: 1}:
+        # Products are calculated directly, and can't use the divisibility terms
+        return node
+
+    report['reductions'] += 1
+    return Reduction(node.pos, node, acc, op, poly, tuple(sorted(divisors.items())))
+
+##
+### SUPERINSTRUCTIONS
+##
+
+# Fused nodes for the statement shapes that dominate typical programs:
+# while a < b, if a % b == 0 (or != 0), and return ident.
+# (i = i + k and i += k become Increment nodes in the peephole pass.)
+# Use misc/shapes.py to find out which shapes are common in a set of programs.
+
+def _superinstruction(node, report):
+    new = _superinstruction_match(node)
+    if new is not node:
+        report['superinstructions'] += 1
+    return new
+
+def _superinstruction_match(node):
+    if (isinstance(node, While) and isinstance(node.cond, Comparison) and
+            len(node.cond.contents) == 3):
+        left, op, right = node.cond.contents
+        return WhileCompare(node.pos, op.pos, left, op.op, right, node.body)
+
+    elif (isinstance(node, Conditional) and isinstance(node.cond, Comparison) and
+            len(node.cond.contents) == 3):
+        mod, op, zero = node.cond.contents
+        if (op.op in ('==', '!=') and _is_int(zero, 0) and isinstance(mod, BinaryOp) and
+                mod.kind == "math" and mod.op == '%'):
+            return IfDivisible(node.pos, mod.pos, op.pos, mod.left, mod.right, op.op,
+                               node.then_body, node.else_body)
+
+    elif (isinstance(node, ControlFlowStatement) and node.kind == "return" and
+            isinstance(node.arg, Ident)):
+        return ReturnVar(node.pos, node.arg)
+
+    return node
+
+##
+### PROFILE-GUIDED CHAIN REORDERING
+##
+
+# if x == 1 { ... } else if x == 2 { ... } else if x == 3 { ... } else { ... }
+# where x is a variable and the constants are all different numbers (or all different
+# strings) takes the same branch whatever order the comparisons are made in, so the
+# most frequently taken ones (according to the profile) can be tested first.
+# See ReorderedChain in ast.py for how errors are kept the same.
+
+def _equality_chain(node):
+    """ Return the if statements in an if/else if chain of x == constant tests, or []. """
+    cases = []
+    while isinstance(node, Conditional):
+        cond = node.cond
+        if not (isinstance(cond, Comparison) and len(cond.contents) == 3 and
+                isinstance(cond.contents[0], Ident) and cond.contents[1].op == '==' and
+                isinstance(cond.contents[2], Value)):
+            break
+        cases.append(node)
+        if not (node.else_body and len(node.else_body) == 1):
+            break
+        node = node.else_body[0]
+
+    if len(cases) < 2:
+        return []
+
+    # Only the chain up to the first test of something else can be reordered
+    name = cases[0].cond.contents[0].name
+    numeric = cases[0].cond.contents[2].kind != "string"
+    for i, case in enumerate(cases):
+        ident, _, value = case.cond.contents
+        if ident.name != name or (value.kind != "string") != numeric:
+            cases = cases[:i]
+            break
+
+    values = [case.cond.contents[2].value for case in cases]
+    if len(cases) < 2 or len(set(values)) != len(values):
+        return []
+    return cases
+
+def _reorder_chains(node, profile, report):
+    """ Replace the if/else if chains in a tree that are worth reordering, top-down. """
+    cases = _equality_chain(node)
+    if cases:
+        counts = [profile.taken(case) for case in cases]
+        order = sorted(range(len(cases)), key=lambda i: -counts[i])
+        for case in cases:
+            case.then_body = [_reorder_chains(n, profile, report) for n in case.then_body]
+        last = cases[-1]
+        if last.else_body:
+            last.else_body = [_reorder_chains(n, profile, report) for n in last.else_body]
+
+        if order != sorted(order):
+            report['reordered_chains'] += 1
+            ident = cases[0].cond.contents[0]
+            return ReorderedChain(node.pos, ident, node, cases, tuple(order))
+        return node
+
+    for field in node._fields:
+        child = getattr(node, field)
+        if isinstance(child, list):
+            setattr(node, field, [_reorder_chains(c, profile, report) if isinstance(c, Node)
+                                  else c for c in child])
+        elif isinstance(child, Node):
+            setattr(node, field, _reorder_chains(child, profile, report))
+
+    return node
+
+##
+### COMMON SUBEXPRESSION ELIMINATION
+##
+
+# Expressions are only considered within a "region": a pure expression (or the
+# pure arguments of a call), where nothing can change a variable between the
+# first and the last occurrence of a subexpression.
+#
+# The first occurrence is replaced by a TempStore, which evaluates the expression
+# as usual but also saves the result, and later occurrences by TempLoads.
+# That keeps the evaluation order intact, so errors are raised exactly where they
+# would have been without the optimization.
+#
+# Because of short-circuiting (&&, || and chained comparisons), some parts of an expression
+# are only conditionally evaluated; a conditionally evaluated occurrence can use a
+# temporary, but never create one.
+
+class _CSE:
+    def __init__(self, pure, builtins, report):
+        self.pure = pure
+        self.builtins = builtins
+        self.report = report
+        self.report.setdefault('cse', 0)
+
+    def statements(self, stmts):
+        for i, stmt in enumerate(stmts):
+            stmts[i] = self.statement(stmt)
+
+    def statement(self, node):
+        if isinstance(node, Function):
+            self.statements(node.body)
+        elif isinstance(node, Conditional):
+            node.cond = self.expr(node.cond)
+            self.statements(node.then_body)
+            if node.else_body:
+                self.statements(node.else_body)
+        elif isinstance(node, While):
+            node.cond = self.expr(node.cond)
+            self.statements(node.body)
+        elif isinstance(node, ControlFlowStatement):
+            if node.arg is not None:
+                node.arg = self.expr(node.arg)
+        else:
+            return self.expr(node)
+
+        return node
+
+    def expr(self, node):
+        """ Find the largest pure regions within an expression, and optimize them. """
+
+        if is_pure(node, self.pure, self.builtins):
+            exprs = [node]
+            self.region(exprs)
+            return exprs[0]
+
+        if isinstance(node, BinaryOp):
+            if node.kind != "assign":
+                node.left = self.expr(node.left)
+            node.right = self.expr(node.right)
+        elif isinstance(node, UnaryOp):
+            node.arg = self.expr(node.arg)
+        elif isinstance(node, Comparison):
+            node.contents = [self.expr(n) if i % 2 == 0 else n
+                             for i, n in enumerate(node.contents)]
+        elif isinstance(node, FunctionCall):
+            # The arguments are all evaluated in order before the call happens,
+            # so they can share temporaries with each other, e.g. print(a*b, a*b + 1)
+            if all(is_pure(a, self.pure, self.builtins) for a in node.args):
+                self.region(node.args)
+            else:
+                node.args = [self.expr(a) for a in node.args]
+
+        return node
+
+    def region(self, exprs):
+        """ Eliminate repeated subexpressions in a list of pure expressions (modified in place). """
+
+        while True:
+            occurrences = {}
+            for i, e in enumerate(exprs):
+                self._collect(e, exprs, i, False, occurrences)
+
+            candidates = [(count_nodes(occ[0][0]), key) for key, occ in occurrences.items()
+                          if len(occ) > 1 and not occ[0][3]]
+            if not candidates:
+                return
+
+            # Prefer the largest expression; its subexpressions are then evaluated only once
+            # anyway, so they may no longer be repeated on the next round.
+            key = max(candidates, key=lambda c: c[0])[1]
+            slot = "%{}".format(self.report['cse'])
+            self.report['cse'] += 1
+
+            for n, (node, holder, where, _) in enumerate(occurrences[key]):
+                new = TempStore(node.pos, slot, node) if n == 0 else TempLoad(node.pos, slot)
+                if isinstance(holder, list):
+                    holder[where] = new
+                else:
+                    setattr(holder, where, new)
+
+    def _collect(self, node, holder, where, conditional, occurrences):
+        """ Record all non-trivial subexpressions, in evaluation order.
+
+            Each occurrence is stored as (node, holder, where, conditional), where
+            holder and where describe how to replace the node: holder[where] if holder is
+            a list, or setattr(holder, where, ...) otherwise.
+        """
+
+        if isinstance(node, (Value, Ident, TempLoad)):
+            return
+        elif isinstance(node, TempStore):
+            self._collect(node.expr, node, 'expr', conditional, occurrences)
+            return
+
+        key = structure_key(node)
+        occurrences.setdefault(key, []).append((node, holder, where, conditional))
+
+        if isinstance(node, BinaryOp):
+            self._collect(node.left, node, 'left', conditional, occurrences)
+            # The right side of && and || is only evaluated if the left side didn't decide
+            right_conditional = conditional or node.kind == "logical"
+            self._collect(node.right, node, 'right', right_conditional, occurrences)
+        elif isinstance(node, UnaryOp):
+            self._collect(node.arg, node, 'arg', conditional, occurrences)
+        elif isinstance(node, Comparison):
+            # a < b < c: a and b are always evaluated, c only if a < b
+            for i in range(0, len(node.contents), 2):
+                self._collect(node.contents[i], node.contents, i, conditional or i > 2,
+                              occurrences)
+        elif isinstance(node, FunctionCall):
+            for i in range(len(node.args)):
+                self._collect(node.args[i], node.args, i, conditional, occurrences)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+import os
+import sys
+
+#
+# Output sinks: where the output of print() goes.
+#
+# Each interpreter writes its output to a sink, which collects it in a buffer and passes
+# it on in large chunks, rather than making a write() call per print(). The buffer is
+# passed on once it holds BUFFER_SIZE characters, and whenever the interpreter flushes
+# the sink: when a program (or a function called by Program.vectorize) finishes, also if
+# it fails; before a program reads input, so that prompts are seen; before pmap_reduce
+# starts its workers; and when a step-wise program (see cooperative.py) yields.
+#
+# The output argument of an Interpreter can be a sink, or anything make_sink() accepts:
+#
+# * None, for sys.stdout (whatever it is when the output is written), flushed at
+#   every line when it is a terminal;
+# * a file object, such as io.StringIO();
+# * an int, for a file descriptor, which is written to with os.write();
+# * a callable, which is called with the output, in chunks.
+#
+# MemorySink collects the output in memory, for getvalue().
+#
+
+# How many characters a sink buffers before passing them on
+BUFFER_SIZE = 64 * 1024
+
+class Sink:
+    """ Base class for sinks; subclasses implement _write(), and optionally _flush().
+
+        buffer_size -- how many characters to buffer; 0 passes every write on at once
+    """
+
+    def __init__(self, buffer_size=None):
+        self.buffer_size = BUFFER_SIZE if buffer_size is None else buffer_size
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self._drain()
+
+    def _drain(self):
+        """ Pass the buffer on. """
+        if self.parts:
+            text = "".join(self.parts)
+            self.parts = []
+            self.size = 0
+            self._write(text)
+
+    def flush(self):
+        """ Pass the buffer on, and flush whatever it was passed to. """
+        self._drain()
+        self._flush()
+
+    def _write(self, text):
+        raise NotImplementedError
+
+    def _flush(self):
+        pass
+
+class FileSink(Sink):
+    """ Writes to a (text) file object. """
+
+    def __init__(self, file, buffer_size=None):
+        super().__init__(buffer_size)
+        self.file = file
+
+    def _write(self, text):
+        self.file.write(text)
+
+    def _flush(self):
+        self.file.flush()
+
+class StdoutSink(Sink):
+    """ Writes to sys.stdout; passes every line on if it is a terminal. """
+
+    def __init__(self, buffer_size=None):
+        if buffer_size is None and _isatty(sys.stdout):
+            buffer_size = 0
+        super().__init__(buffer_size)
+
+    def _write(self, text):
+        sys.stdout.write(text)
+
+    def _flush(self):
+        sys.stdout.flush()
+
+class FDSink(Sink):
+    """ Writes to a file descriptor, encoded with encoding. """
+
+    def __init__(self, fd, buffer_size=None, encoding='utf-8'):
+        super().__init__(buffer_size)
+        self.fd = fd
+        self.encoding = encoding
+
+    def _write(self, text):
+        data = text.encode(self.encoding)
+        while data:
+            data = data[os.write(self.fd, data):]
+
+class CallbackSink(Sink):
+    """ Calls callback with each chunk of output. """
+
+    def __init__(self, callback, buffer_size=None):
+        super().__init__(buffer_size)
+        self.callback = callback
+
+    def _write(self, text):
+        self.callback(text)
+
+class MemorySink(Sink):
+    """ Keeps the output in memory; getvalue() returns all of it. """
+
+    def __init__(self):
+        super().__init__(0)
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def _drain(self):
+        pass
+
+    def getvalue(self):
+        text = "".join(self.parts)
+        self.parts = [text]
+        return text
+
+    def clear(self):
+        self.parts = []
+
+def _isatty(file):
+    try:
+        return file.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+def make_sink(output):
+    """ Return the sink for an interpreter's output argument; see above. """
+    if output is None:
+        return StdoutSink()
+    elif isinstance(output, Sink):
+        return output
+    elif type(output) is int:
+        return FDSink(output)
+    elif hasattr(output, 'write'):
+        return FileSink(output)
+    elif callable(output):
+        return CallbackSink(output)
+    raise TypeError("output must be a file, file descriptor, callable or sink, not {!r}"
+                    .format(output))
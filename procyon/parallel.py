@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+import os
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from .common import *  # Exceptions
+from . import interpreter, memo
+from .ast import Ident, Function, FunctionCall, walk
+
+#
+# The pmap_reduce(func, start, stop, reducer) built-in: reducer(...reducer(reducer(
+# func(start), func(start+1)), func(start+2))..., func(stop-1)), with the calls to func
+# spread over a pool of worker processes.
+#
+# The range is split into one contiguous chunk per worker, and each worker reduces its own
+# chunk, so reducer must be associative (as +, max, etc. are). The partial results are
+# then reduced in order by the caller.
+#
+# Each worker is sent the two functions, and the variables they (and the functions they
+# call) may read, once per pmap_reduce call; see _captured(). Workers run in separate
+# processes, so changes they make to $globals are not seen by the caller, and print()
+# output from different workers may be interleaved. Errors are raised in the caller as
+# they were in the worker, with the position in the Procyon source.
+#
+# If the caller has a budget, each chunk gets an equal share of the steps it has left
+# (and the same deadline and size limits), and the steps the chunks used are then
+# counted in the caller's budget.
+#
+# The pool is shut down when Python exits, or by close().
+#
+
+# Number of worker processes; None means one per CPU
+PMAP_WORKERS = None
+
+_pool = None
+_in_worker = False
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(PMAP_WORKERS, initializer=_start_worker)
+    return _pool
+
+def close():
+    """ Shut down the pool of worker processes; the next pmap_reduce starts a new one. """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+atexit.register(close)
+
+def _start_worker():
+    global _in_worker
+    _in_worker = True
+
+def _captured(funcs, scope):
+    """ Find the variables that the functions, and the functions they call, may read.
+
+        Returns ({name: value}, {$name: value}) with the current values of all names used
+        in the functions that exist in scope.
+    """
+    variables, global_vars = {}, {}
+    todo, seen = list(funcs), set()
+    while todo:
+        func = todo.pop()
+        if id(func) in seen:
+            continue
+        seen.add(id(func))
+
+        for node in walk(func.body):
+            if isinstance(node, Ident):
+                name = node.name
+            elif isinstance(node, FunctionCall):
+                name = node.func_name.name
+            else:
+                continue
+
+            value = interpreter._lookup_var(scope, name)
+            if value is interpreter._MISSING:
+                continue
+            (global_vars if name[0] == '$' else variables)[name] = value
+            if isinstance(value, Function):
+                todo.append(value)
+
+    return variables, global_vars
+
+def _reduce_range(func, reducer, start, stop, scope):
+    call = interpreter._call_function
+    result = call(func, [start], scope)
+    for i in range(start + 1, stop):
+        result = call(reducer, [result, call(func, [i], scope)], scope)
+    return result
+
+def _run_chunk(func, reducer, variables, global_vars, budget, start, stop):
+    """ Reduce a chunk of the range in a worker process.
+
+        Returns the result, and the number of steps used from the chunk's budget, if any.
+    """
+    interp = interpreter.Interpreter(budget=budget)
+    interp.globals.update(global_vars)
+    # The functions see the captured variables as if called from the caller's scope
+    scope = (interp.scope, variables, interp)
+
+    # Memo functions get their cache when defined, which the copies sent here weren't
+    funcs = [v for v in list(variables.values()) + list(global_vars.values())
+             if isinstance(v, Function)]
+    for node in walk([func, reducer] + funcs):
+        if isinstance(node, Function) and node.memo and node.cache is None:
+            node.cache = memo.MemoCache(node)
+
+    try:
+        result = _reduce_range(func, reducer, start, stop, scope)
+    finally:
+        interp.sink.flush()
+    return result, budget.steps_used if budget is not None else 0
+
+def _check_function(pos, value, nparams, what):
+    if not isinstance(value, Function):
+        raise ProcyonTypeError(pos, "pmap_reduce: {} must be a function".format(what))
+    if len(value.params) != nparams:
+        raise ProcyonTypeError(pos, "pmap_reduce: {} must take {} argument{}".format(
+            what, nparams, "s" if nparams != 1 else ""))
+
+def pmap_reduce(pos, args, scope):
+    """ Implement pmap_reduce(func, start, stop, reducer); args are already evaluated. """
+    func, start, stop, reducer = args
+    _check_function(pos, func, 1, "the first argument")
+    _check_function(pos, reducer, 2, "the reducer")
+    if type(start) is not int or type(stop) is not int:
+        raise ProcyonTypeError(pos, "pmap_reduce: the range must be given as ints")
+    if stop <= start:
+        raise ProcyonTypeError(pos, "pmap_reduce: empty range {}..{}".format(start, stop))
+
+    if _in_worker:
+        # Nested calls run in the worker itself
+        return _reduce_range(func, reducer, start, stop, scope)
+
+    scope[2].sink.flush()  # Output printed so far comes before the workers'
+    pool = _get_pool()
+    chunks = min(PMAP_WORKERS or os.cpu_count(), stop - start)
+    bounds = [start + (stop - start) * i // chunks for i in range(chunks + 1)]
+    variables, global_vars = _captured([func, reducer], scope)
+    budget = scope[2].budget
+    budgets = [None] * chunks if budget is None else budget.split(chunks)
+    futures = [pool.submit(_run_chunk, func, reducer, variables, global_vars, part, a, b)
+               for a, b, part in zip(bounds, bounds[1:], budgets)]
+
+    results = []
+    for future in futures:
+        partial, steps = future.result()
+        results.append(partial)
+        if budget is not None:
+            budget.charge(steps)
+    result = results[0]
+    for partial in results[1:]:
+        result = interpreter._call_function(reducer, [result, partial], scope)
+    return result
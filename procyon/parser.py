@@ -360,6 +360,10 @@ def p_statement_func(p):
     'block_statement : FUNC ident LPAREN optargs RPAREN block'
     p[0] = Function(pos(p, 1), p[2], p[4], p[6])
 
+def p_statement_memo_func(p):
+    'block_statement : MEMO FUNC ident LPAREN optargs RPAREN block'
+    p[0] = Function(pos(p, 1), p[3], p[5], p[7], memo=True)
+
 def p_statement_return(p):
     'statement : RETURN'
     p[0] = ControlFlowStatement(pos(p, 1), "return", None)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+import hashlib
+import json
+from collections import Counter
+from . import interpreter, compiler
+from .ast import (BinaryOp, Function, Conditional, While, WhileCompare, CountedLoop, Square,
+                  walk)
+
+#
+# Profile-guided optimization.
+#
+# A profiling run (procyon.py --profile-out prof.json) records, for every node, how the
+# program actually behaved: the types produced by math operations, how often each
+# branch of an if statement was taken, how often each function was called, and how
+# many iterations each loop ran. The next run (--profile-in prof.json) uses that to:
+#
+# * compile hot functions and loops before they first run, instead of waiting for them
+#   to reach the JIT thresholds (see compiler.py);
+# * choose the fast path of compiled math operations by the types they produced;
+# * test the most frequently taken case first in if/else if chains that compare one
+#   variable to different constants (see _reorder_chains in optimizer.py).
+#
+# Nodes are identified by their position in the source, so a profile only applies to
+# the exact program it was recorded for; it contains a hash of the source to check that.
+#
+
+PROFILE_VERSION = 1
+
+def node_key(node):
+    """ Return the key identifying a node in a profile.
+
+        The if statements in an if/else if chain all share the position of the first if,
+        so those are told apart by the position of their conditions.
+    """
+    if isinstance(node, Conditional):
+        return "{}:{}:{}:{}:Conditional".format(*node.pos, *node.cond.pos)
+    return "{}:{}:{}".format(*node.pos, type(node).__name__)
+
+def source_hash(source):
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+class Profile:
+    """ Runtime observations for a single program. """
+
+    def __init__(self, source_hash=None):
+        self.source_hash = source_hash
+        self.types = {}     # node key -> {type name: count}, for math operations
+        self.branches = {}  # node key -> [times then_body ran, times it didn't]
+        self.calls = {}     # node key of the function definition -> number of calls
+        self.loops = {}     # node key -> [number of runs, total number of iterations]
+
+    @classmethod
+    def load(cls, filename):
+        """ Read a profile written by save(); raises ValueError for invalid files. """
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or data.get('version') != PROFILE_VERSION:
+            raise ValueError("{} is not a Procyon profile (version {})".format(
+                filename, PROFILE_VERSION))
+
+        profile = cls(data['source'])
+        profile.types = data['types']
+        profile.branches = data['branches']
+        profile.calls = data['calls']
+        profile.loops = data['loops']
+        return profile
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'version': PROFILE_VERSION, 'source': self.source_hash,
+                       'types': self.types, 'branches': self.branches,
+                       'calls': self.calls, 'loops': self.loops}, f, indent=1, sort_keys=True)
+
+    def matches(self, source):
+        """ Test if this profile was recorded for the given source code. """
+        return self.source_hash == source_hash(source)
+
+    def taken(self, node):
+        """ How many times an if statement's then_body ran (0 if unknown). """
+        return self.branches.get(node_key(node), (0, 0))[0]
+
+    def result_type(self, node):
+        """ The only type a math operation produced, or None if it produced several (or none). """
+        types = self.types.get(node_key(node), {})
+        return next(iter(types)) if len(types) == 1 else None
+
+##
+### RECORDING
+##
+
+# While recording, the compiler is disabled, so that every node runs in the tree walker,
+# and the tree walker's evaluators for the profiled nodes are temporarily replaced by
+# the versions below, which do the same work and also take notes. Since that affects all
+# interpreters, no other programs should run while a profile is recorded. The recording
+# interpreter doesn't compile anything meanwhile.
+
+class Recorder:
+    """ Records a profile while a program runs; use as a context manager around the run.
+
+        The observations are added to profile, which is then marked as belonging to source.
+    """
+
+    def __init__(self, profile, source, trees, interp):
+        self.profile = profile
+        self.interp = interp
+        profile.source_hash = source_hash(source)
+        self.trees = trees
+        # All keyed by node
+        self.types = {}
+        self.branches = {}
+        self.loop_runs = Counter()
+
+    def __enter__(self):
+        interp = self.interp
+        self.saved = (dict(interpreter._evaluators), interp._jit_threshold,
+                      interp._osr_threshold)
+        interp.jit_threshold = interp.osr_threshold = 0
+
+        evaluators = interpreter._evaluators
+        self._wrap_result(BinaryOp, evaluators[BinaryOp])
+        self._wrap_result(Square, evaluators[Square])
+        evaluators[Conditional] = self._conditional
+        for loop_type in (While, WhileCompare, CountedLoop):
+            self._wrap_loop(loop_type, evaluators[loop_type])
+        return self
+
+    def __exit__(self, *exc_info):
+        evaluators, self.interp.jit_threshold, self.interp.osr_threshold = self.saved
+        interpreter._evaluators.clear()
+        interpreter._evaluators.update(evaluators)
+        self._finish()
+        return False
+
+    def _wrap_result(self, node_type, evaluate):
+        types = self.types
+
+        def record_type(tree, scope):
+            result = evaluate(tree, scope)
+            if node_type is not BinaryOp or tree.kind == "math":
+                if tree not in types:
+                    types[tree] = Counter()
+                types[tree][type(result).__name__] += 1
+            return result
+        interpreter._evaluators[node_type] = record_type
+
+    def _wrap_loop(self, node_type, evaluate):
+        loop_runs = self.loop_runs
+
+        def record_run(tree, scope):
+            loop_runs[tree] += 1
+            return evaluate(tree, scope)
+        interpreter._evaluators[node_type] = record_run
+
+    def _conditional(self, tree, scope):
+        counts = self.branches.setdefault(tree, [0, 0])
+
+        if interpreter._evaluate_tree(tree.cond, scope):
+            counts[0] += 1
+            interpreter._evaluate_all(tree.then_body, scope)
+        else:
+            counts[1] += 1
+            if tree.else_body:
+                interpreter._evaluate_all(tree.else_body, scope)
+
+        return None
+
+    def _finish(self):
+        profile = self.profile
+        for tree, types in self.types.items():
+            profile.types[node_key(tree)] = dict(types)
+        for tree, counts in self.branches.items():
+            profile.branches[node_key(tree)] = counts
+        for tree, runs in self.loop_runs.items():
+            profile.loops[node_key(tree)] = [runs, tree.back_edges]
+        for node in walk(self.trees):
+            if isinstance(node, Function) and node.calls:
+                profile.calls[node_key(node)] = node.calls
+
+##
+### APPLYING A PROFILE
+##
+
+def apply(profile, trees, jit_threshold=None, osr_threshold=None):
+    """ Compile the functions and loops in a program that the profile shows to be hot.
+
+        Math operations that only produced a single type get that type as their type_hint,
+        which the compiler uses to choose their fast path. Returns the number of
+        functions and loops compiled.
+
+        The thresholds default to compiler.JIT_THRESHOLD and OSR_THRESHOLD.
+    """
+    if jit_threshold is None:
+        jit_threshold = compiler.JIT_THRESHOLD
+    if osr_threshold is None:
+        osr_threshold = compiler.OSR_THRESHOLD
+
+    for node in walk(trees):
+        if isinstance(node, (BinaryOp, Square)):
+            node.type_hint = profile.result_type(node)
+
+    compiled = 0
+    for node in walk(trees):
+        key = node_key(node)
+        if isinstance(node, Function):
+            if 0 < jit_threshold <= profile.calls.get(key, 0) and node.compiled is None:
+                compiler.tier_up(node)
+                compiled += 1
+        elif isinstance(node, (While, WhileCompare, CountedLoop)):
+            iterations = profile.loops.get(key, (0, 0))[1]
+            if 0 < osr_threshold <= iterations and node.compiled is None:
+                compiler.osr_entry(node)
+                compiled += 1
+
+    return compiled
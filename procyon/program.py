@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+import re
+from .common import *  # Exceptions
+from . import interpreter as interp_module, lexer, vectorize
+
+#
+# Prepared programs: compile(source) parses and optimizes a program once, and returns a
+# Program that can be run any number of times, each time with different values for some
+# of its variables (its bindings), e.g. compile("y = x^2 + 1;").run({'x': 3}, ['y']).
+#
+# That is much faster than putting the values into the source and calling evaluate(),
+# which would parse each variant of the program anew (and fill the program cache). Since
+# the optimizer never looks at variables' values, the optimized program is the same for
+# all bindings.
+#
+# Every run starts with a fresh global state, holding only the built-in constants and
+# the bindings. Everything else carries over from run to run: the compiled code of hot
+# functions and loops, and the caches of memo functions, which are pure, so their results
+# don't depend on the bindings either.
+#
+
+# The types of the values a program can work with
+_VALUE_TYPES = (int, float, str)
+
+# Variable names, as the lexer reads them
+_NAME = re.compile(lexer.t_IDENT.__doc__)
+
+# The built-in functions' names and numbers of arguments
+_builtins = interp_module.__functions
+
+class Program:
+    """ A parsed and optimized program; see compile().
+
+        A program has its own interpreter, so that output and budget can be set for it.
+        Runs from several threads take turns.
+    """
+
+    def __init__(self, source, optimize=1, output=None, budget=None):
+        self.source = source
+        self.interpreter = interp_module.Interpreter(optimize, output, budget)
+        self.report = {}
+        if source.strip():
+            self.trees = interp_module._parse_program(
+                self.interpreter, source, optimize, self.report, None)
+        else:
+            self.trees = []
+
+    def __repr__(self):
+        return "Program({!r})".format(self.source)
+
+    def run(self, bindings=None, returns=None):
+        """ Run the program, with the variables in the bindings dict set to their values.
+
+            Returns the program's results, as evaluate() does, or if returns is a list of
+            variable names, a dict with the values they have at the end of the program.
+            $name variables are bound and returned as "$name".
+        """
+        interp = self.interpreter
+        with interp.lock:
+            interp.reset()
+            if bindings:
+                for name, value in bindings.items():
+                    _check_name(name)
+                    if type(value) not in _VALUE_TYPES:
+                        raise ProcyonTypeError((-1, -1), "cannot bind {} to {!r}: Procyon "
+                                               "values are ints, floats and strings".format(
+                                                   name, value))
+                interp.globals.update(bindings)
+            if interp.budget is not None:
+                interp.budget.start()
+
+            try:
+                results = interp_module._evaluate_all(self.trees, interp.scope)
+            finally:
+                interp.sink.flush()
+            if returns is None:
+                return results
+
+            values = {}
+            for name in returns:
+                try:
+                    values[name] = interp.globals[name]
+                except KeyError:
+                    raise ProcyonNameError(
+                        (-1, -1), "variable {} not set by the program".format(name)) from None
+            return values
+
+    def vectorize(self, name):
+        """ Return the function name, defined by the program, as a function of NumPy
+            arrays; see vectorize.py.
+        """
+        return vectorize.vectorize(self, name)
+
+def _check_name(name):
+    """ Raise the error that assigning to name in a program would, if any. """
+    if type(name) is not str or not _NAME.fullmatch(name) or name in lexer.keywords:
+        raise ProcyonTypeError((-1, -1), "cannot bind {!r}: not a variable name".format(name))
+    if name in _builtins:
+        raise ProcyonTypeError(
+            (-1, -1), 'cannot assign to built-in function "{}"'.format(name))
+
+def compile(source, optimize=1, output=None, budget=None):
+    """ Parse and optimize a program, in the form of a string, to run it many times.
+
+    Returns a Program; use its run() method to run it. Syntax errors are raised here.
+
+    Keyword arguments:
+    optimize -- optimization level passed to the optimizer, as for evaluate()
+    output -- where print() writes to, as for Interpreter; None means sys.stdout
+    budget -- a budget.Budget limiting each run
+    """
+    return Program(source, optimize, output, budget)
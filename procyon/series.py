@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+from math import comb, gcd
+
+#
+# Exact sums over arithmetic progressions, used to evaluate the reduction loops
+# recognized by the optimizer (see Reduction in ast.py) in closed form.
+#
+# Polynomials are tuples of int coefficients, lowest degree first:
+# (3, 0, 2) is 3 + 2x^2. Everything here is integer arithmetic, so results are exact.
+#
+
+def poly_add(p, q):
+    if len(p) < len(q):
+        p, q = q, p
+    return tuple(a + (q[i] if i < len(q) else 0) for i, a in enumerate(p))
+
+def poly_neg(p):
+    return tuple(-a for a in p)
+
+def poly_mul(p, q):
+    result = [0] * (len(p) + len(q) - 1)
+    for i, a in enumerate(p):
+        for j, b in enumerate(q):
+            result[i + j] += a * b
+    return tuple(result)
+
+def poly_eval(p, x):
+    result = 0
+    for a in reversed(p):
+        result = result * x + a
+    return result
+
+def progression_length(start, stop, step):
+    """ The number of values in range(start, stop, step). """
+    return len(range(start, stop, step))
+
+def poly_sum(p, start, step, n):
+    """ Sum p(start + k*step) for k = 0 .. n-1.
+
+        q(k) = p(start + k*step) is a polynomial of the same degree d, so it can be
+        written as sum(D_j * C(k, j)) for j = 0..d, where D_j are its forward differences
+        at 0. Since sum(C(k, j)) for k = 0..n-1 is C(n, j+1), the total is
+        sum(D_j * C(n, j+1)). Only d+1 values of p are needed, whatever n is.
+    """
+    if n <= 0:
+        return 0
+
+    values = [poly_eval(p, start + k * step) for k in range(min(len(p), n))]
+    total = 0
+    for j in range(len(values)):
+        total += values[0] * comb(n, j + 1)
+        values = [b - a for a, b in zip(values, values[1:])]
+
+    return total
+
+def multiples(start, step, n, m):
+    """ Find the values divisible by m among start + k*step, k = 0 .. n-1.
+
+        These form an arithmetic progression themselves; returns its (start, step, length).
+    """
+    m = abs(m)
+    g = gcd(step, m)
+    if start % g != 0:
+        return (start, step, 0)
+
+    # Solve start + k*step = 0 (mod m) for k; the solutions are k0 + t*period
+    period = m // g
+    if period == 1:
+        k0 = 0
+    else:
+        k0 = (-(start // g) * pow(step // g, -1, period)) % period
+
+    if k0 >= n:
+        return (start, step, 0)
+    return (start + k0 * step, step * period, (n - 1 - k0) // period + 1)
+
+def filtered_sum(p, start, step, n, divisors):
+    """ Sum p over the values start + k*step (k = 0 .. n-1) that pass a divisibility filter.
+
+        divisors is a sequence of (m, coefficient) pairs, and the filter counts each value
+        sum(coefficient for every m that divides it) times; see the optimizer's
+        _divisibility_filter for how conditions such as a % 3 == 0 || a % 5 == 0 are
+        turned into that form.
+    """
+    total = 0
+    for m, coefficient in divisors:
+        total += coefficient * poly_sum(p, *multiples(start, step, n, m))
+    return total
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+import gc
+import json
+import os
+import signal
+import socket
+from .common import *  # Exceptions
+from .batch import run_captured
+from .interpreter import Interpreter
+
+#
+# Server mode: keep the interpreter loaded, and run programs sent over a Unix socket
+# (procyon.py --serve /path/to.sock [library.pr ...]).
+#
+# Starting Python, importing the interpreter and building the parser takes far longer
+# than running a small program, so the server does that once. It then loads the
+# libraries, and forks a number of worker processes, which share the parser and the
+# parsed libraries with the server (copy-on-write) and take turns accepting connections.
+#
+# The protocol is line-based JSON: a client sends {"program": "..."} on a line, and gets
+# a line back with the program's results, output and run time, or its error, in the same
+# format as the entries of a batch mode report (see batch.py). A connection can be used
+# for any number of programs, one after the other. Each program starts with the
+# libraries' variables and functions, and nothing else; changes made by earlier programs
+# are forgotten.
+#
+# A worker serves one connection at a time, until the client closes it, so there should
+# be no more connections open at a time than there are workers; further ones wait.
+# Programs can't read input; input_* fails as it does at the end of input.
+#
+
+# Number of connections waiting to be accepted before new ones are refused
+BACKLOG = 128
+
+def load_libraries(interp, filenames):
+    """ Evaluate the library files in interp, and return the variables and functions
+        they define.
+
+        Errors (e.g. ProcyonSyntaxError) are raised as usual; filename is set as an
+        attribute of the exception.
+    """
+    for filename in filenames:
+        try:
+            with open(filename, 'r') as f:
+                interp.evaluate(f.read())
+        except ProcyonException as e:
+            e.filename = filename
+            raise
+    return dict(interp.globals)
+
+def _serve_connection(conn, interp, library):
+    with conn, conn.makefile('rwb') as f:
+        for line in f:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                program = request['program']
+                if not isinstance(program, str):
+                    raise ValueError("program must be a string")
+            except (ValueError, KeyError, TypeError) as e:
+                entry = {'error': {'type': 'RequestError', 'message': str(e)}}
+            else:
+                entry = run_captured(interp, {}, lambda: program, library)
+
+            f.write(json.dumps(entry).encode('utf-8') + b"\n")
+            f.flush()
+
+def _worker(sock, interp, library):
+    """ The main loop of a worker process; never returns. """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The server stops the workers
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Programs can't read input, and input_*'s prompts aren't printed
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+
+    try:
+        while True:
+            conn, addr = sock.accept()
+            try:
+                _serve_connection(conn, interp, library)
+            except OSError:
+                pass  # The client went away
+    finally:
+        os._exit(1)
+
+def _fork_worker(sock, interp, library):
+    pid = os.fork()
+    if pid == 0:
+        _worker(sock, interp, library)
+    return pid
+
+def serve(path, libraries=(), workers=None, optimize=1, ready=None, budget=None):
+    """ Run the server on the Unix socket path, until it gets SIGTERM or SIGINT.
+
+        libraries -- the filenames of programs whose functions and variables all
+                     programs can use; they are evaluated once, before forking
+        workers -- the number of worker processes (default: one per CPU)
+        ready -- called once the server accepts connections
+        budget -- a budget.Budget limiting each program (and each library)
+
+        Workers that die are replaced. When the server stops, it stops its workers and
+        removes the socket.
+    """
+    # The workers inherit this interpreter, and with it the parser
+    interp = Interpreter(optimize, budget=budget)
+    interp.parse("0;")
+    library = load_libraries(interp, libraries)
+
+    if os.path.exists(path):
+        os.unlink(path)  # Left over from an earlier run
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(BACKLOG)
+
+    # Objects that exist now are never collected, so the collector doesn't touch (and
+    # copy) the pages they're on in the workers
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    pids = set()
+    saved = signal.signal(signal.SIGTERM, stop)
+    try:
+        for i in range(workers or os.cpu_count()):
+            pids.add(_fork_worker(sock, interp, library))
+        if ready is not None:
+            ready()
+
+        while True:
+            pid, status = os.wait()
+            if pid in pids:
+                pids.remove(pid)
+                pids.add(_fork_worker(sock, interp, library))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, saved)
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        sock.close()
+        os.unlink(path)
+
+##
+### CLIENT
+##
+
+class Client:
+    """ A connection to a server; use run() to run programs on it. """
+
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rwb')
+
+    def run(self, program):
+        """ Run a program; returns a dict with its results, output and seconds, or error. """
+        self.file.write(json.dumps({'program': program}).encode('utf-8') + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("the server closed the connection")
+        return json.loads(line.decode('utf-8'))
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
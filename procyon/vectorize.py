@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+# vim: ts=4 sts=4 et sw=4
+
+from .common import *  # Exceptions
+from . import interpreter as interp_module
+from .ast import (Value, Ident, BinaryOp, UnaryOp, Function, Conditional, FunctionCall,
+                  ControlFlowStatement, Comparison, ComparisonOp, walk, iter_child_nodes)
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; vectorize() fails without it
+    np = None
+
+#
+# Vectorized functions: running a Procyon function over whole NumPy arrays of arguments
+# at once, for parameter sweeps, e.g.
+#
+#     f = vectorize(procyon.compile(source), 'f')
+#     f(np.linspace(0, 1, 1000000), 0.5)  # An array with f(x, 0.5) for each x
+#
+# Functions made only of arithmetic, comparisons, &&/||/!, assignments to local
+# variables, the math built-ins (sin, sqrt, floor, ...), if/else and return are
+# translated to NumPy operations on all elements at once. Conditionals become masks: both
+# branches run, each on the elements for which it was taken, and a return only sets
+# the result of the elements still running.
+#
+# Subexpressions that don't depend on the arguments or local variables, such as
+# 3^40 % 7, are evaluated by the regular interpreter, once per call, so that ints keep
+# their exact values. Ints are otherwise computed as floats, which is exact up to 2^53;
+# any (possibly) int value that gets larger than that makes the call fall back.
+#
+# Everything else is run by calling the function for each element in turn, with the
+# regular interpreter, so that the results are always those of a Procyon call:
+#
+# * functions using other constructs (loops, calls to user functions, strings, print...);
+# * arguments that aren't all floats, since NumPy's ints overflow and Procyon's don't;
+# * calls where an int gets larger than 2^53;
+# * calls where an element gets a result that isn't finite, which is where Procyon may
+#   raise an error instead (division by zero, math domain errors, overflows), or reads
+#   a variable that isn't set for it;
+# * programs with a budget, which only the tree walker enforces.
+#
+# The results of vectorized calls are the same as the interpreter's, except that NumPy's
+# math functions may differ from Python's in the last bit, and that the result is always
+# an array of floats.
+#
+
+# The math built-ins, as NumPy functions
+_UFUNCS = {} if np is None else {
+    'sin': np.sin, 'cos': np.cos, 'tan': np.tan,
+    'exp': np.exp, 'log': np.log, 'log10': np.log10, 'log2': np.log2,
+    'asin': np.arcsin, 'acos': np.arccos, 'atan': np.arctan, 'atan2': np.arctan2,
+    'sinh': np.sinh, 'cosh': np.cosh, 'tanh': np.tanh,
+    'asinh': np.arcsinh, 'acosh': np.arccosh, 'atanh': np.arctanh,
+    'abs': np.abs, 'sqrt': np.sqrt, 'ceil': np.ceil, 'floor': np.floor, 'trunc': np.trunc,
+}
+
+_MATH = {} if np is None else {
+    '+': np.add, '-': np.subtract, '*': np.multiply, '/': np.true_divide,
+    '//': np.floor_divide, '%': np.mod, '^': np.power,
+}
+
+_COMPARISONS = {} if np is None else {
+    '==': np.equal, '!=': np.not_equal, '<': np.less, '>': np.greater,
+    '<=': np.less_equal, '>=': np.greater_equal,
+}
+
+# The math built-ins that return ints for ints (abs), or always (the rest)
+_INT_UFUNCS = {'abs', 'ceil', 'floor', 'trunc'}
+
+# The largest int that every int up to it can be represented as a float
+_MAX_EXACT = 2 ** 53
+
+# The built-in functions' names and numbers of arguments
+_builtins = interp_module.__functions
+
+class _Fallback(Exception):
+    """ Raised when a call must be run element by element instead. """
+
+def _supported(func):
+    """ Return True if every node of a function (as parsed) can be vectorized. """
+    for node in walk(func.body):
+        if isinstance(node, Value):
+            if node.kind == 'string':
+                return False
+        elif isinstance(node, FunctionCall):
+            if node.func_name.name not in _UFUNCS:
+                return False
+        elif isinstance(node, ControlFlowStatement):
+            if node.kind != 'return' or node.arg is None:
+                return False
+        elif isinstance(node, Ident):
+            if node.name.startswith('$'):
+                return False
+        elif not isinstance(node, (BinaryOp, UnaryOp, Comparison, ComparisonOp, Conditional)):
+            return False
+    return True
+
+def _constants(func):
+    """ Return the ids of the nodes of a function's expressions that don't depend on its
+        parameters or local variables.
+    """
+    variables = {p.name for p in func.params}
+    variables.update(node.left.name for node in walk(func.body)
+                     if isinstance(node, BinaryOp) and node.kind == 'assign')
+    found = set()
+
+    def visit(node):
+        children = [visit(child) for child in iter_child_nodes(node)]
+        if isinstance(node, Ident):
+            constant = node.name not in variables
+        elif isinstance(node, (Value, ComparisonOp)):
+            constant = True
+        elif isinstance(node, BinaryOp) and node.kind == 'assign':
+            constant = False
+        elif isinstance(node, (BinaryOp, UnaryOp, Comparison, FunctionCall)):
+            constant = all(children)
+        else:
+            constant = False
+        if constant:
+            found.add(id(node))
+        return constant
+
+    for stmt in func.body:
+        visit(stmt)
+    return found
+
+class _Call:
+    """ The state of a vectorized call: local variables, results, and which elements
+        have returned.
+
+        Values are (array or float, ints) pairs; ints is True if the interpreter may have
+        ints for some of the elements.
+    """
+
+    def __init__(self, func, args, constants, scope):
+        n = args[0].shape[0] if args else 1
+        self.size = n
+        self.constants = constants
+        self.scope = scope
+        # name -> (values, mask of the elements the variable is set for, ints)
+        self.vars = {p.name: (a, np.ones(n, dtype=bool), False)
+                     for p, a in zip(func.params, args)}
+        self.result = np.zeros(n)
+        self.done = np.zeros(n, dtype=bool)
+
+    def _check(self, values, active, ints):
+        """ Fall back unless values is finite for all the active elements (and exact, if
+            they may be ints).
+        """
+        values = values[active] if np.ndim(values) else values
+        if not np.isfinite(values).all() or (ints and (np.abs(values) > _MAX_EXACT).any()):
+            raise _Fallback()
+
+    def run(self, stmts, mask):
+        for stmt in stmts:
+            active = mask & ~self.done
+            if not active.any():
+                return
+
+            if isinstance(stmt, Conditional):
+                taken = self.evaluate(stmt.cond, active)[0] != 0
+                self.run(stmt.then_body, active & taken)
+                if stmt.else_body:
+                    self.run(stmt.else_body, active & ~taken)
+            elif isinstance(stmt, ControlFlowStatement):
+                value = self.evaluate(stmt.arg, active)[0]
+                self.result = np.where(active, value, self.result)
+                self.done |= active
+            else:
+                self.evaluate(stmt, active)
+
+    def constant(self, tree):
+        """ Evaluate an expression that is the same for all elements, exactly. """
+        try:
+            value = interp_module._evaluate_tree(tree, self.scope)
+        except Exception:
+            raise _Fallback() from None  # Raised again by the element-wise call
+        if type(value) is int:
+            if abs(value) > _MAX_EXACT:
+                raise _Fallback()
+            return np.float64(value), True
+        elif type(value) is float:
+            if value != value or abs(value) == float('inf'):
+                raise _Fallback()
+            return np.float64(value), False
+        raise _Fallback()
+
+    def evaluate(self, tree, active):
+        """ Evaluate an expression for the active elements; the others get any value.
+            Returns (values, ints); see above.
+        """
+        if id(tree) in self.constants:
+            return self.constant(tree)
+
+        t = type(tree)
+        if t is Ident:
+            name = tree.name
+            if name not in self.vars:
+                raise _Fallback()  # Assigned later on
+            values, defined, ints = self.vars[name]
+            if (active & ~defined).any():
+                raise _Fallback()  # Read from the caller's variables, or unset
+            return values, ints
+
+        elif t is BinaryOp:
+            if tree.kind == 'math':
+                left, left_ints = self.evaluate(tree.left, active)
+                right, right_ints = self.evaluate(tree.right, active)
+                ints = left_ints and right_ints and tree.op != '/'
+                values = _MATH[tree.op](left, right)
+                self._check(values, active, ints)
+                return values, ints
+
+            elif tree.kind == 'logical':
+                left = self.evaluate(tree.left, active)[0] != 0
+                # Like the interpreter, only evaluate the right side where it's needed
+                need = active & (left if tree.op == '&&' else ~left)
+                right = self.evaluate(tree.right, need)[0] != 0 if need.any() else False
+                if tree.op == '&&':
+                    return (left & right).astype(float), True
+                return (left | right).astype(float), True
+
+            else:  # assign
+                name = tree.left.name
+                if name in _builtins:
+                    raise _Fallback()  # An error in the interpreter
+                value, ints = self.evaluate(tree.right, active)
+                old = self.vars.get(name)
+                if old is None:
+                    values = np.broadcast_to(value, (self.size,)).copy()
+                    defined = active.copy()
+                else:
+                    values = np.where(active, value, old[0])
+                    defined = old[1] | active
+                    ints = ints or old[2]
+                self.vars[name] = (values, defined, ints)
+                return value, ints
+
+        elif t is UnaryOp:
+            arg, ints = self.evaluate(tree.arg, active)
+            if tree.op == '-':
+                return np.negative(arg), ints
+            return (arg == 0).astype(float), True
+
+        elif t is Comparison:
+            contents = tree.contents
+            left = self.evaluate(contents[0], active)[0]
+            result = np.ones(self.size, dtype=bool)
+            for i in range(1, len(contents), 2):
+                # Like the interpreter, stop at the first false comparison
+                need = active & result
+                if not need.any():
+                    break
+                right = self.evaluate(contents[i + 1], need)[0]
+                result &= _COMPARISONS[contents[i].op](left, right)
+                left = right
+            return result.astype(float), True
+
+        elif t is FunctionCall:
+            name = tree.func_name.name
+            ufunc = _UFUNCS[name]
+            if name in self.vars or len(tree.args) != ufunc.nin:
+                raise _Fallback()  # An error in the interpreter
+            args = [self.evaluate(a, active) for a in tree.args]
+            ints = name in _INT_UFUNCS and (name != 'abs' or args[0][1])
+            values = ufunc(*[a[0] for a in args])
+            self._check(values, active, ints)
+            return values, ints
+
+        raise _Fallback()
+
+class VectorFunction:
+    """ A Procyon function that can be called with NumPy arrays; see vectorize(). """
+
+    def __init__(self, program, name):
+        if np is None:
+            raise ImportError("vectorize() requires NumPy")
+
+        # The function as parsed is vectorized; the optimized one runs element by element
+        parsed = [t for t in program.interpreter.parse(program.source)
+                  if isinstance(t, Function) and t.name.name == name]
+        defs = [t for t in program.trees if isinstance(t, Function)]
+        if not parsed:
+            raise ProcyonNameError(
+                (-1, -1), "function {} is not defined by the program".format(name))
+
+        self.name = name
+        self.parsed = parsed[-1]
+        self.supported = _supported(self.parsed)
+        self.constants = _constants(self.parsed) if self.supported else set()
+
+        # The function is called from the top level of a program that only defines the
+        # program's functions
+        parent = program.interpreter
+        self.interpreter = interp_module.Interpreter(
+            parent.optimize, parent.output, parent.budget, memo_store=parent._memo_store,
+            jit_threshold=parent._jit_threshold, osr_threshold=parent._osr_threshold)
+        for tree in defs:
+            interp_module._evaluate_tree(tree, self.interpreter.scope)
+        self.func = self.interpreter.globals[name]
+
+        # How many calls ran vectorized, and how many element by element
+        self.vectorized = 0
+        self.fallbacks = 0
+
+    def __repr__(self):
+        return "VectorFunction({})".format(self.name)
+
+    def __call__(self, *args):
+        """ Call the function for each element of the arguments, which are broadcast
+            against each other; returns an array of floats of their (broadcast) shape.
+        """
+        interp_module._check_arity(self.func, len(args))
+        arrays = np.broadcast_arrays(*[np.asarray(a) for a in args])
+        shape = arrays[0].shape if arrays else ()
+
+        if (self.supported and self.interpreter.budget is None and
+                all(a.dtype.kind == 'f' for a in arrays)):
+            try:
+                with self.interpreter.lock, np.errstate(all='ignore'):
+                    call = _Call(self.parsed, [a.astype(float).ravel() for a in arrays],
+                                 self.constants, self.interpreter.scope)
+                    call.run(self.parsed.body, np.ones(call.size, dtype=bool))
+                if call.done.all():
+                    self.vectorized += 1
+                    return call.result.reshape(shape)
+            except _Fallback:
+                pass
+
+        self.fallbacks += 1
+        return self._call_each(arrays, shape)
+
+    def _call_each(self, arrays, shape):
+        func = self.func
+        results = np.empty(shape)
+        columns = [a.ravel().tolist() for a in arrays]
+        with self.interpreter.lock:
+            scope = self.interpreter.scope
+            if self.interpreter.budget is not None:
+                self.interpreter.budget.start()
+            try:
+                for i, args in enumerate(zip(*columns) if columns else [()]):
+                    result = interp_module._call_function(func, list(args), scope)
+                    if type(result) not in (int, float):
+                        raise ProcyonTypeError(func.name.pos, "{}() returned {!r}, not a "
+                                               "number".format(self.name, result))
+                    results.flat[i] = result
+            finally:
+                self.interpreter.sink.flush()
+        return results
+
+def vectorize(program, name):
+    """ Return a version of the function name, defined at the top level of a Program (see
+        procyon.compile()), that is called with NumPy arrays (or numbers) as arguments,
+        and returns an array with the result for each element.
+
+        Raises ImportError if NumPy isn't installed.
+    """
+    return VectorFunction(program, name)
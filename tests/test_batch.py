@@ -0,0 +1,45 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import json
+import pytest
+from procyon.batch import run_batch, find_programs
+
+@pytest.fixture
+def programs(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.pr").write_text('print("a"); x = 2; x * 21;')
+    (tmp_path / "sub" / "b.pr").write_text("x;")  # x is not left over from a.pr
+    (tmp_path / "sub" / "c.pr").write_text("func f() { break; }\nf();")
+    (tmp_path / "sub" / "d.pr").write_text("1 +")
+    (tmp_path / "sub" / "notes.txt").write_text("not a program")
+    (tmp_path / "e.pr").write_text("func f() { return 1; } f; 2^0.5;")
+    return tmp_path
+
+def test_find_programs(programs):
+    found = find_programs([str(programs / "e.pr"), str(programs)])
+    assert [f[len(str(programs)) + 1:] for f in found] == \
+        ["e.pr", "a.pr", "e.pr", "sub/b.pr", "sub/c.pr", "sub/d.pr"]
+
+def test_batch(programs):
+    report = run_batch([str(programs)], jobs=2)
+    assert report['jobs'] == 2 and report['failed'] == 3
+    a, e, b, c, d = report['programs']
+
+    assert a['results'] == [None, 2, 42] and a['output'] == "a\n"
+    assert b['error'] == {'type': 'NameError', 'message': 'unknown identifier "x"',
+                          'line': 1, 'column': 1}
+    assert c['error'] == {'type': 'ControlFlowException',
+                          'message': 'break called outside of a loop', 'line': 1, 'column': 12}
+    assert d['error']['type'] == 'SyntaxError' and 'line' not in d['error']
+    assert e['results'][1].startswith("func") and e['results'][2] == 2 ** 0.5
+    assert all(entry['seconds'] >= 0 for entry in report['programs'])
+
+    # The report is valid JSON
+    assert json.loads(json.dumps(report)) == report
+
+def test_missing_file(tmp_path):
+    report = run_batch([str(tmp_path / "missing.pr")], jobs=1)
+    assert report['failed'] == 1
+    assert report['programs'][0]['error']['type'] == 'FileNotFoundError'
@@ -0,0 +1,92 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import asyncio
+import io
+import pytest
+from procyon import Interpreter, evaluate_async
+from procyon import compiler
+from procyon.budget import Budget
+from procyon.batch import run_batch
+from procyon.common import *  # Mostly exceptions
+
+def run(prog, budget, optimize=1):
+    return Interpreter(optimize).evaluate(prog, budget=budget)
+
+def test_steps():
+    prog = "i = 0; while i < 10 { i = i + 1; }"
+    budget = Budget(steps=1000)
+    assert run(prog, optimize=0, budget=budget) == [0, None]
+    used = budget.steps_used
+    assert run(prog, optimize=0, budget=Budget(steps=used))
+    with pytest.raises(ProcyonStepLimitError) as e:
+        run(prog, optimize=0, budget=Budget(steps=used - 1))
+    # The last node is the 10 in the final test of the condition
+    assert e.value.args == ((1, 18), "step limit of {} exceeded".format(used - 1))
+
+def test_infinite_loops():
+    for prog in ("while 1 { }", "i = 0; while i < 1 { }", "func f(n) { while 1 { n += 1; } } f(0);",
+                 "i = 0; while i < 10^9 { i += 1; }"):
+        with pytest.raises(ProcyonStepLimitError):
+            run(prog, optimize=1, budget=Budget(steps=20000))
+
+def test_timeout():
+    with pytest.raises(ProcyonTimeoutError) as e:
+        run("x = 0;\nwhile 1 { x += 1; }", optimize=1, budget=Budget(seconds=0.05))
+    assert e.value.args[0][0] == 2
+
+def test_int_bits():
+    budget = Budget(int_bits=1000)
+    assert run("2^999; 3 * 2^998; -(2^999);", optimize=1, budget=budget) == \
+        [2 ** 999, 3 * 2 ** 998, -(2 ** 999)]
+    for prog in ("x = 2; 2^2^30;", "x = 2^600; x * x;", "x = 2; while 1 { x = x^2; }",
+                 "x = 1; while 1 { x = x + x; }", "x = 2^999; x + x;",
+                 "n = 1; i = 1; while i <= 1000 { n *= i; i += 1; }",
+                 "x = 3; (x^5000) % 7.5;"):
+        with pytest.raises(ProcyonIntSizeError):
+            run(prog, optimize=1, budget=budget)
+
+def test_string_length():
+    budget = Budget(string_length=10)
+    assert run('x = "abcde"; x + x;', optimize=1, budget=budget)[-1] == "abcde" * 2
+    with pytest.raises(ProcyonStringSizeError) as e:
+        run('s = "ab";\nwhile 1 { s = s + s; }', optimize=1, budget=budget)
+    assert e.value.args == ((2, 17), "string would be longer than 10 characters")
+
+def test_no_compilation(monkeypatch):
+    monkeypatch.setattr(compiler, 'JIT_THRESHOLD', 2)
+    monkeypatch.setattr(compiler, 'OSR_THRESHOLD', 2)
+    interp = Interpreter(budget=Budget(steps=10 ** 6))
+    results = interp.evaluate("func f(x) { return x + 1; } i = 0; n = 0;"
+                              "while i < 100 { n = f(n); i += 1; } n;")
+    assert results[-1] == 100
+    f = interp.globals['f']
+    assert f.calls == 100 and f.compiled is None
+
+def test_budget_restarts():
+    # Every program gets the whole budget
+    prog = "i = 0; while i < 20 { print(i); i += 1; }"
+    interp = Interpreter(output=io.StringIO(), budget=Budget(steps=300))
+    for i in range(10):
+        interp.evaluate(prog)
+
+    # A budget given to evaluate() replaces the interpreter's for that program only
+    with pytest.raises(ProcyonStepLimitError):
+        interp.evaluate(prog, budget=Budget(steps=30))
+    interp.evaluate(prog)
+
+def test_cooperative():
+    with pytest.raises(ProcyonStepLimitError):
+        asyncio.run(evaluate_async("func f() { while 1 { } } f();",
+                                   Interpreter(budget=Budget(steps=5000))))
+    with pytest.raises(ProcyonIntSizeError):
+        asyncio.run(evaluate_async("func f(x) { return x * x; } x = 3; while 1 { x = f(x); }",
+                                   Interpreter(budget=Budget(int_bits=500))))
+
+def test_batch(tmp_path):
+    (tmp_path / "a.pr").write_text("while 1 { }")
+    (tmp_path / "b.pr").write_text("1 + 1;")
+    report = run_batch([str(tmp_path)], jobs=1, budget=Budget(steps=1000))
+    a, b = report['programs']
+    assert a['error']['type'] == 'StepLimitError' and b['results'] == [2]
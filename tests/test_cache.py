@@ -0,0 +1,96 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from tests_common import ev
+from procyon import Interpreter, evaluate, cache, compiler
+from procyon.cache import ProgramCache
+from procyon.common import *  # Mostly exceptions
+
+@pytest.fixture
+def programs(monkeypatch):
+    programs = ProgramCache(size=3)
+    monkeypatch.setattr(cache, 'programs', programs)
+    return programs
+
+def test_hits(programs):
+    assert ev("x = 6; x * 7;") == [6, 42]
+    assert (programs.hits, programs.misses) == (0, 1)
+    assert ev("x = 6; x * 7;") == [6, 42]
+    assert (programs.hits, programs.misses) == (1, 1)
+
+    # The optimization level is part of the key
+    evaluate("x = 6; x * 7;", True, optimize=0)
+    assert (programs.hits, programs.misses, len(programs)) == (1, 2, 2)
+
+def test_evictions(programs):
+    for n in range(5):
+        ev("{};".format(n))
+    assert (len(programs), programs.evictions) == (3, 2)
+    ev("4;")
+    ev("0;")
+    assert (programs.hits, programs.misses) == (1, 6)
+
+    programs.clear()
+    assert (len(programs), programs.hits, programs.misses, programs.evictions) == (0, 0, 0, 0)
+    programs.size = 0
+    ev("0;")
+    assert len(programs) == 0
+
+def test_errors_not_cached(programs):
+    with pytest.raises(ProcyonSyntaxError):
+        ev("1 +")
+    assert len(programs) == 0
+
+    # Runtime errors happen after caching, and happen again
+    for i in range(2):
+        with pytest.raises(ProcyonNameError):
+            ev("y;")
+    assert programs.hits == 1
+
+def test_report(programs):
+    prog = "x = 2 * 3; y = x + 0;"
+    first, second = {}, {}
+    evaluate(prog, True, report=first)
+    evaluate(prog, True, report=second)
+    assert programs.hits == 1
+    assert second == first and first['nodes_before'] > first['nodes_after']
+
+def test_global_state(programs):
+    # A cached program runs against whatever state it finds
+    prog = "func f() { return $k * 2; } f();"
+    a, b = Interpreter(), Interpreter()
+    a.evaluate("$k = 1;")
+    b.evaluate("$k = 10;")
+    assert a.evaluate(prog)[-1] == 2
+    assert b.evaluate(prog)[-1] == 20
+    assert programs.hits == 1
+
+    # Each run defines its own function
+    assert a.globals['f'] is not b.globals['f']
+
+def test_fresh_runtime_state(programs, monkeypatch):
+    monkeypatch.setattr(compiler, 'JIT_THRESHOLD', 5)
+    prog = "memo func sq(n) { return n * n; } i = 0; while i < 10 { sq(i % 3); i += 1; }"
+    a, b = Interpreter(), Interpreter()
+    a.evaluate(prog)
+    sq = a.globals['sq']
+    assert sq.calls == 3 and len(sq.cache) == 3
+
+    b.evaluate(prog)
+    sq2 = b.globals['sq']
+    assert programs.hits == 1
+    assert sq2.calls == 3 and sq2.cache.hits == 7
+    assert sq.cache.hits == 7  # The first run's cache is left alone
+
+def test_threads(programs):
+    # Interpreters in several threads share the cache
+    def run(n):
+        return Interpreter().evaluate("x = {}; x * 2;".format(n % 2))
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(run, range(40)))
+    assert results == [[n % 2, n % 2 * 2] for n in range(40)]
+    # Two threads may both miss the same program, and parse it at the same time
+    assert programs.hits + programs.misses == 40 and len(programs) == 2
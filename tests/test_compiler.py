@@ -0,0 +1,165 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import pytest
+from tests_common import ev
+from procyon import compiler
+from procyon.common import *  # Mostly exceptions
+
+@pytest.fixture
+def jit(monkeypatch):
+    """ Compile every function on its first call. """
+    monkeypatch.setattr(compiler, 'JIT_THRESHOLD', 1)
+
+def interpreted_and_compiled(prog, monkeypatch):
+    """ Run a program with and without the compiler; check that the results match. """
+    monkeypatch.setattr(compiler, 'JIT_THRESHOLD', 0)
+    expected = ev(prog)
+    monkeypatch.setattr(compiler, 'JIT_THRESHOLD', 1)
+    assert ev(prog) == expected
+    return expected
+
+PROGRAMS = [
+    # Recursion, comparisons and logical operators
+    """
+    func fib(n) { if n < 2 { return n; } return fib(n-1) + fib(n-2); }
+    func between(a, b, c) { return a < b <= c && !(a == c) || 0; }
+    fib(15); between(1, 2, 2); between(2, 2, 3); between(1.5, 2, 3);
+    """,
+    # Loops with break and continue, globals, and mixed types
+    """
+    func f(n) {
+        total = 0; i = 0;
+        while 1 {
+            i += 1;
+            continue if i % 3 == 0;
+            break if i > n;
+            total = total + i * 1.5 - i // 2 + 2^i % 7;
+            $count = i;
+        }
+        return total;
+    }
+    f(20); $count; f(0);
+    """,
+    # Counted loops, squares, strings, and functions reading their caller's variables
+    """
+    func inner() { return x * x; }
+    func outer(n) {
+        s = ""; i = 0;
+        while i < n { x = i; s = s + "ab"; i += 1; }
+        return inner() + len_of(s);
+    }
+    func len_of(s) { return 2 * n; }
+    outer(10); outer(3);
+    """,
+    # Nested functions, and functions as values
+    """
+    func apply(f, x) { return f(x); }
+    func twice(x) { func add(y) { return x + y; } return add(x); }
+    apply(twice, 4); apply(twice, "ab"); apply(twice, -2.5);
+    """,
+]
+
+@pytest.mark.parametrize('prog', PROGRAMS)
+def test_same_results(prog, monkeypatch):
+    interpreted_and_compiled(prog, monkeypatch)
+
+@pytest.mark.parametrize('prog, error', [
+    ('func f(x) { return x + "a"; } f(1);', ProcyonTypeError),
+    ('func f(x) { return y; } f(1);', ProcyonNameError),
+    ('func f(x) { return x < "a"; } f(1);', ProcyonTypeError),
+    ('func f(x) { return g(x); } f(1);', ProcyonNameError),
+    ('func f(x) { abs = x; } f(1);', ProcyonTypeError),
+    ('func f(x) { return abs + x; } f(1);', ProcyonTypeError),
+    ('func f(x) { x = 1; } func g() { return f(1, 2); } g();', ProcyonTypeError),
+    ('func f() { break; } f();', ProcyonControlFlowException),
+])
+def test_same_errors(prog, error, jit):
+    with pytest.raises(error) as compiled_error:
+        ev(prog)
+    compiler.JIT_THRESHOLD = 0
+    with pytest.raises(error) as interpreted_error:
+        ev(prog)
+    assert compiled_error.value.args == interpreted_error.value.args
+
+def test_threshold(monkeypatch):
+    monkeypatch.setattr(compiler, 'JIT_THRESHOLD', 5)
+    ev("func f(x) { return x; } func g() { return 1; } i = 0; while i < 5 { f(i); i += 1; } g();")
+    # The functions live in the global scope, which ev() doesn't clear afterwards
+    from procyon import interpreter
+    f = interpreter._default.globals['f']
+    g = interpreter._default.globals['g']
+    assert f.calls == 5 and f.compiled is not None
+    assert g.calls == 1 and g.compiled is None
+
+def test_deoptimization(jit, monkeypatch, capsys):
+    monkeypatch.setattr(compiler, 'DEBUG_JIT', True)
+    prog = """
+    func a(x) { return x + 1; }
+    func b(x) { return x * 2; }
+    func run(n) { return g(n); }
+    g = a; i = 0; while i < 10 { run(i); i += 1; }
+    g = b; run(5);
+    g = 3;
+    """
+    assert ev(prog)[-2] == 10
+
+    log = capsys.readouterr().err.splitlines()
+    assert "jit: compiled run() at 4:5 after 1 calls" in log
+    assert "jit: deoptimized call to g() at 4:26, which no longer refers to a() at 2:5" in log
+
+    with pytest.raises(ProcyonTypeError):
+        ev(prog + "run(1);")
+
+#
+# On-stack replacement
+#
+
+@pytest.fixture
+def osr(monkeypatch):
+    """ Compile loops after three iterations, but never functions. """
+    monkeypatch.setattr(compiler, 'OSR_THRESHOLD', 3)
+    monkeypatch.setattr(compiler, 'JIT_THRESHOLD', 0)
+
+OSR_PROGRAMS = [
+    # The condition has a side effect, so it must not be evaluated twice when switching
+    """
+    func next() { $calls += 1; return $calls; }
+    $calls = 0; total = 0;
+    while next() < 10 { total += $calls; continue if $calls == 5; total += 100; }
+    $calls; total;
+    """,
+    # Counted loops, with a break, a counter change after the switch, and nested loops
+    """
+    total = 0; i = 0;
+    while i < 20 { total += i; break if i == 15; i += 1; } i;
+    i = 0; while i < 20 { total += i; i = i + 5 if i == 10; i += 1; } i;
+    i = 0; while i < 5 { j = 0; while j < i { total += j; j += 1; } i += 1; }
+    total;
+    """,
+    # A loop that turns hot in a function that is only called once
+    """
+    func count_divisors(n) {
+        d = 1; count = 0;
+        while d * d <= n { count += 2 if n % d == 0; d += 1; }
+        return count;
+    }
+    count_divisors(360);
+    """,
+]
+
+@pytest.mark.parametrize('prog', OSR_PROGRAMS)
+def test_osr_same_results(prog, osr, monkeypatch):
+    expected = ev(prog)
+    monkeypatch.setattr(compiler, 'OSR_THRESHOLD', 0)
+    assert ev(prog) == expected
+
+def test_osr(osr, monkeypatch, capsys):
+    from procyon.interpreter import Interpreter, parse, _evaluate_all
+    monkeypatch.setattr(compiler, 'DEBUG_JIT', True)
+    trees = parse("i = 0; while i < 5 { i = i + 1; } i = 0; while i < 2 { i = i + 1; }")
+    _evaluate_all(trees, Interpreter().scope)
+    assert trees[1].back_edges == 3 and trees[1].compiled is not None
+    assert trees[3].back_edges == 2 and trees[3].compiled is None
+    assert capsys.readouterr().err == "jit: compiled loop at 1:8 after 3 iterations\n"
@@ -0,0 +1,139 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import asyncio
+import io
+import pytest
+from tests_common import ev
+from procyon import Interpreter, Scheduler, evaluate_async
+from procyon.cooperative import steps
+from procyon.common import *  # Mostly exceptions
+
+def run_steps(prog, quantum=3):
+    """ Run a program step-wise; returns (results, number of yields). """
+    program = steps(prog, quantum=quantum)
+    yields = 0
+    try:
+        while True:
+            next(program)
+            yields += 1
+    except StopIteration as e:
+        return e.value, yields
+
+PROGRAMS = [
+    """
+    func fib(n) { if n < 2 { return n; } return fib(n-1) + fib(n-2); }
+    memo func mfib(n) { if n < 2 { return n; } return mfib(n-1) + mfib(n-2); }
+    fib(12); mfib(50); fib(3) * 2 + -fib(4) - !fib(0);
+    """,
+    """
+    total = 0; i = 0;
+    while 1 {
+        i += 1;
+        continue if i % 3 == 0;
+        break if i > 50;
+        if i < 10 || i > 40 && i < 45 { total += i * 1.5; } else { total -= 1; }
+        $count = i;
+    }
+    total; $count; 1 < 2 < 3; 1 < 3 < 2;
+    """,
+    """
+    func outer(n) { x = n * 2; return inner() + sqrt(16); }
+    func inner() { return x; }
+    func apply(f, v) { return f(v); }
+    apply(outer, 5); print("hello");
+    """,
+]
+
+@pytest.mark.parametrize('prog', PROGRAMS)
+def test_same_results(prog):
+    results, yields = run_steps(prog)
+    assert results == ev(prog)
+    assert yields > 0
+
+@pytest.mark.parametrize('prog, error', [
+    ('func f(x) { return x + "a"; } f(1);', ProcyonTypeError),
+    ('func f(x) { return y; } f(1);', ProcyonNameError),
+    ('func f(x) { return 1; } f(1, 2);', ProcyonTypeError),
+    ('func f() { break; } f();', ProcyonControlFlowException),
+    ('sqrt = 2;', ProcyonTypeError),
+    ('memo func f() { return $x; }', ProcyonTypeError),
+])
+def test_same_errors(prog, error):
+    with pytest.raises(error) as stepwise:
+        run_steps(prog)
+    with pytest.raises(error) as regular:
+        ev(prog)
+    assert stepwise.value.args == regular.value.args
+
+def test_quantum():
+    # Every loop iteration counts, as does every statement
+    results, yields = run_steps("i = 0; while i < 1000 { i += 1; }", quantum=100)
+    assert results == [0, None] and 10 <= yields <= 21
+
+def test_scheduler_interleaves():
+    output = io.StringIO()
+    scheduler = Scheduler(quantum=5)
+    prog = 'i = 0; while i < 20 {{ print("{}"); i += 1; }} i;'
+    a = scheduler.add(prog.format("a"), Interpreter(output=output))
+    b = scheduler.add(prog.format("b"), Interpreter(output=output))
+    c = scheduler.add("undefined;")
+    d = scheduler.add('x = -"a";')
+    scheduler.run()
+
+    assert a.done and b.done and a.result[-1] == b.result[-1] == 20
+    assert isinstance(c.error, ProcyonNameError)
+    assert isinstance(d.error, TypeError) and d.done
+    lines = output.getvalue().split()
+    assert sorted(lines) == ["a"] * 20 + ["b"] * 20
+    # Neither program ran to the end before the other one started
+    assert lines.index("b") < 20 and lines[::-1].index("a") < 20
+
+def test_scheduler_input():
+    prompts = []
+
+    def answer(prompt):
+        prompts.append(prompt)
+        return "21"
+
+    scheduler = Scheduler(input=answer)
+    task = scheduler.add('x = input_int("a? "); y = input_str("b? "); x * 2; y;')
+    scheduler.run()
+    assert task.result == [21, "21", 42, "21"] and prompts == ["a? ", "b? "]
+
+def test_evaluate_async():
+    async def answer(prompt):
+        await asyncio.sleep(0)
+        return "4.5"
+
+    async def main():
+        programs = [evaluate_async("func f(n) {{ return n + {}; }} i = 0; "
+                                   "while i < 500 {{ i = f(i); }} i;".format(k), quantum=20)
+                    for k in range(1, 50)]
+        programs.append(evaluate_async('input_float("x");', input=answer))
+        return await asyncio.gather(*programs)
+
+    results = asyncio.run(main())
+    assert [r[-1] for r in results[:-1]] == [(500 + k - 1) // k * k for k in range(1, 50)]
+    assert results[-1] == [4.5]
+
+def test_evaluate_async_without_input():
+    with pytest.raises(ProcyonTypeError) as e:
+        asyncio.run(evaluate_async('x = 1;\nx = input_int("x");'))
+    assert e.value.args[0] == (2, 5)
+
+@pytest.mark.parametrize('call', ['read_int()', 'read_float()', 'read_str()', 'read_line()',
+                                  'eof()'])
+def test_stream_input_rejected(call):
+    # They would read from the interpreter's input, and block the other programs
+    interp = Interpreter(input="1\n")
+    scheduler = Scheduler(input=lambda prompt: "1")
+    task = scheduler.add('x = 1 + {};'.format(call), interp)
+    scheduler.run()
+    assert isinstance(task.error, ProcyonTypeError)
+    assert task.error.args[1] == call[:-2] + "() can't be used in step-wise programs; " \
+                                             "use input_* instead"
+
+    with pytest.raises(ProcyonTypeError):
+        asyncio.run(evaluate_async('x = 1;\nx = {};'.format(call), input=lambda p: "1"))
@@ -382,3 +382,18 @@ def test_builtin_functions():
 def test_misc():
     assert ev("log10(10^3)^3 + 3 * 3^3") == [108]
     assert ev("(( (1-3)^2 - 5) + log2(128) - 1)") == [5]
+
+def test_string_escapes(capsys):
+    # Escape sequences are decoded by the lexer
+    assert ev(r'"a\tb\\c\"d\u00e9\x41\101\N{EM DASH}";') == ['a\tb\\c"dé' + "AA\u2014"]
+    assert ev(r'"\t" == "	";') == [1]
+    ev(r'print("line\nbreak", "back\\slash\\n");')
+    assert capsys.readouterr()[0] == "line\nbreak back\\slash\\n\n"
+
+    # Strings built at run time are printed as they are
+    ev(r'print("\\" + "n");')
+    assert capsys.readouterr()[0] == "\\n\n"
+
+    with pytest.raises(ProcyonSyntaxError) as e:
+        ev('x = 1;\ny = "bad \\xZZ";')
+    assert e.value.args[0] == (2, 5)
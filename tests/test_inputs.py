@@ -0,0 +1,121 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import io
+import sys
+import pytest
+from procyon import Interpreter, inputs
+from procyon.inputs import (Source, FileSource, StdinSource, StringSource, MappedSource,
+                            make_source)
+from procyon.output import MemorySink
+from procyon.common import *  # Mostly exceptions
+
+def run(program, input):
+    output = MemorySink()
+    results = Interpreter(output=output, input=input).evaluate(program)
+    return results, output.getvalue()
+
+def test_read_tokens():
+    prog = 'a = read_int(); b = read_float(); c = read_str(); d = read_int(); a; b; c; d;'
+    assert run(prog, "12 2.5\n\n  word\t-7\n")[0][-4:] == [12, 2.5, "word", -7]
+    assert run(prog, b"1\r\n2\r\nx\r\n3")[0][-4:] == [1, 2.0, "x", 3]
+
+def test_sum_until_eof():
+    prog = 'n = 0; t = 0; while !eof() { t += read_int(); n += 1; } print(n, t);'
+    data = "".join("{}{}".format(i, "\n" if i % 3 else " ") for i in range(1, 1001))
+    assert run(prog, data)[1] == "1000 500500\n"
+    assert run(prog, "")[1] == "0 0\n"
+    assert run(prog, " \n\n ")[1] == "0 0\n"
+
+def test_lines():
+    prog = 'x = read_int(); a = read_line(); b = read_line(); c = read_line(); a; b; c;'
+    # read_line() reads the rest of the line the last token was on
+    assert run(prog, "5 rest of it\r\nnext\n\n")[0][-3:] == [" rest of it", "next", ""]
+    assert run('input_str("> "); input_int("");', "fé\n42")[0] == ["fé", 42]
+
+def test_eof_keeps_whitespace():
+    # eof() skips blank lines to look for more input, but leaves them to read_line()
+    assert run('eof(); read_line(); read_line(); read_int();', "\n\n7\n")[0] == [0, "", "", 7]
+    assert run('read_str(); eof(); read_line();', "abc  \n")[0] == ["abc", 1, "  "]
+
+def test_errors():
+    with pytest.raises(ProcyonEOFError) as e:
+        run('read_int(); read_int();', "1\n")
+    assert e.value.args[1] == "read_int() called at the end of the input"
+    assert isinstance(e.value, EOFError)
+
+    with pytest.raises(ProcyonEOFError):
+        run('read_line();', "")
+    with pytest.raises(ProcyonEOFError):
+        run('input_int("");', "")
+
+    with pytest.raises(ProcyonTypeError):
+        run('read_int();', "1.5")
+    with pytest.raises(ProcyonTypeError):
+        run('read_float();', "x")
+    with pytest.raises(ProcyonTypeError):
+        run('eof(1);', "")
+    with pytest.raises(ProcyonTypeError):
+        run('read_int(0);', "")
+
+def test_memo_impure():
+    for func in ('read_int()', 'read_float()', 'read_str()', 'read_line()', 'eof()'):
+        with pytest.raises(ProcyonTypeError):
+            run('memo func f(n) {{ return {}; }}'.format(func), "")
+
+@pytest.mark.parametrize('block_size', [1, 2, 3, 7, 64])
+def test_block_boundaries(monkeypatch, block_size):
+    # Tokens and lines that span blocks (and are longer than a block) come out whole
+    monkeypatch.setattr(inputs, 'BLOCK_SIZE', block_size)
+    data = b"1 22 333\n4444  55555 666666\nline one\n\n  7777777 last"
+    for source in (FileSource(io.BytesIO(data)), FileSource(io.StringIO(data.decode()))):
+        tokens = [source.token() for i in range(6)]
+        assert tokens == [b"1", b"22", b"333", b"4444", b"55555", b"666666"]
+        assert source.readline() == ""
+        assert source.readline() == "line one"
+        assert not source.eof()
+        assert source.readline() == ""
+        assert source.token() == b"7777777"
+        assert source.readline() == " last"
+        assert source.eof()
+        assert source.token() is None and source.readline() is None
+
+def test_sources(tmp_path, monkeypatch):
+    path = tmp_path / "input.txt"
+    path.write_bytes(b"3 4\nfive\n")
+    with open(str(path)) as f:
+        assert run('read_int() * read_int(); read_line(); read_line();', f)[0] == [
+            12, "", "five"]
+
+    source = MappedSource(str(path))
+    assert run('read_int(); read_int(); read_str(); eof();', source)[0] == [3, 4, "five", 1]
+    source.close()
+    assert source.eof()
+
+    path.write_bytes(b"")
+    empty = MappedSource(str(path))
+    assert empty.eof() and empty.token() is None
+    empty.close()
+
+    # None reads from whatever sys.stdin is at the time
+    interp = Interpreter(output=MemorySink())
+    monkeypatch.setattr(sys, 'stdin', io.StringIO("8\n"))
+    assert interp.evaluate('read_int();') == [8]
+
+    # The input given to evaluate() is only used for that program
+    interp = Interpreter(input="1 2")
+    assert interp.evaluate('read_int();', input="5") == [5]
+    assert interp.evaluate('read_int(); read_int();') == [1, 2]
+
+def test_make_source():
+    assert isinstance(make_source(None), StdinSource)
+    assert isinstance(make_source("x"), StringSource)
+    assert isinstance(make_source(b"x"), StringSource)
+    assert isinstance(make_source(io.BytesIO()), FileSource)
+    source = StringSource("")
+    assert make_source(source) is source
+    with pytest.raises(TypeError):
+        make_source(1)
+    with pytest.raises(NotImplementedError):
+        Source().token()
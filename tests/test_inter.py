@@ -696,3 +696,15 @@ def test_continue_in_function():
     with pytest.raises(ProcyonControlFlowException) as e:
         ev(prog)
         assert e.args[0]["type"] == "continue"
+
+def test_recursion_depth():
+    # Procyon calls take several Python stack frames each; this is the depth programs
+    # could reach before the tree walker used a dispatch table, and must not get lower.
+    # It runs in a thread of its own, so that pytest's frames don't count.
+    import threading
+    prog = "func f(n) { if n == 0 { return 0; } return f(n - 1) + 1; } f(140);"
+    results = []
+    thread = threading.Thread(target=lambda: results.append(ev(prog)[-1]))
+    thread.start()
+    thread.join()
+    assert results == [140]
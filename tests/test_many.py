@@ -0,0 +1,44 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import pytest
+from procyon import Interpreter, evaluate_many
+from procyon.common import *  # Mostly exceptions
+
+def test_evaluate_many():
+    programs = ["x = 2; x * 21;", "x;", "1 +", "func f(n) { return n + 1; } f(1);", ""]
+    results = list(Interpreter().evaluate_many(programs))
+    assert len(results) == 5
+    assert results[0] == ([2, 42], None)
+    # x is not left over from the first program
+    assert results[1][0] is None and isinstance(results[1][1], ProcyonNameError)
+    assert results[2][0] is None and isinstance(results[2][1], ProcyonSyntaxError)
+    assert results[3][0][-1] == 2 and results[3][1] is None
+    assert results[4] == (None, None)
+
+def test_shared_state():
+    programs = ["x = 2;", "$y = x + 1;", "func f() { return $y * 2; }", "f();"]
+    results = list(Interpreter().evaluate_many(programs, shared_state=True))
+    assert [r for r, e in results] == [[2], [3], [None], [6]]
+
+def test_streaming():
+    # Programs are run as their results are asked for
+    def programs():
+        yield "1;"
+        raise RuntimeError("out of programs")
+
+    results = Interpreter().evaluate_many(programs())
+    assert next(results) == ([1], None)
+    with pytest.raises(RuntimeError):
+        next(results)
+
+def test_stats():
+    stats = {}
+    results = list(evaluate_many(["{};".format(n) for n in range(50)] + ["1/0;"], stats=stats))
+    assert [r for r, e in results[:50]] == [[n] for n in range(50)]
+    assert results[50][0] is None and isinstance(results[50][1], ZeroDivisionError)
+    assert stats['programs'] == 51
+    assert stats['failed'] == 1
+    assert stats['seconds'] > 0
+    assert stats['programs_per_second'] == pytest.approx(51 / stats['seconds'])
@@ -0,0 +1,172 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import math
+import pytest
+from tests_common import ev, ev_reuse_state
+from procyon import memo, interpreter
+from procyon.common import *  # Mostly exceptions
+
+FIB = "memo func fib(n) { if n < 2 { return n; } return fib(n - 1) + fib(n - 2); }"
+
+def cache_of(name):
+    return interpreter._default.globals[name].cache
+
+def test_fib():
+    assert ev(FIB + "fib(30); fib(60);") == [None, 832040, 1548008755920]
+    cache = cache_of('fib')
+    assert (len(cache), cache.misses, cache.hits) == (61, 61, 29 + 30)
+
+    # The cache is kept for later calls
+    assert ev_reuse_state("fib(60);") == [1548008755920]
+    assert (cache.misses, cache.hits) == (61, 60)
+
+def test_same_results():
+    prog = """
+    {}func choose(n, k) {{
+        if k == 0 || k == n {{ return 1; }}
+        r = choose(n - 1, k - 1) + choose(n - 1, k);
+        return r;
+    }}
+    choose(20, 10); choose(5, 2.0); choose(5, 2); choose(6, 0);
+    """
+    assert ev(prog.format("memo ")) == ev(prog.format("")) == [None, 184756, 10.0, 10, 1]
+
+def test_types_are_kept_apart():
+    assert ev("memo func f(x) { return x / 2 * 2; } f(1); f(1.0); f(2);") == [None, 1.0, 1.0, 2.0]
+    assert ev("memo func f(x) { return x; } f(1); f(1.0);") == [None, 1, 1.0]
+    # 0.0 == -0.0, but atan2() tells them apart
+    assert ev("memo func f(x) { return atan2(x, -1); } f(0.0); f(-0.0); f(0.0);") == [
+        None, math.pi, -math.pi, math.pi]
+
+def test_lru():
+    ev("memo func f(x) { return x * 2; } f(1);")
+    cache = cache_of('f')
+    cache.size = 3
+    ev_reuse_state("f(1); f(2); f(3); f(1); f(4); f(1); f(2);")
+    # 2 was evicted by 4, as 1 was used more recently
+    assert list(cache.results) == [(4, int), (1, int), (2, int)]
+
+def test_errors_are_not_cached():
+    prog = 'memo func f(x) { return x + 1; } f("a");'
+    with pytest.raises(ProcyonTypeError):
+        ev(prog)
+    assert len(cache_of('f')) == 0
+
+def test_redefined_name():
+    prog = FIB + """
+    g = fib; func fib(n) { return 100; }
+    g(10); g(10);
+    """
+    # The recursive calls go to the new fib
+    assert ev(prog)[-2:] == [200, 200]
+    assert len(interpreter._default.globals['g'].cache) == 0
+
+@pytest.mark.parametrize('body, message', [
+    ("return x + n;", 'reads "x", which may be a variable of its caller'),
+    ("return $x;", 'reads global variable "$x"'),
+    ("$x = n; return n;", 'assigns to global variable "$x"'),
+    ("print(n);", "calls print()"),
+    ("return g(n);", "calls g(), which may not be pure"),
+    ("return n * pi;", 'reads "pi", which may be a variable of its caller'),
+    ("if n > 1 { y = 1; } return y;", 'reads "y", which may be a variable of its caller'),
+    ("while n > 1 { y = 1; n -= 1; } return y;",
+     'reads "y", which may be a variable of its caller'),
+    ("return n > 1 && (y = 2) || y;", 'reads "y", which may be a variable of its caller'),
+    ("func g() { return 1; } return 1;", "defines function g()"),
+    ("f = 2;", "assigns to its own name"),
+])
+def test_impure(body, message):
+    with pytest.raises(ProcyonTypeError) as e:
+        ev("memo func f(n) { " + body + " }")
+    assert e.value.args[1] == "memo function f() is not pure: it " + message
+
+@pytest.mark.parametrize('body', [
+    "y = n; return y + f(n - 1) if n > 0;",
+    "if n > 1 { y = 1; } else { y = 2; } return y;",
+    "y = 0; while y < n { y += 1; z = y; } return sqrt(y) + abs(n);",
+    "return (y = n) && y;",
+    "return f;",
+])
+def test_pure(body):
+    ev("memo func f(n) { " + body + " }")
+
+def test_memo_as_name():
+    # memo is only a keyword right before func
+    assert ev("memo = 3; memo_count = memo + 1; memo_count;") == [3, 4, 4]
+    assert ev("func memo(x) { return x * 2; } memo(5);") == [None, 10]
+    assert ev("memo # comment\n func f(x) { return x; } f(1);") == [None, 1]
+    assert interpreter._default.globals['f'].cache is not None
+
+def test_parameter_named_like_function():
+    with pytest.raises(ProcyonTypeError):
+        ev("memo func f(f) { return f; }")
+
+#
+# Persistent store
+#
+
+@pytest.fixture
+def memo_db(tmp_path, monkeypatch):
+    """ Use a fresh memo database; returns a function that reopens it (as a new run would). """
+    filename = str(tmp_path / "memo.db")
+
+    def reopen(max_results=None):
+        if memo.store is not None:
+            memo.store.close()
+        monkeypatch.setattr(memo, 'store', memo.MemoStore(filename, max_results))
+        return memo.store
+
+    yield reopen
+    memo.store.close()
+
+def test_store(memo_db):
+    store = memo_db()
+    assert ev(FIB + "fib(30);") == [None, 832040]
+    assert len(store) == 31 and cache_of('fib').stored_hits == 0
+
+    # A new run finds the results right away, without any recursive calls
+    memo_db()
+    assert ev(FIB + "fib(30); fib(29); fib(30);") == [None, 832040, 514229, 832040]
+    cache = cache_of('fib')
+    assert (cache.stored_hits, cache.hits, cache.misses) == (2, 1, 0)
+
+def test_store_types(memo_db):
+    prog = 'memo func f(x) { return x + x; } f(1); f(1.0); f("ab"); f(10^30);'
+    memo_db()
+    expected = ev(prog)
+    memo_db()
+    assert ev(prog) == expected == [None, 2, 2.0, "abab", 2 * 10**30]
+    assert cache_of('f').stored_hits == 4
+
+def test_store_invalidation(memo_db):
+    memo_db()
+    ev("memo func f(x) { return x + 1; } f(1);")
+    store = memo_db()
+    assert ev("memo func f(x) { return x + 2; } f(1);") == [None, 3]
+    assert cache_of('f').stored_hits == 0
+    # Positions don't matter, though
+    assert ev("\n\nmemo func f(x) {\n return x + 2; }  f(1);") == [None, 3]
+    assert len(store) == 2
+
+def test_store_unoptimized_digest(memo_db):
+    # CSE numbers its temporaries through the whole program, so the optimized f differs
+    # between these; the results are found all the same
+    f = "memo func f(x) { return (x*x + 1) * (x*x + 1); }"
+    memo_db()
+    ev("func g(y) { return (y+1) * (y+1); } " + f + " f(3);")
+    memo_db()
+    assert ev(f + " f(3);") == [None, 100]
+    assert cache_of('f').stored_hits == 1
+
+def test_store_eviction(memo_db):
+    memo_db(max_results=3)
+    ev("memo func f(x) { return x; } f(1); f(2); f(3);")
+    store = memo_db(max_results=3)
+    ev("memo func f(x) { return x; } f(1); f(4);")
+    # 2 was the least recently used
+    assert len(store) == 3
+    memo_db(max_results=3)
+    ev("memo func f(x) { return x; } f(1); f(3); f(4); f(2);")
+    assert cache_of('f').stored_hits == 3
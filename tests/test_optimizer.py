@@ -0,0 +1,516 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import pytest
+from tests_common import ev
+from procyon.interpreter import parse, evaluate
+from procyon.optimizer import optimize
+from procyon.analysis import pure_functions
+from procyon.ast import TempStore, TempLoad, walk
+from procyon.common import *  # Mostly exceptions
+
+BUILTINS = ('sqrt', 'abs', 'print', 'abort', 'input_str', 'input_int', 'input_float')
+
+def opt(prog, level=1):
+    """ Parse and optimize a program; returns (statements, report). """
+    report = {}
+    trees = optimize(parse(prog), BUILTINS, level, report=report)
+    return trees, report
+
+def same_as_unoptimized(prog, level=1):
+    """ Check that a program gives the same results with and without the optimizer. """
+    expected = evaluate(prog, clear_state=True, optimize=0)
+    assert evaluate(prog, clear_state=True, optimize=level) == expected
+    return expected
+
+#
+# Purity analysis
+#
+
+def test_pure_functions():
+    prog = """
+    func sqr(x) { return x*x; }
+    func loud(x) { print(x); return x; }
+    func calls_loud(x) { return loud(x) + 1; }
+    func sets_global(x) { $g = x; return x; }
+    func fac(n) { return 1 if n < 2; return n * fac(n - 1); }
+    func uses_sqrt(x) { y = sqrt(x); return y; }
+    """
+    assert pure_functions(parse(prog), BUILTINS) == {'sqr', 'fac', 'uses_sqrt'}
+
+#
+# Common subexpression elimination
+#
+
+def test_cse_simple():
+    trees, report = opt("a = 3; b = 4; c = (a*b + 1) * (a*b + 1);")
+    assert report['cse'] == 1
+    nodes = list(walk(trees))
+    assert len([n for n in nodes if isinstance(n, TempStore)]) == 1
+    assert len([n for n in nodes if isinstance(n, TempLoad)]) == 1
+    assert ev("a = 3; b = 4; c = (a*b + 1) * (a*b + 1); c")[-1] == 169
+
+def test_cse_call_args():
+    trees, report = opt("x = 2; print(x^10, x^10 + 1);")
+    assert report['cse'] == 1
+
+def test_cse_pure_function():
+    prog = """
+    func sqr(x) { return x*x; }
+    a = 5;
+    sqr(a + 1) + sqr(a + 1);
+    """
+    trees, report = opt(prog)
+    assert report['cse'] == 1
+    assert same_as_unoptimized(prog)[-1] == 72
+
+def test_cse_impure_function(capsys):
+    prog = """
+    func loud(x) { print(x); return x; }
+    loud(1) + loud(1);
+    """
+    trees, report = opt(prog)
+    assert report['cse'] == 0
+    assert ev(prog)[-1] == 2
+    assert capsys.readouterr()[0] == "1\n1\n"
+
+def test_cse_signed_zero():
+    # 0.0 == -0.0, but they are different constants
+    prog = "x = 1.0; atan2(0.0 * x, -1.0) + atan2(-0.0 * x, -1.0);"
+    assert opt(prog)[1]['cse'] == 0
+    assert same_as_unoptimized(prog)[-1] == 0.0
+
+def test_cse_rebound_function(capsys):
+    # f may refer to another function than its definition; neither call can be removed
+    for prog in ("func f() { return 1; } func g() { print(1); return 1; } f = g; f() + f();",
+                 "func f() { return 1; } func g() { print(1); return 1; }"
+                 "func h(f) { return f() + f(); } h(g);"):
+        assert pure_functions(parse(prog), BUILTINS) == set()
+        assert opt(prog)[1]['cse'] == 0
+        assert ev(prog)[-1] == 2
+        assert capsys.readouterr()[0] == "1\n1\n"
+
+def test_cse_short_circuit():
+    # a*b is only evaluated conditionally the first time, so it must not be stored there
+    prog = "a = 0; b = 2; c = a && a*b || a*b + a*b;"
+    trees, report = opt(prog)
+    assert report['cse'] == 0
+    assert same_as_unoptimized(prog)[-1] == 0
+
+def test_cse_errors():
+    # The first occurrence must still be the one that raises
+    with pytest.raises(ProcyonNameError) as e:
+        ev("x = 1;\ny = (q + 1) * (q + 1);")
+    assert e.value.args[0] == (2, 6)
+
+def test_cse_loop():
+    prog = """
+    i = 0; total = 0;
+    while i*i + 1 < 50 + i*i - i {
+        total += i*i + i*i;
+        i += 1;
+    }
+    total;
+    """
+    assert same_as_unoptimized(prog)[-1] == 2 * sum(i*i for i in range(49))
+
+def test_chained_comparison_evaluates_once(capsys):
+    prog = """
+    func mid() { print("mid"); return 2; }
+    1 < mid() < 3;
+    3 < mid() < 1;
+    """
+    assert ev(prog)[-2:] == [1, 0]
+    assert capsys.readouterr()[0] == "mid\nmid\n"
+
+#
+# Constant folding and dead code elimination
+#
+
+def test_fold():
+    trees, report = opt('x = 2^10 + 3*4; y = "a" + "b"; z = 1/0; w = 2 < 3 < 4;')
+    assert [t.right.value for t in trees if hasattr(t.right, 'value')] == [1036, "ab", 1]
+    with pytest.raises(ZeroDivisionError):
+        ev('x = 1; z = 1/0;')
+    with pytest.raises(ProcyonTypeError):
+        ev('z = "a" - "b";')
+
+def test_dce_after_return():
+    prog = """
+    func f(x) {
+        return x + 1;
+        print("unreachable");
+        x = 10;
+    }
+    f(1);
+    """
+    trees, report = opt(prog)
+    assert len(trees[0].body) == 1
+    assert report['dce'] > 0
+    assert report['nodes_after'] < report['nodes_before']
+    assert same_as_unoptimized(prog)[-1] == 2
+
+def test_dce_after_break():
+    prog = """
+    i = 0;
+    while 1 {
+        i += 1;
+        if i > 5 { break; print("no"); } else { continue; }
+        i = 100;
+    }
+    i;
+    """
+    trees, report = opt(prog)
+    assert len(trees[1].body) == 2
+    assert same_as_unoptimized(prog)[-1] == 6
+
+def test_dce_constant_if(capsys):
+    prog = """
+    func f() {
+        if 2 > 3 { print("no"); } else { print("yes"); }
+        while 0 { print("never"); }
+        return 1;
+    }
+    if 1 { f(); } else { print("never"); }
+    """
+    trees, report = opt(prog)
+    assert len(trees) == 2  # one result per top-level statement
+    assert not isinstance(trees[0].body[0], type(trees[1]))
+    assert ev(prog) == [None, None]
+    assert capsys.readouterr()[0] == "yes\n"
+
+def test_dce_dead_stores(capsys):
+    prog = """
+    func f(x) {
+        unused = x * 2;
+        loud = print("side effect");
+        y = x + 1;
+        y = y * 2;
+        return y;
+    }
+    f(3);
+    """
+    trees, report = opt(prog)
+    body = trees[0].body
+    # The stores are gone, but the expressions are kept, since they could raise errors
+    assert [repr(s) for s in body[:2]] == ["(binop: (ident: x) * 2)",
+                                            "(call: (ident: print), ['side effect'])"]
+    assert ev(prog)[-1] == 8
+    assert capsys.readouterr()[0] == "side effect\n"
+
+def test_dce_dynamic_scope():
+    # g reads f's local variable x through the caller's scope, so x = 5 must stay
+    prog = """
+    func g() { return x; }
+    func f() { x = 5; return g(); }
+    f();
+    func h(n) { return x if n == 0; x = n; return h(n - 1); }
+    h(2);
+    """
+    assert same_as_unoptimized(prog)[-3:] == [5, None, 1]
+
+#
+# Peephole optimizations
+#
+
+def test_peephole_nodes():
+    trees, report = opt("x = 3; x^2; (x ^ 100) % 7; x += 1; x -= 1; x*x > 10;")
+    assert [type(t).__name__ for t in trees] == [
+        'BinaryOp', 'Square', 'ModPow', 'Increment', 'Increment', 'ProductCompare']
+    assert report['peephole'] == 5
+
+def test_peephole_square():
+    assert same_as_unoptimized("x = 7; y = 1.5; x^2; y^2; (x+1)^2; -x^2;")[-4:] == [
+        49, 2.25, 64, -49]
+    with pytest.raises(OverflowError):
+        ev("x = 1e200; x^2;")
+    with pytest.raises(ProcyonTypeError):
+        ev('x = "abc"; x^2;')
+
+def test_peephole_modpow():
+    prog = """
+    a = 3; b = 200; m = 7;
+    (a ^ b) % m;
+    (a ^ b) % -m;
+    (-a ^ 3) % m;
+    (a ^ -1) % m;
+    (2.5 ^ 2) % 2;
+    (10 ^ 50) % 7.5;
+    """
+    assert same_as_unoptimized(prog)[-6:] == [
+        3**200 % 7, 3**200 % -7, (-27) % 7, (1/3) % 7, 0.25, 10**50 % 7.5]
+    with pytest.raises(ZeroDivisionError):
+        ev("a = 2; (a ^ 3) % 0;")
+
+def test_peephole_increment():
+    assert same_as_unoptimized("x = 1; x += 1; x -= 1; y = 1.5; y += 1; x; y;")[-2:] == [1, 2.5]
+    with pytest.raises(ProcyonTypeError):
+        ev('x = "abc"; x += 1;')
+    with pytest.raises(ProcyonNameError):
+        ev('undefined += 1;')
+    for prog in ("sin += 1;", "sin = sin - 1;"):
+        with pytest.raises(ProcyonTypeError) as unoptimized:
+            evaluate(prog, clear_state=True, optimize=0)
+        with pytest.raises(ProcyonTypeError) as optimized:
+            evaluate(prog, clear_state=True)
+        assert optimized.value.args == unoptimized.value.args
+
+def test_peephole_product_compare():
+    prog = """
+    d = 5; n = 24;
+    d*d > n; d*d > n + 1; d*2 < n; 1.5 * d == 7.5;
+    """
+    assert same_as_unoptimized(prog)[-4:] == [1, 0, 1, 1]
+    with pytest.raises(ProcyonTypeError):
+        ev('d = 5; d*d > "a";')
+
+#
+# Superinstructions
+#
+
+def test_superinstruction_nodes():
+    prog = """
+    func f(n) {
+        i = 0;
+        count = 0;
+        while i < n {
+            i = i + 2;
+            continue if i % 3 == 0;
+            count += 1;
+        }
+        return count;
+    }
+    f(10);
+    """
+    trees, report = opt(prog)
+    body = trees[0].body
+    assert [type(s).__name__ for s in body] == [
+        'BinaryOp', 'BinaryOp', 'WhileCompare', 'ReturnVar']
+    assert [type(s).__name__ for s in body[2].body] == ['Increment', 'IfDivisible', 'Increment']
+    assert report['superinstructions'] == 3
+    assert same_as_unoptimized(prog)[-1] == 4
+
+def test_superinstruction_fallbacks():
+    prog = """
+    x = 2.5; s = 0;
+    while x < 5 { x += 1; s += x; }
+    if 7.5 % 2.5 == 0 { s += 100; } else { s -= 100; }
+    if 7 % 2 != 0 { s += 1000; }
+    s;
+    """
+    assert same_as_unoptimized(prog)[-1] == 3.5 + 4.5 + 5.5 + 100 + 1000
+    with pytest.raises(ZeroDivisionError):
+        ev("x = 0; if 5 % x == 0 { 1; }")
+    with pytest.raises(ProcyonTypeError):
+        ev('x = "a"; while x < 5 { x += 1; }')
+    with pytest.raises(ProcyonTypeError):
+        ev('x = "a"; if x % 2 == 0 { 1; }')
+
+def test_shape_counts():
+    from procyon.analysis import shape_counts
+    counts = shape_counts(parse("i = 0; while i < 10 { i += 1; }"), depth=1)
+    assert counts["While(Comparison[<])"] == 1
+    assert counts["BinaryOp[=](Ident, BinaryOp[+])"] == 1
+
+#
+# Counted loops
+#
+
+def test_counted_loop_nodes():
+    prog = """
+    i = 0; n = 10; total = 0;
+    while i < n { total += i; i += 1; }
+    while i > 0 { total += i; i -= 2; }
+    while i < n { i += 1; n += 1; break if n > 100; }  # n changes
+    while i < 50 { continue if i > 70; i += 1; }       # continue would skip the increment
+    """
+    trees, report = opt(prog)
+    assert [type(t).__name__ for t in trees[-4:]] == [
+        'CountedLoop', 'CountedLoop', 'WhileCompare', 'WhileCompare']
+    assert report['counted_loops'] == 2
+
+def test_counted_loop_semantics():
+    prog = """
+    total = 0;
+    i = 0; while i < 10 { total += i; i += 1; } i;
+    i = 3; while i <= 20 { total += i; i += 4; } i;
+    i = 10; while i > 0 { total += i; i -= 3; } i;
+    i = 10; while i >= -10 { total += i; i -= 5; } i;
+    i = 0; while i < 7.5 { total += i; i += 2; } i;
+    i = 0; while i > 0 { total += 1000; i -= 1; } i;
+    i = 0.5; while i < 3 { total += i; i += 1; } i;
+    i = 0; while i < 100 { break if i == 42; i += 1; } i;
+    total;
+    """
+    results = same_as_unoptimized(prog)
+    assert results[3::3] == [10, 23, -2, -15, 8, 0, 3.5, 42]
+    assert results[-1] == 138.5
+
+def test_counted_loop_in_function():
+    prog = """
+    func first_multiple(n, m) {
+        i = n;
+        while i < n + 1000 {
+            return i if i % m == 0;
+            i += 1;
+        }
+        return -1;
+    }
+    first_multiple(100, 7); first_multiple(10, 2000);
+    """
+    assert same_as_unoptimized(prog)[-2:] == [105, -1]
+
+def test_counted_loop_fallback():
+    # Build a counted loop, then sneak in a change to the counter that the
+    # optimizer didn't see; the loop must notice and fall back to a regular while loop.
+    from procyon.ast import CountedLoop
+    trees, report = opt("i = 0; n = 0; while i < 10 { n += 1; i += 1; } i; n;")
+    loop = trees[2]
+    assert isinstance(loop, CountedLoop)
+    loop.body += parse("i = i + 3 if i == 2;")
+
+    from procyon.interpreter import Interpreter, _evaluate_all
+    scope = Interpreter().scope
+    # Without the fallback, n would be 10
+    assert _evaluate_all(trees, scope)[-2:] == [10, 7]
+
+def test_counted_loop_errors():
+    with pytest.raises(ProcyonNameError):
+        ev("i = 0; while i < undefined { i += 1; }")
+    with pytest.raises(ProcyonTypeError):
+        ev('i = 0; while i < "x" { i += 1; }')
+
+#
+# Reductions
+#
+
+def test_reduction_nodes():
+    prog = """
+    sum = 0; i = 0;
+    while i < 1000 { if i % 3 == 0 || i % 5 == 0 { sum += i; } i += 1; }
+    while i > 0 { sum -= i^2 + 1; i -= 1; }
+    while i < 10 { sum += i; print(i); i += 1; }         # not just an accumulation
+    while i < 20 { sum += i / 2; i += 1; }               # / can produce floats
+    while i < 30 { if i % 3 == 0 { sum += i; } else { sum += 1; } i += 1; }
+    """
+    trees, report = opt(prog, level=2)
+    assert [type(t).__name__ for t in trees[2:]] == [
+        'Reduction', 'Reduction', 'CountedLoop', 'CountedLoop', 'CountedLoop']
+    assert report['reductions'] == 2
+    assert trees[2].divisors == ((3, 1), (5, 1), (15, -1))
+    assert trees[3].poly == (1, 0, 1)
+
+    assert 'reductions' not in opt(prog)[1]
+
+def test_reduction_sums():
+    for cond in ("i % 3 == 0", "i % 3 == 0 || i % 5 == 0", "i % 4 != 0 && i % 6 == 0",
+                 "!(i % 2 == 0) || i % -7 == 0", "i % 6 == 0 || i % 10 == 0 || i % 15 == 0"):
+        for term in ("i", "1", "i^2", "(i - 3) * (2*i + 1)", "-i^3 + 7"):
+            for start, op, stop, step in ((0, '<', 100, 1), (-17, '<=', 45.5, 3),
+                                          (50, '>', -20, -1), (40, '>=', 3, -4),
+                                          (5, '<', 5, 1)):
+                update = "i += {}".format(step) if step > 0 else "i -= {}".format(-step)
+                prog = "acc = 5; i = {}; while i {} {} {{ if {} {{ acc -= {}; }} {}; }} acc; i;"
+                prog = prog.format(start, op, stop, cond, term, update)
+                same_as_unoptimized(prog, level=2)
+
+def test_reduction_products():
+    assert same_as_unoptimized("""
+    acc = 1; i = 1; while i <= 20 { acc *= i; i += 1; } acc; i;
+    acc = 1; i = 1; while i <= 20 { acc = (i*i + 1) * acc; i += 3; } acc; i;
+    """, level=2)[3] == 2432902008176640000
+
+def test_reduction_divisor_limit():
+    import time
+    prog = "t = 0; i = 0; while i < 1000 {{ if {} {{ t += i; }} i += 1; }} t;"
+    primes = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61)
+
+    # Every || doubles the terms; the expansion stops once there are too many
+    long_chain = prog.format(" || ".join("i % {} == 0".format(p) for p in primes))
+    start = time.perf_counter()
+    trees, report = opt(long_chain, level=2)
+    assert time.perf_counter() - start < 5
+    assert report['reductions'] == 0
+    assert type(trees[2]).__name__ == 'CountedLoop'
+    same_as_unoptimized(long_chain, level=2)
+
+    # Shorter chains are still reduced
+    short_chain = prog.format(" || ".join("i % {} == 0".format(p) for p in primes[:5]))
+    assert opt(short_chain, level=2)[1]['reductions'] == 1
+    same_as_unoptimized(short_chain, level=2)
+
+def test_reduction_fallback():
+    same_as_unoptimized("acc = 1.5; i = 0; while i < 10 { acc += i; i += 1; } acc; i;", level=2)
+    same_as_unoptimized("acc = 0; i = 0.5; while i < 10 { acc += i; i += 1; } acc; i;", level=2)
+    with pytest.raises(ProcyonNameError):
+        evaluate("i = 0; while i < 10 { acc += i; i += 1; }", clear_state=True, optimize=2)
+    with pytest.raises(ProcyonTypeError):
+        evaluate('acc = "x"; i = 0; while i < 10 { acc += i; i += 1; }', clear_state=True,
+                 optimize=2)
+    # The loop never runs, so the missing accumulator is never read
+    assert evaluate("i = 0; while i < 0 { acc += i; i += 1; } i;", clear_state=True,
+                    optimize=2)[-1] == 0
+
+#
+# Specialization
+#
+
+def test_specialization():
+    prog = """
+    func f(x, m) { return ((x + m) ^ 3) % m; }
+    func g(m) { return f(m, 7) + f(m, 7) + f(m, 8); }
+    f(5, 7); g(5); f(4, 5);
+    """
+    trees, report = opt(prog, level=2)
+    assert report['specializations'] == 5  # f(m, 7), f(m, 8), f(5, 7), g(5), f(4, 5)
+    call = trees[2]
+    assert type(call).__name__ == 'SpecializedCall'
+    assert call.target is trees[0]
+    # With both arguments constant, the whole body folds into a constant
+    assert repr(call.func.body) == "[return 6]"
+    assert same_as_unoptimized(prog, level=2)[-3:] == [6, 17, 4]
+
+    assert 'specializations' not in opt(prog)[1]
+
+def test_specialization_limit():
+    from procyon.optimizer import MAX_SPECIALIZATIONS
+    calls = " ".join("f({});".format(i) for i in range(MAX_SPECIALIZATIONS + 5))
+    trees, report = opt("func f(x) { return x + 1; } " + calls + " f(1);", level=2)
+    assert report['specializations'] == MAX_SPECIALIZATIONS
+    assert type(trees[1]).__name__ == 'SpecializedCall'
+    assert type(trees[-2]).__name__ == 'FunctionCall'
+    assert trees[-1].func is trees[2].func  # f(1) reuses the copy
+
+def test_specialization_skipped():
+    trees, report = opt("""
+    func f(n) { n -= 1; return n; }   # assigns to its parameter
+    func g(n) { return n; }
+    func g(n) { return -n; }          # several definitions
+    f(3); g(3); h(3);
+    """, level=2)
+    assert report['specializations'] == 0
+
+def test_specialization_global_param():
+    # $x is set by the call, but g() changes it before it is read
+    prog = "func g() { $x = 5; } func f($x) { g(); return $x + 1; } f(1);"
+    assert opt(prog, level=2)[1]['specializations'] == 0
+    assert same_as_unoptimized(prog, level=2)[-1] == 6
+
+def test_specialization_semantics():
+    # Functions called by the specialized one still see its parameters
+    assert same_as_unoptimized("""
+    func inner() { return n + 1; }
+    func outer(n) { return inner() * n; }
+    outer(4);
+    """, level=2)[-1] == 20
+
+    # If the name refers to something else when the call happens, the call is left alone
+    evaluate("func f(x) { return x; }", clear_state=True, optimize=2)
+    assert evaluate("r = f(2); func f(x) { return x * 10; } r; f(2);", optimize=2) == [
+        2, None, 2, 20]
+    with pytest.raises(ProcyonTypeError):
+        evaluate("func f(x) { return x; } func h() { f = 5; return f(3); } h();",
+                 clear_state=True, optimize=2)
+    with pytest.raises(ProcyonNameError):
+        evaluate("f(3); func f(x) { return x; }", clear_state=True, optimize=2)
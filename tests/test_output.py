@@ -0,0 +1,105 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import io
+import os
+import pytest
+import procyon
+from procyon import Interpreter, Scheduler
+from procyon.output import (Sink, FileSink, FDSink, CallbackSink, MemorySink, StdoutSink,
+                            make_sink)
+from procyon.inputs import StringSource
+from procyon.common import *  # Mostly exceptions
+
+def test_print(capsys):
+    interp = Interpreter()
+    interp.evaluate('print("a", 1, 2.5, "tab\\there"); print(); print("x" + "y");')
+    assert capsys.readouterr()[0] == "a 1 2.5 tab\there\n\nxy\n"
+
+def test_buffering():
+    chunks = []
+    sink = CallbackSink(chunks.append, buffer_size=10)
+    interp = Interpreter(output=sink)
+    assert interp.output is sink and interp.sink is sink
+
+    interp.evaluate('print("abc"); print("def"); print("ghi");')
+    assert chunks == ["abc\ndef\nghi\n"]  # Passed on when the buffer filled up
+
+    interp.evaluate('print("abc");')
+    assert chunks[1:] == ["abc\n"]  # Flushed when the program ended
+
+    # Also when it fails
+    with pytest.raises(ProcyonNameError):
+        interp.evaluate('print("before"); x;')
+    assert chunks[2:] == ["before\n"]
+
+    unbuffered = []
+    Interpreter(output=CallbackSink(unbuffered.append, 0)).evaluate('print(1); print(2);')
+    assert unbuffered == ["1\n", "2\n"]
+
+def test_sinks(tmp_path):
+    memory = MemorySink()
+    Interpreter(output=memory).evaluate('print("one");')
+    Interpreter(output=memory).evaluate('print("two");')
+    assert memory.getvalue() == "one\ntwo\n"
+    memory.clear()
+    assert memory.getvalue() == ""
+
+    r, w = os.pipe()
+    try:
+        Interpreter(output=w).evaluate('print("f\\u00e9");')
+        assert os.read(r, 100) == "fé\n".encode('utf-8')
+    finally:
+        os.close(r)
+        os.close(w)
+
+    path = tmp_path / "out.txt"
+    with open(str(path), 'w') as f:
+        interp = Interpreter(output=f)
+        interp.evaluate('i = 0; while i < 3 { print(i); i += 1; }')
+        assert path.read_text() == "0\n1\n2\n"  # Flushed to the file itself, too
+
+    lines = []
+    Interpreter(output=lines.append).evaluate('print("cb");')
+    assert lines == ["cb\n"]
+
+def test_make_sink():
+    assert isinstance(make_sink(None), StdoutSink)
+    assert isinstance(make_sink(io.StringIO()), FileSink)
+    assert isinstance(make_sink(1), FDSink)
+    assert isinstance(make_sink(print), CallbackSink)
+    sink = MemorySink()
+    assert make_sink(sink) is sink
+    with pytest.raises(TypeError):
+        make_sink(1.5)
+    with pytest.raises(NotImplementedError):
+        Sink(0).write("x")
+
+def test_flush_before_input():
+    output = MemorySink()
+    seen = []
+
+    class Input(StringSource):
+        def input(self, prompt):
+            seen.append(output.getvalue())
+            return super().input(prompt)
+
+    interp = Interpreter(output=CallbackSink(output.write), input=Input("5\n"))
+    interp.evaluate('print("hello"); x = input_int(""); print(x * 2);')
+    assert seen == ["hello\n"]
+    assert output.getvalue() == "hello\n10\n"
+
+def test_programs_and_scheduler():
+    output = MemorySink()
+    procyon.compile('print(x);', output=output).run({'x': 7})
+    assert output.getvalue() == "7\n"
+
+    # Step-wise programs flush when they yield, so that output isn't reordered
+    chunks = []
+    scheduler = Scheduler(quantum=2)
+    for name in "ab":
+        scheduler.add('print("{0}1"); print("{0}2"); print("{0}3");'.format(name),
+                      Interpreter(output=CallbackSink(chunks.append)))
+    scheduler.run()
+    assert "".join(chunks) == "a1\na2\nb1\nb2\na3\nb3\n"
@@ -0,0 +1,109 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import pickle
+import pytest
+from tests_common import ev
+from procyon import parallel, compiler, interpreter
+from procyon.common import *  # Mostly exceptions
+
+@pytest.fixture(autouse=True)
+def pool(monkeypatch):
+    """ Use a fresh pool of three workers. """
+    monkeypatch.setattr(parallel, 'PMAP_WORKERS', 3)
+    monkeypatch.setattr(parallel, '_pool', None)
+    yield
+    if parallel._pool is not None:
+        parallel._pool.shutdown()
+
+def test_sum():
+    prog = """
+    func square(x) { return x * x; }
+    func add(a, b) { return a + b; }
+    pmap_reduce(square, 1, 101, add); pmap_reduce(square, 5, 6, add);
+    """
+    assert ev(prog)[-2:] == [sum(x * x for x in range(1, 101)), 25]
+
+def test_order():
+    # Concatenation is associative, but not commutative
+    prog = """
+    func first(i) { s = "0123456789"; return s if i == 0; return "x"; }
+    func concat(a, b) { return a + b; }
+    pmap_reduce(first, 0, 7, concat);
+    """
+    assert ev(prog)[-1] == "0123456789xxxxxx"
+
+def test_captured_variables():
+    prog = """
+    memo func fib(n) { if n < 2 { return n; } return fib(n - 1) + fib(n - 2); }
+    func term(i) { return fib(i) * factor + $offset + helper(); }
+    func helper() { return unused_in_caller; }
+    func add(a, b) { return a + b; }
+    func run() { factor = 2; return pmap_reduce(term, 0, 30, add); }
+    $offset = 1; unused_in_caller = 10;
+    run();
+    """
+    fib = [0, 1]
+    while len(fib) < 30:
+        fib.append(fib[-1] + fib[-2])
+    assert ev(prog)[-1] == sum(f * 2 + 1 + 10 for f in fib)
+
+def test_worker_errors():
+    prog = 'func f(x) { return x + "a" if x == 5; return x; }\n' \
+           'func add(a, b) { return a + b; }\npmap_reduce(f, 0, 10, add);'
+    with pytest.raises(ProcyonTypeError) as e:
+        ev(prog)
+    assert e.value.args[0] == (1, 22)
+
+    with pytest.raises(ProcyonNameError) as e:
+        ev("func f(x) { return y; } func add(a, b) { return a + b; } pmap_reduce(f, 0, 3, add);")
+    assert e.value.args[0] == (1, 20)
+
+@pytest.mark.parametrize('call, message', [
+    ("pmap_reduce(1, 0, 3, add)", "pmap_reduce: the first argument must be a function"),
+    ("pmap_reduce(add, 0, 3, add)", "pmap_reduce: the first argument must take 1 argument"),
+    ("pmap_reduce(f, 0, 3, f)", "pmap_reduce: the reducer must take 2 arguments"),
+    ("pmap_reduce(f, 0, 3.5, add)", "pmap_reduce: the range must be given as ints"),
+    ("pmap_reduce(f, 3, 3, add)", "pmap_reduce: empty range 3..3"),
+])
+def test_argument_errors(call, message):
+    with pytest.raises(ProcyonTypeError) as e:
+        ev("func f(x) { return x; } func add(a, b) { return a + b; } " + call + ";")
+    assert e.value.args[1] == message
+
+def test_pickled_function(monkeypatch):
+    monkeypatch.setattr(compiler, 'JIT_THRESHOLD', 1)
+    ev("func f(n) { i = 0; while i < n { i += 1; } return i; } f(3);")
+    f = interpreter._default.globals['f']
+    assert f.calls == 1 and f.compiled is not None
+
+    copy = pickle.loads(pickle.dumps(f))
+    assert copy.calls == 0 and copy.compiled is None
+    assert copy.body[1].compiled is None and copy.body[1].back_edges == 0
+
+def test_budget_shared():
+    from procyon import Interpreter
+    from procyon.budget import Budget
+    prog = """
+    func work(i) { j = 0; while j < 200 { j += 1; } return i; }
+    func add(a, b) { return a + b; }
+    pmap_reduce(work, 0, 6, add);
+    """
+    # The workers' steps are counted in the caller's budget
+    budget = Budget(steps=100000)
+    assert Interpreter(budget=budget).evaluate(prog)[-1] == 15
+    assert budget.steps_used > 6 * 200
+
+    # Together, the workers only get the steps the caller has left
+    needed = budget.steps_used
+    with pytest.raises(ProcyonStepLimitError):
+        Interpreter(budget=Budget(steps=needed * 2 // 3)).evaluate(prog)
+
+def test_close():
+    ev("func f(x) { return x; } func add(a, b) { return a + b; } pmap_reduce(f, 0, 3, add);")
+    assert parallel._pool is not None
+    parallel.close()
+    assert parallel._pool is None
+    assert ev("func f(x) { return x; } func add(a, b) { return a + b; } "
+              "pmap_reduce(f, 0, 3, add);")[-1] == 3
@@ -0,0 +1,152 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import pytest
+from tests_common import ev
+from procyon import compiler, evaluate
+from procyon.interpreter import parse
+from procyon.optimizer import optimize
+from procyon.profile import Profile, apply, node_key
+from procyon.ast import ReorderedChain, Conditional, walk
+from procyon.common import *  # Mostly exceptions
+
+CHAIN = """
+func classify(x) {
+    if x == 1 { return "one"; }
+    else if x == 2 { return "two"; }
+    else if x == 3 { return "three"; }
+    else { return "other"; }
+}
+"""
+
+def record(prog):
+    profile = Profile()
+    evaluate(prog, clear_state=True, profile_out=profile)
+    return profile
+
+def test_record():
+    prog = CHAIN + "i = 0; while i < 10 { classify(3); i += 1; } classify(1); y = 1.5; y * 2.0;"
+    profile = record(prog)
+    assert profile.matches(prog) and not profile.matches(prog + " ")
+
+    trees = parse(prog)
+    chain = trees[0].body[0]
+    assert profile.taken(chain) == 1
+    assert profile.taken(chain.else_body[0].else_body[0]) == 10
+    assert profile.calls == {"2:1:Function": 11}
+    assert list(profile.loops.values()) == [[1, 10]]
+    assert profile.result_type(trees[-1]) == 'float'
+
+def test_recording_restores_interpreter():
+    jit, osr = compiler.JIT_THRESHOLD, compiler.OSR_THRESHOLD
+    with pytest.raises(ProcyonNameError):
+        evaluate("x + 1;", clear_state=True, profile_out=Profile())
+    assert (compiler.JIT_THRESHOLD, compiler.OSR_THRESHOLD) == (jit, osr)
+    assert ev("func f(x) { if x == 1 { return 2; } return 3; } f(1); f(2);") == [None, 2, 3]
+
+def test_reorder():
+    prog = CHAIN + "i = 0; while i < 10 { classify(3); i += 1; } classify(1);"
+    profile = record(prog)
+    report = {}
+    trees = optimize(parse(prog), {}, profile=profile, report=report)
+    chain = trees[0].body[0]
+    assert isinstance(chain, ReorderedChain)
+    assert chain.order == (2, 0, 1)
+    assert report['reordered_chains'] == 1
+
+    # Without a profile, or when the profile shows the order is already the best one
+    assert not isinstance(optimize(parse(prog), {})[0].body[0], ReorderedChain)
+    profile = record(CHAIN + "classify(1); classify(1); classify(2);")
+    trees = optimize(parse(prog), {}, profile=profile)
+    assert not isinstance(trees[0].body[0], ReorderedChain)
+
+@pytest.mark.parametrize('chain', [
+    # Different variables, repeated constants, mixed types, and other operators
+    "if x == 1 { r = 1; } else if y == 2 { r = 2; } else if x == 3 { r = 3; }",
+    "if x == 1 { r = 1; } else if x == 1.0 { r = 2; }",
+    "if x == 1 { r = 1; } else if x == \"2\" { r = 2; }",
+    "if x == 1 { r = 1; } else if x < 2 { r = 2; }",
+    "if x == 1 { r = 1; } else { if x == 2 { r = 2; } r = 3; }",
+])
+def test_not_reordered(chain):
+    prog = "x = 1; y = 2; " + chain
+    profile = record(prog)
+    # Claim that the later cases are the common ones
+    conditionals = [node for node in walk(parse(prog)) if isinstance(node, Conditional)]
+    profile.branches = {node_key(node): [i, 0] for i, node in enumerate(conditionals)}
+    trees = optimize(parse(prog), {}, profile=profile)
+    assert not any(isinstance(node, ReorderedChain) for node in walk(trees))
+
+@pytest.mark.parametrize('value', ['1', '2', '3', '4', '2.0', '"a"', '"b"'])
+@pytest.mark.parametrize('threshold', [0, 1])
+def test_reordered_results(value, threshold, monkeypatch):
+    prog = CHAIN + 'i = 0; while i < 10 { classify(3); classify(2); i += 1; } classify(1);'
+    profile = record(prog)
+    monkeypatch.setattr(compiler, 'JIT_THRESHOLD', threshold)
+
+    run = prog + ' classify({});'.format(value)
+    profile.source_hash = Profile().source_hash
+    if value[0] == '"':
+        with pytest.raises(ProcyonTypeError) as expected:
+            evaluate(run, clear_state=True)
+        with pytest.raises(ProcyonTypeError) as reordered:
+            evaluate(run, clear_state=True, profile_in=record(run))
+        assert reordered.value.args == expected.value.args
+    else:
+        expected = evaluate(run, clear_state=True)
+        assert evaluate(run, clear_state=True, profile_in=record(run)) == expected
+
+def test_string_chain():
+    prog = """
+    func f(s) { r = 0; if s == "a" { r = 1; } else if s == "b" { r = 2; } return r; }
+    i = 0; while i < 5 { f("b"); i += 1; } f("a"); f("c");
+    """
+    report = {}
+    assert evaluate(prog, clear_state=True, profile_in=record(prog),
+                    report=report)[-2:] == [1, 0]
+    assert report['reordered_chains'] == 1
+    with pytest.raises(ProcyonTypeError):
+        evaluate(prog + "f(1);", clear_state=True, profile_in=record(prog + "f(1);"))
+
+def test_eager_compilation(monkeypatch):
+    monkeypatch.setattr(compiler, 'JIT_THRESHOLD', 5)
+    monkeypatch.setattr(compiler, 'OSR_THRESHOLD', 5)
+    prog = """
+    func hot(x) { return x * 1.5; }
+    func cold(x) { return x; }
+    i = 0; while i < 10 { hot(i); i += 1; } cold(1);
+    """
+    profile = record(prog)
+    trees = optimize(parse(prog), {})
+    assert apply(profile, trees) == 2
+    hot, cold, _, loop = trees[:4]
+    assert hot.compiled is not None and cold.compiled is None and loop.compiled is not None
+    assert hot.body[0].arg.type_hint == 'float'
+
+    # The compiled versions give the same results
+    report = {}
+    assert evaluate(prog, clear_state=True, profile_in=profile, report=report) == \
+        evaluate(prog, clear_state=True)
+    assert report['profile_compiled'] == 2
+
+def test_stale_profile():
+    profile = record(CHAIN + "classify(2); classify(2);")
+    report = {}
+    evaluate(CHAIN + "classify(2); classify(2); ", clear_state=True, report=report,
+             profile_in=profile)
+    assert 'reordered_chains' not in report and 'profile_compiled' not in report
+
+def test_save_and_load(tmp_path):
+    prog = CHAIN + "classify(3); classify(2.5); 2 * 3;"
+    profile = record(prog)
+    filename = str(tmp_path / "prof.json")
+    profile.save(filename)
+    loaded = Profile.load(filename)
+    assert loaded.matches(prog)
+    assert (loaded.types, loaded.branches, loaded.calls, loaded.loops) == \
+        (profile.types, profile.branches, profile.calls, profile.loops)
+
+    (tmp_path / "bad.json").write_text('{"version": 0}')
+    with pytest.raises(ValueError):
+        Profile.load(str(tmp_path / "bad.json"))
@@ -0,0 +1,77 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import io
+import pytest
+import procyon
+from procyon import compiler
+from procyon.budget import Budget
+from procyon.common import *  # Mostly exceptions
+
+def test_run():
+    prog = procyon.compile("y = x^2 + 1; y * 2;")
+    assert prog.run({'x': 3}) == [10, 20]
+    assert prog.run({'x': 0.5}, ['y']) == {'y': 1.25}
+    assert prog.run({'x': 2, 'z': 1}, ['x', 'y']) == {'x': 2, 'y': 5}
+
+    # Each run starts over, without the earlier runs' variables
+    with pytest.raises(ProcyonNameError):
+        prog.run()
+    with pytest.raises(ProcyonNameError):
+        prog.run({'x': 1}, ['z'])
+
+def test_globals_and_functions():
+    prog = procyon.compile("""
+        func scale(v) { return v * $factor; }
+        if greeting != "" { print(greeting); }
+        total = scale(a) + scale(b);""", output=io.StringIO())
+    values = prog.run({'$factor': 10, 'a': 1, 'b': 2, 'greeting': "hi"}, ['total', '$factor'])
+    assert values == {'total': 30, '$factor': 10}
+    assert prog.run({'$factor': 1, 'a': 1, 'b': 2, 'greeting': ""}, ['total']) == {'total': 3}
+    assert prog.interpreter.output.getvalue() == "hi\n"
+
+def test_bad_bindings():
+    prog = procyon.compile("x;")
+    for value in (None, True, [1], procyon):
+        with pytest.raises(ProcyonTypeError):
+            prog.run({'x': value})
+
+    # Names are checked as assignments in a program are
+    for name in ('sin', 'print', 'a b', '', '1x', 'if', '$', 1):
+        with pytest.raises(ProcyonTypeError):
+            prog.run({name: 1, 'x': 2})
+    with pytest.raises(ProcyonTypeError) as e:
+        prog.run({'sin': 1})
+    assert e.value.args[1] == 'cannot assign to built-in function "sin"'
+    assert prog.run({'memo': 1, '$y': 2, '_x1': 3, 'x': 4}) == [4]
+
+def test_syntax_error():
+    with pytest.raises(ProcyonSyntaxError):
+        procyon.compile("x = ;")
+    assert procyon.compile("  ").run() == []
+
+def test_compiled_state_kept(monkeypatch):
+    # Hot functions stay compiled, and memo caches stay filled, from run to run
+    monkeypatch.setattr(compiler, 'JIT_THRESHOLD', 5)
+    prog = procyon.compile("""
+        memo func fib(n) { if n < 2 { return n; } return fib(n - 1) + fib(n - 2); }
+        func f(n) { return n + 1; }
+        i = 0; while i < 10 { f(i); i += 1; }
+        r = fib(k);""")
+    assert prog.run({'k': 30}, ['r']) == {'r': 832040}
+    fib = prog.interpreter.globals['fib']
+    f = prog.interpreter.globals['f']
+    assert f.compiled is not None
+    misses = fib.cache.misses
+
+    assert prog.run({'k': 20}, ['r']) == {'r': 6765}
+    assert prog.interpreter.globals['fib'] is fib
+    assert fib.cache.misses == misses
+
+def test_budget():
+    prog = procyon.compile("while n > 0 { n -= 1; }", budget=Budget(steps=1000))
+    prog.run({'n': 10})
+    with pytest.raises(ProcyonStepLimitError):
+        prog.run({'n': 10000})
+    prog.run({'n': 10})  # The budget restarts for every run
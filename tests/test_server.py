@@ -0,0 +1,75 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import os
+import socket
+import subprocess
+import sys
+import time
+import pytest
+from procyon.server import Client
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX') or not hasattr(os, 'fork'),
+                                reason="server mode needs Unix sockets and fork()")
+
+PROCYON = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'procyon.py')
+
+def connect(path, timeout=10):
+    """ Connect to a server that is starting up. """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return Client(path)
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+@pytest.fixture
+def server(tmp_path):
+    library = tmp_path / "lib.pr"
+    library.write_text("func sq(x) { return x * x; }\nlimit = 10;\n")
+    path = str(tmp_path / "procyon.sock")
+    proc = subprocess.Popen([sys.executable, PROCYON, '--serve', path, '--jobs', '2',
+                             str(library)], stderr=subprocess.PIPE)
+    yield path
+    proc.terminate()
+    assert proc.wait(timeout=10) == 0
+    assert not os.path.exists(path)
+
+def test_programs(server):
+    with connect(server) as client:
+        entry = client.run('print(sq(limit)); x = 5; sq(x);')
+        assert entry['results'] == [None, 5, 25] and entry['output'] == "100\n"
+        # Each program starts over with just the library
+        assert client.run('x;')['error'] == {'type': 'NameError',
+                                             'message': 'unknown identifier "x"',
+                                             'line': 1, 'column': 1}
+        assert client.run('limit = 3; limit;')['results'] == [3, 3]
+        assert client.run('limit;')['results'] == [10]
+
+def test_errors(server):
+    with connect(server) as client:
+        assert client.run('1 +')['error']['type'] == 'SyntaxError'
+        assert client.run('input_int("x");')['error']['type'] == 'EOFError'
+        client.file.write(b'{"program": 1}\n')
+        client.file.flush()
+        assert b'RequestError' in client.file.readline()
+        assert client.run('sq(2);')['results'] == [4]
+
+def test_concurrent_clients(server):
+    clients = [connect(server) for i in range(2)]
+    for i in range(10):
+        for n, client in enumerate(clients):
+            assert client.run('sq({});'.format(i + n))['results'] == [(i + n) ** 2]
+    for client in clients:
+        client.close()
+
+def test_bad_library(tmp_path):
+    library = tmp_path / "lib.pr"
+    library.write_text("func f() {\n  1 + ;\n}")
+    proc = subprocess.run([sys.executable, PROCYON, '--serve', str(tmp_path / "s.sock"),
+                           str(library)], stderr=subprocess.PIPE, universal_newlines=True)
+    assert proc.returncode == 1
+    assert "Unable to load library {}:2:7".format(library) in proc.stderr
@@ -0,0 +1,107 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import io
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from tests_common import ev
+from procyon import Interpreter
+from procyon.common import *  # Mostly exceptions
+
+# Uses globals, functions reading their caller's variables, memo functions, and loops and
+# functions that run long enough to be compiled
+PROGRAM = """
+$seed = {n};
+memo func fib(k) {{ if k < 2 {{ return k; }} return fib(k - 1) + fib(k - 2); }}
+func scaled(x) {{ return x * factor + $seed; }}
+func total(count) {{
+    factor = 3; t = 0; i = 0;
+    while i < count {{ t += scaled(i % 7); i += 1; }}
+    return t;
+}}
+print("run", $seed);
+total(1500) + fib($seed % 40);
+"""
+
+def expected(n):
+    fib = [0, 1]
+    while len(fib) < 40:
+        fib.append(fib[-1] + fib[-2])
+    return sum((i % 7) * 3 + n for i in range(1500)) + fib[n % 40]
+
+def run(n):
+    output = io.StringIO()
+    interp = Interpreter(output=output)
+    result = interp.evaluate(PROGRAM.format(n=n))[-1]
+    return result, output.getvalue(), interp.globals['$seed']
+
+def test_stress():
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(run, range(64)))
+
+    for n, (result, output, seed) in enumerate(results):
+        assert result == expected(n)
+        assert output == "run {}\n".format(n)
+        assert seed == n
+
+def test_independent_state():
+    a, b = Interpreter(), Interpreter()
+    a.evaluate("x = 1; $g = 2;")
+    with pytest.raises(ProcyonNameError):
+        b.evaluate("x;")
+    assert b.evaluate("$g = 3; x = 4;") == [3, 4]
+    assert a.evaluate("x + $g;") == [3]
+
+    # The default interpreter (used by evaluate()) is separate as well
+    with pytest.raises(ProcyonNameError):
+        ev("x;")
+
+    a.reset()
+    with pytest.raises(ProcyonNameError):
+        a.evaluate("x;")
+
+def test_independent_settings(tmp_path, monkeypatch):
+    from procyon import cache, compiler, memo
+    programs = cache.ProgramCache()
+    store = memo.MemoStore(str(tmp_path / "memo.db"))
+    try:
+        a = Interpreter(program_cache=programs, memo_store=store, jit_threshold=2,
+                        osr_threshold=0)
+        b = Interpreter()
+        assert (b.program_cache, b.memo_store) == (cache.programs, memo.store)
+        monkeypatch.setattr(compiler, 'JIT_THRESHOLD', 7)
+        assert (a.jit_threshold, b.jit_threshold) == (2, 7)
+
+        prog = """
+        memo func sq(n) { return n * n; }
+        func f(n) { i = 0; while i < 3000 { i += 1; } return n; }
+        f(1); f(2); sq(4);
+        """
+        a.evaluate(prog)
+        assert len(programs) == 1 and len(store) == 1
+        f = a.globals['f']
+        assert f.compiled is not None and f.body[1].compiled is None  # No OSR
+
+        assert cache.programs.get(prog, 1) is None
+        b.evaluate(prog)
+        assert b.globals['f'].compiled is None and cache.programs.get(prog, 1) is not None
+        assert len(programs) == 1 and len(store) == 1
+    finally:
+        store.close()
+
+def test_shared_interpreter():
+    # Programs sent to the same interpreter from several threads run one at a time
+    interp = Interpreter()
+    interp.evaluate("$count = 0; func add(n) { i = 0; while i < n { $count += 1; i += 1; } }")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: interp.evaluate("add(500);"), range(16)))
+    assert interp.globals['$count'] == 16 * 500
+
+def test_error_positions():
+    # Each interpreter counts lines from 1 in every program
+    interp = Interpreter()
+    interp.evaluate("x = 1;\ny = 2;\n")
+    with pytest.raises(ProcyonNameError) as e:
+        interp.evaluate("\nundefined;")
+    assert e.value.args[0] == (2, 1)
@@ -0,0 +1,99 @@
+# Requires pytest; install with "pip install pytest" (as root) if pip is available
+
+# vim: ts=4 sts=4 et sw=4
+
+import pytest
+import procyon
+from procyon.budget import Budget
+from procyon.common import *  # Mostly exceptions
+
+np = pytest.importorskip("numpy")
+
+SOURCE = """
+func f(x, y) {
+    if x > 0.5 && y != 0 { z = sin(x) * y; }
+    else if x < 0.2 || !(y < 3) { return -x ^ 2; }
+    else { z = sqrt(x) + pi; }
+    return z / 2 + floor(x * 10) % 3 + (0 < x <= 0.3);
+}
+func inv(x) { return 1 / x; }
+func sum_to(n) { s = 0; while n > 0 { s += n; n -= 1; } return s; }
+func maybe(x) { if x > 0 { w = 1.5; } return w; }
+"""
+
+def scalar(name, *args):
+    call = "{}({});".format(name, ", ".join(repr(float(a)) for a in args))
+    return procyon.evaluate(SOURCE + call, True)[-1]
+
+@pytest.fixture
+def program():
+    return procyon.compile(SOURCE)
+
+def test_vectorized(program):
+    f = program.vectorize('f')
+    x = np.linspace(0, 1, 101)
+    for y in (0.0, 2.0, 5.0):
+        result = f(x, y)
+        assert result.shape == x.shape
+        assert result == pytest.approx([scalar('f', a, y) for a in x], rel=1e-12)
+    assert (f.vectorized, f.fallbacks) == (3, 0)
+
+    # Arguments are broadcast
+    assert f(np.full((2, 3), 0.7), np.array([1.0, 0.0, 4.0])).shape == (2, 3)
+    assert f.vectorized == 4
+
+def test_fallbacks(program):
+    # Ints run element by element, with Procyon's ints
+    f = program.vectorize('f')
+    assert f(np.arange(3), 1).tolist() == [scalar('f', a, 1) for a in range(3)]
+    assert (f.vectorized, f.fallbacks) == (0, 1)
+
+    # Unsupported constructs
+    sum_to = program.vectorize('sum_to')
+    assert not sum_to.supported
+    assert sum_to(np.array([3.0, 4.0])).tolist() == [6, 10]
+
+    # Errors are raised as by a call
+    inv = program.vectorize('inv')
+    assert inv(np.array([1.0, 4.0])).tolist() == [1, 0.25]
+    with pytest.raises(ZeroDivisionError):
+        inv(np.array([1.0, 0.0]))
+    assert (inv.vectorized, inv.fallbacks) == (1, 1)
+
+    maybe = program.vectorize('maybe')
+    assert maybe(np.array([1.0, 2.0])).tolist() == [1.5, 1.5]
+    with pytest.raises(ProcyonNameError):
+        maybe(np.array([1.0, -2.0]))
+
+def test_exact_ints():
+    # Parts that don't depend on the arguments are evaluated with Procyon's ints
+    f = procyon.compile("func f(x) { return (3^40 % 7) * x; }").vectorize('f')
+    assert f(np.array([1.0, 2.0])).tolist() == [4.0, 8.0]
+    g = procyon.compile("""
+    func g(x) { if x > 0.5 { return 2^60 + 1 - 2^60; } return x; }
+    """).vectorize('g')
+    assert g(np.array([0.7, 0.2])).tolist() == [1.0, 0.2]
+    assert (f.vectorized, g.vectorized) == (1, 1)
+
+    # Ints that may be larger than 2^53 are calculated element by element
+    h = procyon.compile("""
+    func h(x) { y = 2^30; z = y * y * y; return z + 1 - z + x; }
+    """).vectorize('h')
+    assert h(np.array([0.5, 0.25])).tolist() == [1.5, 1.25]
+    assert (h.vectorized, h.fallbacks) == (0, 1)
+    k = procyon.compile("func k(x) { return 2^54 + x; }").vectorize('k')
+    k(np.array([0.5]))
+    assert (k.vectorized, k.fallbacks) == (0, 1)
+
+def test_errors(program):
+    with pytest.raises(ProcyonNameError):
+        program.vectorize('g')
+    with pytest.raises(ProcyonTypeError):
+        program.vectorize('f')(np.ones(3))
+
+    budgeted = procyon.compile(SOURCE, budget=Budget(steps=100))
+    f = budgeted.vectorize('f')
+    f(np.array([0.1, 0.9]), 1.0)
+    assert f.vectorized == 0
+    with pytest.raises(ProcyonStepLimitError):
+        f(np.linspace(0, 1, 100), 1.0)